@@ -0,0 +1,89 @@
+"""
+树构建基准测试：对比build_tree/sort_nodes_by_parent与原先逐项扫描全表的实现。
+用法: python benchmarks/bench_tree.py [--sizes 1000,5000,10000,20000,50000] [--legacy-max 5000]
+每行输出单位节点耗时(us/item)，线性实现在各规模下应基本持平。
+"""
+import argparse
+import os
+import random
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'workflow'))
+
+from workflow.libs.utils.common_util import build_tree, sort_nodes_by_parent  # noqa: E402
+
+
+def make_items(size, fanout=8, seed=0):
+    """生成一棵随机树：每个节点挂在之前的某个节点下，约1/fanout的节点为根"""
+    rnd = random.Random(seed)
+    items = []
+    for i in range(1, size + 1):
+        parent_id = None if i == 1 or rnd.random() < 1 / fanout / 10 else rnd.randint(max(1, i - fanout * 10), i - 1)
+        items.append({'id': i, 'parent_id': parent_id, 'rank': rnd.randint(0, 10)})
+    return items
+
+
+def make_chain(size):
+    """生成一条深度为size的单链，用于验证没有递归深度限制"""
+    return [{'id': i, 'parent_id': i - 1 if i > 1 else None} for i in range(1, size + 1)]
+
+
+def legacy_build_tree(items):
+    tree = [item for item in items if item['parent_id'] is None]
+    for item in items:
+        item['children'] = [c for c in items if item['id'] == c['parent_id']]
+    return tree
+
+
+def legacy_sort_nodes_by_parent(nodes):
+    parent_map = {node['id']: node for node in nodes}
+
+    def get_children(node_id):
+        return [node for node in nodes if node['parent_id'] == node_id]
+
+    def dfs(node_id):
+        result.append(parent_map[node_id])
+        for child in get_children(node_id):
+            dfs(child['id'])
+
+    result = []
+    for root in [node for node in nodes if node['parent_id'] is None]:
+        dfs(root['id'])
+    return result
+
+
+def timeit(func, items, repeat=3):
+    best = None
+    for _ in range(repeat):
+        data = [dict(item) for item in items]
+        start = time.perf_counter()
+        func(data)
+        elapsed = time.perf_counter() - start
+        best = elapsed if best is None else min(best, elapsed)
+    return best
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--sizes', default='1000,5000,10000,20000,50000')
+    parser.add_argument('--legacy-max', type=int, default=5000, help='原实现为平方复杂度，超过该规模不再运行')
+    args = parser.parse_args()
+
+    print(f"{'func':<24}{'size':>8}{'total(ms)':>12}{'us/item':>10}")
+    for size in [int(s) for s in args.sizes.split(',')]:
+        items = sorted(make_items(size), key=lambda item: (item['rank'], item['id']))
+        cases = [('build_tree', build_tree), ('sort_nodes_by_parent', sort_nodes_by_parent)]
+        if size <= args.legacy_max:
+            cases += [('legacy_build_tree', legacy_build_tree), ('legacy_sort_nodes', legacy_sort_nodes_by_parent)]
+        for name, func in cases:
+            elapsed = timeit(func, items)
+            print(f"{name:<24}{size:>8}{elapsed * 1000:>12.2f}{elapsed / size * 1e6:>10.2f}")
+
+    depth = max(int(s) for s in args.sizes.split(','))
+    elapsed = timeit(sort_nodes_by_parent, make_chain(depth), repeat=1)
+    print(f"{'sort_nodes (chain)':<24}{depth:>8}{elapsed * 1000:>12.2f}{elapsed / depth * 1e6:>10.2f}")
+
+
+if __name__ == '__main__':
+    main()
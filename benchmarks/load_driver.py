@@ -0,0 +1,159 @@
+"""
+本地压测脚本：按比例回放 创建事件/我的事件列表/待我审批/审批通过 请求，统计各接口的延迟分位数(p50/p95/p99)和吞吐。
+只依赖标准库，可离线运行。先生成数据并启动服务（SQLite或本地MySQL均可），例如：
+    export DATABASE_ENGINE=sqlite DATABASE_NAME=/tmp/load.sqlite3
+    python manage.py makemigrations && python manage.py migrate
+    python manage.py generate_load_data --events 100000
+    python manage.py runserver 127.0.0.1:8000 --noreload --nothreading
+然后：
+    python benchmarks/load_driver.py --base-url http://127.0.0.1:8000 --users 100 --concurrency 8 --duration 60
+SQLite同一时间只允许一个写事务，先读后写的请求事务并发时会直接报database is locked，因此须以--nothreading串行处理请求；
+评估uwsgi进程/线程数（uwsgi.ini中workers=4 threads=2）时应使用本地MySQL，--concurrency与workers*threads对应。
+"""
+import argparse
+import http.client
+import json
+import random
+import threading
+import time
+import urllib.parse
+from collections import defaultdict
+
+
+class Client(object):
+    """每个压测线程一个长连接"""
+
+    def __init__(self, base_url, timeout):
+        url = urllib.parse.urlsplit(base_url)
+        self.host, self.port, self.timeout = url.hostname, url.port or 80, timeout
+        self.conn = None
+
+    def request(self, method, path, token=None, data=None):
+        headers = {'Content-Type': 'application/json'}
+        if token:
+            headers['Authorization'] = f'Token {token}'
+        body = json.dumps(data) if data is not None else None
+        for retry in range(2):
+            if self.conn is None:
+                self.conn = http.client.HTTPConnection(self.host, self.port, timeout=self.timeout)
+            try:
+                self.conn.request(method, path, body=body, headers=headers)
+                response = self.conn.getresponse()
+                content = response.read()
+                return response.status, json.loads(content) if content and response.getheader('Content-Type', '').startswith('application/json') else None
+            except (http.client.HTTPException, ConnectionError):
+                self.conn.close()
+                self.conn = None
+                if retry:
+                    raise
+
+
+class Stats(object):
+
+    def __init__(self):
+        self.latencies = defaultdict(list)
+        self.errors = defaultdict(int)
+        self.lock = threading.Lock()
+
+    def record(self, name, elapsed, ok):
+        with self.lock:
+            self.latencies[name].append(elapsed)
+            if not ok:
+                self.errors[name] += 1
+
+    @staticmethod
+    def percentile(values, p):
+        return values[min(len(values) - 1, int(len(values) * p / 100))]
+
+    def report(self, duration):
+        print(f"{'endpoint':<12}{'requests':>10}{'errors':>8}{'rps':>10}{'p50(ms)':>10}{'p95(ms)':>10}{'p99(ms)':>10}{'max(ms)':>10}")
+        for name in sorted(self.latencies):
+            values = sorted(self.latencies[name])
+            print(f"{name:<12}{len(values):>10}{self.errors[name]:>8}{len(values) / duration:>10.1f}"
+                  + ''.join(f'{self.percentile(values, p) * 1000:>10.1f}' for p in (50, 95, 99)) + f'{values[-1] * 1000:>10.1f}')
+
+
+class LoadDriver(object):
+
+    def __init__(self, args):
+        self.args = args
+        self.prefix = urllib.parse.urlsplit(args.base_url).path.rstrip('/') + '/api/v1'
+        self.stats = Stats()
+        self.mix = []
+        for item in args.mix.split(','):
+            name, weight = item.split('=')
+            self.mix += [name] * int(weight)
+
+    def setup(self):
+        client = Client(self.args.base_url, self.args.timeout)
+        self.users = []
+        for i in range(self.args.users):
+            status, data = client.request('POST', f'{self.prefix}/user/login/',
+                                          data={'username': f'{self.args.prefix}_user{i}', 'password': self.args.password})
+            if status == 200:
+                self.users.append((data['id'], data['token']))
+        if not self.users:
+            raise SystemExit('没有可登录的压测用户，请先执行 python manage.py generate_load_data')
+        status, data = client.request('GET', f'{self.prefix}/workflow/workflows/?search={self.args.prefix}_&page_size=100', self.users[0][1])
+        self.workflow_ids = [workflow['id'] for workflow in data['results']]
+        print(f'已登录{len(self.users)}个用户，{len(self.workflow_ids)}个工作流')
+
+    def timed(self, client, name, method, path, token, data=None):
+        start = time.perf_counter()
+        try:
+            status, body = client.request(method, path, token, data)
+        except (OSError, http.client.HTTPException):
+            status, body = 0, None
+        self.stats.record(name, time.perf_counter() - start, 200 <= status < 300)
+        return status, body
+
+    def run_once(self, client, rnd):
+        user_id, token = rnd.choice(self.users)
+        operation = rnd.choice(self.mix)
+        if operation == 'create':
+            data = {'requester_id': user_id, 'workflow_id': rnd.choice(self.workflow_ids), 'form_fields': {'days': rnd.randint(0, 7)}}
+            self.timed(client, 'create', 'POST', f'{self.prefix}/workflow/workflow_events/', token, data)
+        elif operation == 'list':
+            self.timed(client, 'list', 'GET', f'{self.prefix}/workflow/workflow_events/my_event/?page_size=20', token)
+        elif operation in ('inbox', 'approve'):
+            status, data = self.timed(client, 'inbox', 'GET', f'{self.prefix}/workflow/workflow_nodes/inbox/?page_size=20', token)
+            if operation == 'approve' and status == 200 and data['results']:
+                node_id = rnd.choice(data['results'])['id']
+                self.timed(client, 'approve', 'POST', f'{self.prefix}/workflow/workflow_nodes/{node_id}/approve/', token, {'comment': 'load'})
+        else:
+            raise SystemExit(f'未知的操作：{operation}')
+
+    def worker(self, index, deadline):
+        client = Client(self.args.base_url, self.args.timeout)
+        rnd = random.Random(self.args.seed + index)
+        while time.monotonic() < deadline:
+            self.run_once(client, rnd)
+
+    def run(self):
+        self.setup()
+        start = time.monotonic()
+        deadline = start + self.args.duration
+        threads = [threading.Thread(target=self.worker, args=(i, deadline)) for i in range(self.args.concurrency)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self.stats.report(time.monotonic() - start)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--base-url', default='http://127.0.0.1:8000')
+    parser.add_argument('--prefix', default='load', help='generate_load_data使用的数据前缀')
+    parser.add_argument('--password', default='load123456', help='generate_load_data使用的用户密码')
+    parser.add_argument('--users', type=int, default=100, help='登录并轮流使用的用户数量')
+    parser.add_argument('--concurrency', type=int, default=8, help='并发线程数，对应uwsgi workers*threads')
+    parser.add_argument('--duration', type=int, default=60, help='压测时长（秒）')
+    parser.add_argument('--mix', default='create=2,list=4,inbox=3,approve=1', help='各操作的权重')
+    parser.add_argument('--timeout', type=float, default=30)
+    parser.add_argument('--seed', type=int, default=0)
+    LoadDriver(parser.parse_args()).run()
+
+
+if __name__ == '__main__':
+    main()
@@ -5,14 +5,22 @@ python manage.py collectstatic --noinput
 python manage.py makemigrations --noinput
 python manage.py migrate
 
-if [ "$ENABLE_CELERY_WORKER" == 'true' ]
+# /metrics的多进程计数目录，重启时清空
+export METRICS_DIR=${METRICS_DIR:-/tmp/workflow_metrics}
+rm -rf "$METRICS_DIR" && mkdir -p "$METRICS_DIR"
+
+# 发件箱通知投递worker（审批通过/驳回邮件等）
+if [ "$ENABLE_OUTBOX_WORKER" != 'false' ]
 then
-  celery worker -A workflow.celery_app -l info --logfile='logs/celery_worker.log' &
+  mkdir -p logs
+  python manage.py run_outbox_worker >> logs/outbox_worker.log 2>&1 &
 fi
 
-if [ "$ENABLE_CELERY_BEAT" == 'true' ]
+# 审批统计增量汇总（统计接口读取的汇总表）
+if [ "$ENABLE_STATS_WORKER" != 'false' ]
 then
-  celery beat -A workflow.celery_app -l info --logfile='logs/celery_beat.log' --pidfile= &
+  mkdir -p logs
+  python manage.py rollup_stats >> logs/rollup_stats.log 2>&1 &
 fi
 
 uwsgi --ini /data/server/run/uwsgi.ini
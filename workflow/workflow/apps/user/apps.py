@@ -8,3 +8,4 @@ class UserConfig(AppConfig):
 
     def ready(self):
         super().ready()
+        from . import signals
@@ -1,8 +1,15 @@
+import threading
+from contextlib import contextmanager
+
 from django.contrib.auth.models import AbstractUser, Group
 from django.db import models
+from django.utils import timezone
+
+from workflow.libs.utils.cache_util import LRUCache
+from workflow.libs.utils.common_util import build_tree
 
 
-__all__ = ['User', 'Department', 'Menu']
+__all__ = ['User', 'Department', 'Menu', 'ResourceVersion']
 
 
 class User(AbstractUser):
@@ -26,6 +33,15 @@ class Department(models.Model):
         return self.name
 
 
+# 用户的角色ID。本进程内由User.groups的m2m信号清除，其他进程等待过期
+USER_ROLE_CACHE_SIZE = 4096
+USER_ROLE_CACHE_TTL = 60
+_user_role_cache = LRUCache(maxsize=USER_ROLE_CACHE_SIZE, ttl=USER_ROLE_CACHE_TTL)
+# 按角色集合缓存的菜单树，key为(角色ID元组, 菜单资源版本)，菜单或菜单角色变更后版本递增，旧缓存自然失效
+MENU_TREE_CACHE_SIZE = 1024
+_menu_tree_cache = LRUCache(maxsize=MENU_TREE_CACHE_SIZE)
+
+
 class Menu(models.Model):
     """菜单/按钮模型，菜单宽泛讲也算是一种按钮，所以共用一张表，也方便前端router配置"""
     class Type(models.TextChoices):
@@ -52,3 +68,98 @@ class Menu(models.Model):
 
     def __str__(self):
         return self.name
+
+    @classmethod
+    def get_user_role_ids(cls, user_id):
+        """用户的角色ID元组（升序）"""
+        return _user_role_cache.get_or_set(user_id, lambda: tuple(sorted(
+            User.groups.through.objects.filter(user_id=user_id).values_list('group_id', flat=True))))
+
+    @classmethod
+    def invalidate_user_roles(cls, user_ids=None):
+        """清除本进程中用户的角色缓存，user_ids为None时全部清除"""
+        if user_ids is None:
+            _user_role_cache.clear()
+        for user_id in user_ids or ():
+            _user_role_cache.pop(user_id)
+
+    @classmethod
+    def build_tree(cls, role_ids):
+        """角色集合可见的菜单树：多个角色共有的菜单只出现一次，同级按rank排列"""
+        from .serializers import MenuSerializer
+        menus = cls.objects.filter(id__in=cls.roles.through.objects.filter(group_id__in=role_ids).values('menu_id'))
+        menus = menus.select_related('parent').prefetch_related('roles').order_by('rank', 'id')
+        return build_tree(MenuSerializer(menus, many=True).data)
+
+    @classmethod
+    def get_tree(cls, role_ids, version):
+        """按(角色集合, 菜单资源版本)缓存的菜单树，多个请求共用，调用方不应修改"""
+        return _menu_tree_cache.get_or_set((tuple(role_ids), version), lambda: cls.build_tree(role_ids))
+
+    @classmethod
+    def invalidate_trees(cls):
+        _menu_tree_cache.clear()
+
+
+_bump_local = threading.local()  # ResourceVersion.collect()上下文中待递增的资源
+
+
+class ResourceVersion(models.Model):
+    """
+    定义类数据（菜单、工作流及其表单/审批链、组件）的版本号，数据写入时在同一事务中递增（见signals），
+    接口据此生成ETag/Last-Modified，支持条件GET
+    """
+    MENU = 'menu'
+    WORKFLOW = 'workflow'  # 工作流、表单字段、审批链
+    COMPONENT = 'component'
+
+    name = models.CharField(max_length=64, unique=True, verbose_name='资源名称')
+    version = models.PositiveBigIntegerField(default=1, verbose_name='版本号')
+    update_time = models.DateTimeField(default=timezone.now, verbose_name='更新时间')
+
+    class Meta:
+        db_table = 'wf_resource_version'
+        verbose_name = '资源版本'
+        verbose_name_plural = verbose_name
+
+    def __str__(self):
+        return f'{self.name}-{self.version}'
+
+    @classmethod
+    @contextmanager
+    def collect(cls):
+        """批量替换表单/审批链等场景下，将上下文中逐行信号产生的递增合并，结束时每个资源只递增一次"""
+        previous = getattr(_bump_local, 'names', None)
+        _bump_local.names = set()
+        try:
+            yield
+            names = _bump_local.names
+        finally:
+            _bump_local.names = previous
+        if previous is not None:
+            previous.update(names)
+            return
+        for name in sorted(names):
+            cls.bump(name)
+
+    @classmethod
+    def bump(cls, name):
+        """递增资源版本，在写入数据的事务中调用，事务回滚时版本不变；在collect()上下文中时延后到上下文结束"""
+        names = getattr(_bump_local, 'names', None)
+        if names is not None:
+            names.add(name)
+            return
+        now = timezone.now()
+        if cls.objects.filter(name=name).update(version=models.F('version') + 1, update_time=now):
+            return
+        _, created = cls.objects.get_or_create(name=name, defaults={'update_time': now})
+        if not created:  # 并发首次写入，对方已创建
+            cls.objects.filter(name=name).update(version=models.F('version') + 1, update_time=now)
+
+    @classmethod
+    def get_versions(cls, names):
+        """{资源名称: (版本号, 更新时间)}，从未写入过的资源为(0, None)"""
+        versions = {name: (0, None) for name in names}
+        for name, version, update_time in cls.objects.filter(name__in=names).values_list('name', 'version', 'update_time'):
+            versions[name] = (version, update_time)
+        return versions
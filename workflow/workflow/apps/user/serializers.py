@@ -2,6 +2,7 @@ from django.contrib.auth.models import Group
 from rest_framework import serializers
 from rest_framework.serializers import ModelSerializer
 
+from workflow.libs.frameworks.serializers import BulkManyRelatedField
 from .models import *
 
 
@@ -32,6 +33,8 @@ class MenuTinySerializer(ModelSerializer):
 class MenuSerializer(ModelSerializer):
     parent_id = serializers.IntegerField(allow_null=True, required=False, label='父级菜单ID')
     parent = MenuTinySerializer(read_only=True, label='父级菜单')
+    roles = BulkManyRelatedField(child_relation=serializers.PrimaryKeyRelatedField(queryset=Group.objects.all()),
+                                 required=False, label='角色')
 
     class Meta:
         model = Menu
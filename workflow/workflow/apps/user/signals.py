@@ -0,0 +1,63 @@
+from django.contrib.auth.models import Group
+from django.db import transaction
+from django.dispatch import receiver
+from django.db.models.signals import post_save, post_delete, m2m_changed
+from rest_framework.authtoken.models import Token
+
+from workflow.libs.frameworks.authentication import invalidate_tokens
+from .models import User, Menu, ResourceVersion
+
+
+"""====================信号捕获==================="""
+# 菜单及其角色变更时递增菜单资源版本（各进程的菜单树缓存随之失效），角色删除会级联删除菜单与角色、用户与角色的关联
+# （不发送m2m_changed），同样需要处理
+
+
+@receiver(post_save, sender=Menu)
+@receiver(post_delete, sender=Menu)
+def on_menu_changed(sender, **kwargs):
+    ResourceVersion.bump(ResourceVersion.MENU)
+    transaction.on_commit(Menu.invalidate_trees)
+
+
+@receiver(m2m_changed, sender=Menu.roles.through)
+def on_menu_roles_changed(sender, action, **kwargs):
+    if action in ('post_add', 'post_remove', 'post_clear'):
+        ResourceVersion.bump(ResourceVersion.MENU)
+        transaction.on_commit(Menu.invalidate_trees)
+
+
+@receiver(post_delete, sender=Group)
+def on_role_deleted(sender, **kwargs):
+    ResourceVersion.bump(ResourceVersion.MENU)
+    transaction.on_commit(Menu.invalidate_trees)
+    transaction.on_commit(Menu.invalidate_user_roles)
+
+
+@receiver(m2m_changed, sender=User.groups.through)
+def on_user_roles_changed(sender, instance, action, reverse, pk_set, **kwargs):
+    """用户与角色关系变更后清除用户的角色缓存：reverse为True时instance为角色，pk_set为用户ID"""
+    if action not in ('post_add', 'post_remove', 'post_clear'):
+        return
+    if not reverse:
+        user_ids = [instance.pk]
+    else:
+        user_ids = None if action == 'post_clear' else list(pk_set)
+    transaction.on_commit(lambda: Menu.invalidate_user_roles(user_ids))
+
+
+@receiver(post_delete, sender=Token)
+def on_token_deleted(sender, instance, **kwargs):
+    """token删除或重新生成（删除后新建）后，旧token立即失效"""
+    key = instance.key
+    transaction.on_commit(lambda: invalidate_tokens([key]))
+
+
+@receiver(post_save, sender=User)
+def on_user_saved(sender, instance, created, **kwargs):
+    """用户禁用或信息修改后，清除缓存中该用户token解析出的用户对象"""
+    if created:
+        return
+    keys = list(Token.objects.filter(user_id=instance.pk).values_list('key', flat=True))
+    if keys:
+        transaction.on_commit(lambda: invalidate_tokens(keys))
@@ -1,3 +1,242 @@
-from django.test import TestCase
+from django.contrib.auth.models import Group
+from django.core.cache import cache
+from django.test import TestCase, override_settings
+from rest_framework.test import APIClient
 
-# Create your tests here.
+from rest_framework.authtoken.models import Token
+
+from workflow.libs.frameworks import authentication
+from workflow.libs.utils.test_util import QueryBudgetMixin
+from . import models
+from .models import *
+
+
+class CacheIsolatedTestCase(TestCase):
+    """进程内缓存的key含数据库ID和资源版本，测试回滚后会被复用，每个测试前后都须清除"""
+
+    @staticmethod
+    def clear_process_caches():
+        models._user_role_cache.clear()
+        models._menu_tree_cache.clear()
+        authentication._token_cache.clear()
+
+    def setUp(self):
+        super(CacheIsolatedTestCase, self).setUp()
+        self.clear_process_caches()
+        self.addCleanup(self.clear_process_caches)
+
+
+class EndpointQueryBudgetMixin(QueryBudgetMixin):
+    """
+    用户接口的SQL查询数预算，数据规模由scale控制：
+    scale个用户和角色，每个角色下有一个顶级菜单及两个子菜单，当前用户属于所有角色
+    """
+    client_class = APIClient
+    prefix = '/api/v1/user'
+
+    @classmethod
+    def setUpTestData(cls):
+        n = cls.scale
+        cls.user = User.objects.create_user(username='admin', password='admin')
+        User.objects.bulk_create([User(username=f'user{i}') for i in range(n)])
+        for i in range(n):
+            role = Group.objects.create(name=f'role{i}')
+            role.user_set.add(cls.user)
+            parent = Menu.objects.create(name=f'菜单{i}', code=f'menu{i}', path=f'/menu{i}', rank=i)
+            parent.roles.add(role)
+            for j in range(2):
+                child = Menu.objects.create(name=f'菜单{i}-{j}', code=f'menu{i}-{j}', path=f'menu{i}-{j}', rank=j, parent=parent)
+                child.roles.add(role)
+        cls.menu = Menu.objects.filter(parent__isnull=False).first()
+
+    def setUp(self):
+        super(EndpointQueryBudgetMixin, self).setUp()
+        self.client.force_authenticate(self.user)
+
+    def test_login(self):
+        self.client.force_authenticate(None)
+        self.assertQueryBudget(7, 'post', f'{self.prefix}/login/', {'username': 'admin', 'password': 'admin'})
+
+    def test_user_endpoints(self):
+        self.assertQueryBudget(3, 'get', f'{self.prefix}/users/')
+        self.assertQueryBudget(3, 'get', f'{self.prefix}/users/{self.user.id}/')
+        self.assertQueryBudget(3, 'get', f'{self.prefix}/roles/')
+
+    def test_menu_endpoints(self):
+        # 比未做条件GET时多一次资源版本查询
+        self.assertQueryBudget(5, 'get', f'{self.prefix}/menus/')
+        self.assertQueryBudget(5, 'get', f'{self.prefix}/menus/{self.menu.id}/')
+        # 菜单树：资源版本、当前用户角色、菜单及其角色，之后角色和菜单树都命中缓存，只查询资源版本
+        response = self.assertQueryBudget(6, 'get', f'{self.prefix}/menus/menu_tree/')
+        self.assertQueryBudget(3, 'get', f'{self.prefix}/menus/menu_tree/')
+        self.assertQueryBudget(3, 'get', f'{self.prefix}/menus/menu_tree/', status_code=304, HTTP_IF_NONE_MATCH=response['ETag'])
+
+
+    def test_user_writes(self):
+        user = User.objects.get(username='user0')
+        self.assertQueryBudget(5, 'patch', f'{self.prefix}/users/{user.id}/', {'email': 'user0@example.com'})
+        self.assertQueryBudget(6, 'put', f'{self.prefix}/users/{user.id}/', {'username': 'user0', 'email': 'user0@example.com'})
+        self.assertQueryBudget(18, 'delete', f'{self.prefix}/users/{user.id}/', status_code=204)  # 级联查询各关联表
+
+    def test_menu_writes(self):
+        parent = Menu.objects.filter(parent__isnull=True).first()
+        roles = list(Group.objects.values_list('id', flat=True))
+        data = {'name': '新菜单', 'code': 'new', 'path': 'new', 'parent_id': parent.id, 'roles': roles}
+        response = self.assertQueryBudget(12, 'post', f'{self.prefix}/menus/', data)  # 一次查询校验全部角色
+        self.assertQueryBudget(7, 'patch', f'{self.prefix}/menus/{self.menu.id}/', {'name': '改名'})
+        self.assertQueryBudget(10, 'put', f'{self.prefix}/menus/{response.data["id"]}/', dict(data, name='改名'))
+        self.assertEqual(self.client.get(f'{self.prefix}/menus/{response.data["id"]}/').data['roles'], roles)
+        self.assertEqual(self.client.post(f'{self.prefix}/menus/', dict(data, code='other', roles=[0]), format='json').status_code, 400)
+        self.assertQueryBudget(10, 'delete', f'{self.prefix}/menus/{parent.id}/', status_code=204)  # 级联删除子菜单
+
+class MenuConditionalGetTestCase(CacheIsolatedTestCase):
+    client_class = APIClient
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create_user(username='admin', password='admin')
+        cls.role = Group.objects.create(name='role')
+        cls.role.user_set.add(cls.user)
+        cls.menu = Menu.objects.create(name='菜单', code='menu', path='/menu')
+        cls.menu.roles.add(cls.role)
+
+    def setUp(self):
+        super(MenuConditionalGetTestCase, self).setUp()
+        self.client.force_authenticate(self.user)
+
+    def get_etag(self, url='/api/v1/user/menus/menu_tree/'):
+        response = self.client.get(url)
+        self.assertEqual(response.status_code, 200)
+        return response['ETag']
+
+    def test_etag_changes_on_write(self):
+        etag = self.get_etag()
+        self.assertEqual(self.client.get('/api/v1/user/menus/menu_tree/', HTTP_IF_NONE_MATCH=etag).status_code, 304)
+        self.client.patch(f'/api/v1/user/menus/{self.menu.id}/', {'name': '新菜单'}, format='json')
+        self.assertNotEqual(self.get_etag(), etag)
+        etag = self.get_etag()
+        self.menu.roles.clear()
+        self.assertNotEqual(self.get_etag(), etag)
+
+    def test_etag_varies_by_role(self):
+        etag = self.get_etag()
+        other = User.objects.create_user(username='other', password='other')
+        self.client.force_authenticate(other)
+        self.assertEqual(self.client.get('/api/v1/user/menus/menu_tree/', HTTP_IF_NONE_MATCH=etag).status_code, 200)
+        self.assertEqual(self.client.get('/api/v1/user/menus/', HTTP_IF_NONE_MATCH=self.get_etag('/api/v1/user/menus/')).status_code, 304)
+
+
+class MenuTreeCacheTestCase(CacheIsolatedTestCase):
+    client_class = APIClient
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create_user(username='admin', password='admin')
+        cls.roles = [Group.objects.create(name=f'role{i}') for i in range(2)]
+        cls.user.groups.add(*cls.roles)
+        cls.parent = Menu.objects.create(name='系统', code='system', path='/system', rank=2)
+        cls.parent.roles.add(*cls.roles)
+        for rank in (1, 0):
+            Menu.objects.create(name=f'菜单{rank}', code=f'menu{rank}', path=f'menu{rank}', rank=rank, parent=cls.parent).roles.add(*cls.roles)
+        cls.other = Menu.objects.create(name='其他', code='other', path='/other', rank=1)
+        cls.other.roles.add(cls.roles[1])
+
+    def setUp(self):
+        super(MenuTreeCacheTestCase, self).setUp()
+        self.client.force_authenticate(self.user)
+
+    def get_tree(self):
+        return self.client.get('/api/v1/user/menus/menu_tree/').data
+
+    def test_deduplicated_and_ordered(self):
+        tree = self.get_tree()
+        self.assertEqual([menu['code'] for menu in tree], ['other', 'system'])
+        self.assertEqual([menu['code'] for menu in tree[1]['children']], ['menu0', 'menu1'])
+
+    def test_invalidated_by_signals(self):
+        self.get_tree()
+        with self.captureOnCommitCallbacks(execute=True):
+            self.user.groups.remove(self.roles[1])
+        self.assertEqual([menu['code'] for menu in self.get_tree()], ['system'])
+        with self.captureOnCommitCallbacks(execute=True):
+            self.other.roles.add(self.roles[0])
+        self.assertEqual([menu['code'] for menu in self.get_tree()], ['other', 'system'])
+        with self.captureOnCommitCallbacks(execute=True):
+            Menu.objects.filter(id=self.other.id).first().delete()
+        self.assertEqual([menu['code'] for menu in self.get_tree()], ['system'])
+
+
+class CachedTokenAuthenticationTestCase(CacheIsolatedTestCase):
+    client_class = APIClient
+
+    def setUp(self):
+        super(CachedTokenAuthenticationTestCase, self).setUp()
+        self.user = User.objects.create_user(username='admin', password='admin')
+        token = self.client.post('/api/v1/user/login/', {'username': 'admin', 'password': 'admin'}, format='json').data['token']
+        self.client.credentials(HTTP_AUTHORIZATION=f'Token {token}')
+
+    def get_status(self):
+        return self.client.get(f'/api/v1/user/users/{self.user.id}/').status_code
+
+    def counts(self):
+        values = authentication.token_auth_cache.values
+        return values.get(('hit',), 0), values.get(('miss',), 0)
+
+    def test_cached(self):
+        hits, misses = self.counts()
+        self.assertEqual(self.get_status(), 200)
+        with self.assertNumQueries(3):  # 只有用户查询，外加savepoint
+            self.assertEqual(self.get_status(), 200)
+        self.assertEqual(self.counts(), (hits + 1, misses + 1))
+
+    @override_settings(TOKEN_AUTH_SHARED_CACHE='default')
+    def test_shared_cache(self):
+        self.addCleanup(cache.clear)
+        self.assertEqual(self.get_status(), 200)
+        authentication._token_cache.clear()  # 模拟另一个进程
+        hits, misses = self.counts()
+        self.assertEqual(self.get_status(), 200)
+        self.assertEqual(self.counts(), (hits + 1, misses))
+        with self.captureOnCommitCallbacks(execute=True):
+            Token.objects.filter(user=self.user).delete()
+        self.assertEqual(self.get_status(), 401)
+
+    @override_settings(TOKEN_AUTH_SHARED_CACHE='default')
+    def test_shared_cache_revokes_in_other_processes(self):
+        self.addCleanup(cache.clear)
+        self.assertEqual(self.get_status(), 200)
+        token = Token.objects.get(user=self.user)
+        with self.captureOnCommitCallbacks(execute=True):
+            self.user.is_active = False
+            self.user.save()
+        authentication._token_cache.set(token.key, (self.user, token))  # 另一个进程的本地缓存中仍有该token，signals清除不到
+        self.assertEqual(self.get_status(), 401)
+
+        self.user.is_active = True
+        self.user.save()
+        self.assertEqual(self.get_status(), 200)
+        with self.captureOnCommitCallbacks(execute=True):
+            token.delete()
+        authentication._token_cache.set(token.key, (self.user, token))
+        self.assertEqual(self.get_status(), 401)
+
+    def test_invalidated_on_token_delete(self):
+        self.assertEqual(self.get_status(), 200)
+        with self.captureOnCommitCallbacks(execute=True):
+            Token.objects.filter(user=self.user).delete()
+        self.assertEqual(self.get_status(), 401)
+
+    def test_invalidated_on_user_deactivated(self):
+        self.assertEqual(self.get_status(), 200)
+        with self.captureOnCommitCallbacks(execute=True):
+            self.user.is_active = False
+            self.user.save()
+        self.assertEqual(self.get_status(), 401)
+
+
+class SmallEndpointQueryBudgetTestCase(EndpointQueryBudgetMixin, CacheIsolatedTestCase):
+    scale = 2
+
+
+class LargeEndpointQueryBudgetTestCase(EndpointQueryBudgetMixin, CacheIsolatedTestCase):
+    scale = 8
@@ -6,6 +6,8 @@ from rest_framework.decorators import action
 from rest_framework.response import Response
 from rest_framework.viewsets import ModelViewSet, GenericViewSet
 
+from workflow.libs.frameworks.views import ConditionalGetMixin
+from workflow.libs.utils.common_util import build_tree
 from .models import *
 from .serializers import *
 
@@ -39,21 +41,37 @@ class RoleViewSet(mixins.ListModelMixin,
     serializer_class = RoleSerializer
 
 
-class MenuViewSet(ModelViewSet):
+class MenuViewSet(ConditionalGetMixin, ModelViewSet):
+    conditional_resources = (ResourceVersion.MENU,)
+    conditional_actions = ('list', 'retrieve', 'menu_tree')
     ordering_fields = ('name', 'code')
     filter_fields = ()
     search_fields = filter_fields
 
-    queryset = Menu.objects.all()
+    queryset = Menu.objects.select_related('parent').prefetch_related('roles')
     serializer_class = MenuSerializer
 
+    def get_conditional_vary(self, request):
+        if self.action == 'menu_tree':  # 菜单树按当前用户的角色过滤
+            return Menu.get_user_role_ids(request.user.id)
+        return ''
+
+    def perform_destroy(self, instance):
+        with ResourceVersion.collect():  # 级联删除子菜单时逐行信号的版本递增合并为一次
+            instance.delete()
+
     @action(methods=['get'], detail=False, url_path='menu_tree', name='menu_tree')
     def menu_tree(self, request, **kwargs):
-        """菜单树"""
-        roles = request.user.groups.all()
-        menus_queryset = self.filter_queryset(queryset=self.queryset).filter(roles__in=roles)
+        """菜单树，按角色集合缓存；带查询参数（搜索/排序）时不走缓存"""
+        role_ids = Menu.get_user_role_ids(request.user.id)
+        if not request.query_params:
+            version, _ = self.conditional_versions[ResourceVersion.MENU]
+            return Response(data=Menu.get_tree(role_ids, version), status=status.HTTP_200_OK)
+
+        menus_queryset = self.filter_queryset(queryset=self.queryset).filter(
+            id__in=Menu.roles.through.objects.filter(group_id__in=role_ids).values('menu_id'))
+        if not menus_queryset.ordered:  # 未指定排序时，同级菜单按rank排列
+            menus_queryset = menus_queryset.order_by('rank', 'id')
         menus = self.serializer_class(menus_queryset, many=True).data
-        tree = [menu for menu in menus if menu['parent_id'] is None]
-        for menu in menus:
-            menu['children'] = [m for m in menus if menu['id'] == m['parent_id']]
+        tree = build_tree(menus)
         return Response(data=tree, status=status.HTTP_200_OK)
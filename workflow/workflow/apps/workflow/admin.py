@@ -10,3 +10,6 @@ admin.site.register(Workflow)
 admin.site.register(WorkflowChain)
 admin.site.register(WorkflowNode)
 admin.site.register(WorkflowEvent)
+admin.site.register(OutboxMessage)
+admin.site.register(ArchivedWorkflowEvent)
+admin.site.register(StatWatermark)
@@ -0,0 +1,275 @@
+"""
+审批统计汇总。
+rollup按水位线增量读取上次汇总之后新发起的事件（create_time）、审批完成的节点（WorkflowNode.finish_time）和
+审批人的处理记录（NodeApprover.action_time），累加到(工作流, 日期)、(审批人, 工作流, 日期)的每日统计表，并刷新当前积压。
+读取窗口的上界比当前时间早lag秒：时间戳在审批事务中生成、提交稍晚，留出余量避免漏掉尚未提交的数据。
+首次汇总（没有水位线）时连同归档表一起计算全部历史：finish_time上线前已完成的节点以最后更新时间（action_time）补齐；
+审批人处理时间上线前的记录没有action_time，不计入审批人统计。
+节点的action_time随任意保存（如修改备注）刷新，不能作为增量读取或进入审批的依据，统一使用只写一次的finish_time。
+rollup_stats命令定期调用，统计接口（WorkflowStatViewSet）只读汇总表，耗时与历史数据量无关。
+"""
+import datetime
+from collections import Counter, defaultdict
+
+from django.db import transaction
+from django.db.models import Count, F, Min, Sum
+from django.db.models.functions import Coalesce
+from django.utils import timezone
+
+from .models import WorkflowEvent, WorkflowNode, NodeApprover, ArchivedWorkflowEvent, ArchivedWorkflowNode, ArchivedNodeApprover
+from .models import WorkflowDailyStat, ApproverDailyStat, WorkflowBacklog, ApproverBacklog, StatWatermark
+from .models import Action, State
+from .archive import FINISHED_STATES
+
+__all__ = ['WATERMARK_NAME', 'rollup', 'rebuild', 'refresh_backlog', 'workflow_summary', 'workflow_daily', 'approver_summary']
+
+WATERMARK_NAME = 'approval'
+CHUNK_SIZE = 2000
+
+HOT_MODELS = (WorkflowEvent, WorkflowNode, NodeApprover)
+ARCHIVE_MODELS = (ArchivedWorkflowEvent, ArchivedWorkflowNode, ArchivedNodeApprover)
+
+
+def _time_range(field, start, end):
+    """(start, end]，start为None时不限下界"""
+    lookups = {f'{field}__lte': end}
+    if start is not None:
+        lookups[f'{field}__gt'] = start
+    return lookups
+
+
+def _chunks(queryset, size=CHUNK_SIZE):
+    chunk = []
+    for row in queryset.iterator(chunk_size=size):
+        chunk.append(row)
+        if len(chunk) == size:
+            yield chunk
+            chunk = []
+    if chunk:
+        yield chunk
+
+
+def _start_times(node_model, rows):
+    """节点进入审批的时间：首节点为创建时间，其余为父节点审批通过的时间。rows: [(parent_id, create_time), ...]"""
+    parent_ids = {parent_id for parent_id, _ in rows if parent_id}
+    parent_times = dict(node_model.objects.filter(id__in=parent_ids).values_list('id', 'finish_time')) if parent_ids else {}
+    return [parent_times.get(parent_id) or create_time for parent_id, create_time in rows]
+
+
+class Deltas(object):
+    """一次汇总中各统计行的增量，key为统计表的唯一键"""
+
+    def __init__(self):
+        self.workflow = defaultdict(Counter)  # (workflow_id, day): {字段: 增量}
+        self.approver = defaultdict(Counter)  # (approver_id, workflow_id, day): {字段: 增量}
+
+    def collect_events(self, event_model, start, end):
+        queryset = event_model.objects.filter(**_time_range('create_time', start, end)).values_list('workflow_id', 'create_time')
+        for workflow_id, create_time in queryset.iterator(chunk_size=CHUNK_SIZE):
+            self.workflow[(workflow_id, timezone.localdate(create_time))]['events_created'] += 1
+
+    def collect_nodes(self, node_model, start, end):
+        """审批完成（通过/驳回）的节点；节点驳回即事件驳回，最后一个节点（没有子节点）通过即事件通过"""
+        queryset = node_model.objects.filter(state__in=FINISHED_STATES, **_time_range('finish_time', start, end)).values_list(
+            'id', 'parent_id', 'create_time', 'state', 'finish_time', 'event__workflow_id')
+        for chunk in _chunks(queryset):
+            starts = _start_times(node_model, [(row[1], row[2]) for row in chunk])
+            parent_ids = set(node_model.objects.filter(parent_id__in=[row[0] for row in chunk]).values_list('parent_id', flat=True))
+            for (node_id, _, _, state, finish_time, workflow_id), start_time in zip(chunk, starts):
+                delta = self.workflow[(workflow_id, timezone.localdate(finish_time))]
+                if state == State.REJECTED:
+                    delta['nodes_rejected'] += 1
+                    delta['events_rejected'] += 1
+                    continue
+                delta['nodes_approved'] += 1
+                delta['approve_seconds'] += (finish_time - start_time).total_seconds()
+                if node_id not in parent_ids:
+                    delta['events_approved'] += 1
+
+    def collect_approvers(self, approver_model, node_model, start, end):
+        queryset = approver_model.objects.filter(
+            action__in=[Action.APPROVED, Action.REJECTED], **_time_range('action_time', start, end)).values_list(
+            'node__parent_id', 'node__create_time', 'approver_id', 'action', 'action_time', 'node__event__workflow_id')
+        for chunk in _chunks(queryset):
+            starts = _start_times(node_model, [(row[0], row[1]) for row in chunk])
+            for (_, _, approver_id, action, action_time, workflow_id), start_time in zip(chunk, starts):
+                delta = self.approver[(approver_id, workflow_id, timezone.localdate(action_time))]
+                delta['approved' if action == Action.APPROVED else 'rejected'] += 1
+                delta['response_seconds'] += (action_time - start_time).total_seconds()
+
+    def collect(self, models, start, end):
+        event_model, node_model, approver_model = models
+        self.collect_events(event_model, start, end)
+        self.collect_nodes(node_model, start, end)
+        self.collect_approvers(approver_model, node_model, start, end)
+
+    @staticmethod
+    def apply_to(model, key_fields, deltas):
+        """将增量累加到统计表：已有的行批量更新，没有的批量插入"""
+        if not deltas:
+            return
+        lookups = {f'{name}__in': {key[i] for key in deltas} for i, name in enumerate(key_fields)}
+        existing = {tuple(getattr(row, name) for name in key_fields): row for row in model.objects.filter(**lookups)}
+        created, updated = [], []
+        for key, delta in deltas.items():
+            row = existing.get(key)
+            if row is None:
+                row = model(**dict(zip(key_fields, key)))
+                created.append(row)
+            else:
+                updated.append(row)
+            for field, value in delta.items():
+                setattr(row, field, getattr(row, field) + value)
+        model.objects.bulk_create(created, batch_size=1000)
+        fields = sorted({field for delta in deltas.values() for field in delta})
+        model.objects.bulk_update(updated, fields, batch_size=1000)
+
+    def apply(self):
+        self.apply_to(WorkflowDailyStat, ('workflow_id', 'day'), self.workflow)
+        self.apply_to(ApproverDailyStat, ('approver_id', 'workflow_id', 'day'), self.approver)
+
+
+def refresh_backlog():
+    """按审批中的节点重新计算积压，扫描量与积压数量成正比；等待时间从节点进入审批算起（同_start_times）"""
+    workflow_rows = WorkflowNode.objects.filter(state=State.PROCESSING).order_by().values_list('event__workflow_id').annotate(
+        count=Count('id'), oldest=Min(Coalesce('parent__finish_time', 'create_time')))
+    approver_rows = NodeApprover.objects.filter(node__state=State.PROCESSING, action=Action.PENDING).order_by().values_list(
+        'approver_id').annotate(count=Count('id'), oldest=Min(Coalesce('node__parent__finish_time', 'node__create_time')))
+    WorkflowBacklog.objects.all().delete()
+    WorkflowBacklog.objects.bulk_create([
+        WorkflowBacklog(workflow_id=workflow_id, processing_nodes=count, oldest_time=oldest) for workflow_id, count, oldest in workflow_rows
+    ])
+    ApproverBacklog.objects.all().delete()
+    ApproverBacklog.objects.bulk_create([
+        ApproverBacklog(approver_id=approver_id, pending_nodes=count, oldest_time=oldest) for approver_id, count, oldest in approver_rows
+    ])
+
+
+def _fill_finish_time():
+    """finish_time上线前已完成的节点没有审批完成时间，以最后更新时间补齐（只在首次汇总时执行）"""
+    for node_model in (WorkflowNode, ArchivedWorkflowNode):
+        node_model.objects.filter(state__in=FINISHED_STATES, finish_time__isnull=True).update(finish_time=F('action_time'))
+
+
+def rollup(lag=60, now=None):
+    """
+    汇总水位线之后、now-lag（含）之前的数据并推进水位线，返回新的水位线。
+    水位线行加锁，多个进程同时汇总时串行执行；首次汇总并发创建水位线时，后者因唯一键冲突回滚
+    """
+    end = (now or timezone.now()) - datetime.timedelta(seconds=lag)
+    with transaction.atomic():
+        watermark = StatWatermark.objects.select_for_update().filter(name=WATERMARK_NAME).first()
+        start = watermark.value if watermark else None
+        if start is not None and end <= start:
+            return start
+        if start is None:
+            _fill_finish_time()
+        deltas = Deltas()
+        deltas.collect(HOT_MODELS, start, end)
+        if start is None:
+            deltas.collect(ARCHIVE_MODELS, start, end)
+        deltas.apply()
+        refresh_backlog()
+        if watermark is None:
+            watermark = StatWatermark(name=WATERMARK_NAME)
+        watermark.value = end
+        watermark.save()
+    return end
+
+
+def rebuild(lag=60, now=None):
+    """清空汇总表和水位线后重新计算全部历史（如修正了统计口径）"""
+    with transaction.atomic():
+        StatWatermark.objects.select_for_update().filter(name=WATERMARK_NAME).delete()
+        WorkflowDailyStat.objects.all().delete()
+        ApproverDailyStat.objects.all().delete()
+        return rollup(lag, now)
+
+
+"""====================读取==================="""
+
+
+def _ratio(numerator, denominator, digits=4):
+    return round(numerator / denominator, digits) if denominator else None
+
+
+def workflow_summary(start, end, workflow_id=None):
+    """[start, end]日期范围内各工作流的汇总，附带当前积压"""
+    daily = WorkflowDailyStat.objects.filter(day__range=(start, end))
+    backlogs = WorkflowBacklog.objects.select_related('workflow')
+    if workflow_id is not None:
+        daily, backlogs = daily.filter(workflow_id=workflow_id), backlogs.filter(workflow_id=workflow_id)
+    rows = daily.order_by().values('workflow_id', 'workflow__name').annotate(
+        events_created=Sum('events_created'), events_approved=Sum('events_approved'), events_rejected=Sum('events_rejected'),
+        nodes_approved=Sum('nodes_approved'), nodes_rejected=Sum('nodes_rejected'), approve_seconds=Sum('approve_seconds'))
+    results = {}
+    for row in rows:
+        results[row['workflow_id']] = {
+            'workflow_id': row['workflow_id'],
+            'workflow_name': row.pop('workflow__name'),
+            'events_created': row['events_created'],
+            'events_approved': row['events_approved'],
+            'events_rejected': row['events_rejected'],
+            'nodes_approved': row['nodes_approved'],
+            'nodes_rejected': row['nodes_rejected'],
+            'avg_approve_seconds': _ratio(row['approve_seconds'], row['nodes_approved'], 1),
+            'rejection_rate': _ratio(row['events_rejected'], row['events_approved'] + row['events_rejected']),
+        }
+    empty = dict.fromkeys(['events_created', 'events_approved', 'events_rejected', 'nodes_approved', 'nodes_rejected'], 0)
+    for backlog in backlogs:
+        result = results.setdefault(backlog.workflow_id, dict(
+            empty, workflow_id=backlog.workflow_id, workflow_name=backlog.workflow.name, avg_approve_seconds=None, rejection_rate=None))
+        result.update(processing_nodes=backlog.processing_nodes, oldest_processing_time=backlog.oldest_time)
+    for result in results.values():
+        result.setdefault('processing_nodes', 0)
+        result.setdefault('oldest_processing_time', None)
+    return [results[key] for key in sorted(results)]
+
+
+def workflow_daily(start, end, workflow_id=None):
+    """[start, end]日期范围内按天的趋势，未指定工作流时为所有工作流之和"""
+    daily = WorkflowDailyStat.objects.filter(day__range=(start, end))
+    if workflow_id is not None:
+        daily = daily.filter(workflow_id=workflow_id)
+    rows = daily.order_by('day').values('day').annotate(
+        events_created=Sum('events_created'), events_approved=Sum('events_approved'), events_rejected=Sum('events_rejected'),
+        nodes_approved=Sum('nodes_approved'), nodes_rejected=Sum('nodes_rejected'), approve_seconds=Sum('approve_seconds'))
+    for row in rows:
+        row['avg_approve_seconds'] = _ratio(row.pop('approve_seconds'), row['nodes_approved'], 1)
+        row['rejection_rate'] = _ratio(row['events_rejected'], row['events_approved'] + row['events_rejected'])
+    return list(rows)
+
+
+def approver_summary(start, end, workflow_id=None, approver_id=None):
+    """[start, end]日期范围内各审批人的汇总，pending_nodes为当前所有工作流中待其审批的节点数"""
+    daily = ApproverDailyStat.objects.filter(day__range=(start, end))
+    backlogs = ApproverBacklog.objects.select_related('approver')
+    if workflow_id is not None:
+        daily = daily.filter(workflow_id=workflow_id)
+    if approver_id is not None:
+        daily, backlogs = daily.filter(approver_id=approver_id), backlogs.filter(approver_id=approver_id)
+    rows = daily.order_by().values('approver_id', 'approver__username').annotate(
+        approved=Sum('approved'), rejected=Sum('rejected'), response_seconds=Sum('response_seconds'))
+    results = {}
+    for row in rows:
+        handled = row['approved'] + row['rejected']
+        results[row['approver_id']] = {
+            'approver_id': row['approver_id'],
+            'username': row['approver__username'],
+            'approved': row['approved'],
+            'rejected': row['rejected'],
+            'avg_response_seconds': _ratio(row['response_seconds'], handled, 1),
+            'rejection_rate': _ratio(row['rejected'], handled),
+        }
+    for backlog in backlogs:
+        if backlog.approver_id not in results and workflow_id is not None:
+            continue  # 按工作流统计时只列出在该工作流中处理过审批的人
+        result = results.setdefault(backlog.approver_id, {
+            'approver_id': backlog.approver_id, 'username': backlog.approver.username,
+            'approved': 0, 'rejected': 0, 'avg_response_seconds': None, 'rejection_rate': None,
+        })
+        result.update(pending_nodes=backlog.pending_nodes, oldest_pending_time=backlog.oldest_time)
+    for result in results.values():
+        result.setdefault('pending_nodes', 0)
+        result.setdefault('oldest_pending_time', None)
+    return [results[key] for key in sorted(results)]
@@ -0,0 +1,93 @@
+"""
+冷热分离。
+已结束（通过/驳回）且结束时间早于保留期的事件，连同审批节点、审批人由archive_batch移入归档表，
+热表只保留在途及近期结束的事件，审批、待我审批使用的索引规模与在途审批数量成正比。
+archive_events命令按批循环调用，每批一个事务；读取时通过ArchiveInclusiveList合并热表和归档表（见WorkflowEventViewSet的include_archived参数）。
+"""
+import functools
+import heapq
+import itertools
+
+from django.db import transaction
+from django.utils import timezone
+
+from .models import WorkflowEvent, WorkflowNode, NodeApprover, ArchivedWorkflowEvent, ArchivedWorkflowNode, ArchivedNodeApprover
+from .models import State
+
+__all__ = ['FINISHED_STATES', 'archive_batch', 'ArchiveInclusiveList']
+
+FINISHED_STATES = (State.APPROVED, State.REJECTED)
+
+
+def _copy(instance, model, **extra):
+    """按字段属性名（如requester_id）复制到归档模型，ID保持不变"""
+    return model(**{f.attname: getattr(instance, f.attname) for f in type(instance)._meta.concrete_fields}, **extra)
+
+
+def archive_batch(before, batch_size=500):
+    """归档一批结束时间早于before的事件，返回归档的事件数量，为0时表示已没有可归档的事件"""
+    with transaction.atomic():
+        # 走(state, create_time)索引，创建时间不晚于结束时间，同时过滤update_time保证结束时间早于before
+        events = list(WorkflowEvent.objects.select_for_update().filter(
+            state__in=FINISHED_STATES, create_time__lt=before, update_time__lt=before)[:batch_size])
+        if not events:
+            return 0
+        # 归档事件一定带有进度快照，读取归档事件时不需要查询归档节点表
+        WorkflowEvent.load_node_process([event for event in events if event.progress is None])
+        for event in events:
+            if event.progress is None:
+                event.progress = event._node_process
+
+        event_ids = [event.id for event in events]
+        nodes = list(WorkflowNode.objects.filter(event_id__in=event_ids))
+        node_ids = [node.id for node in nodes]
+        approvers = list(NodeApprover.objects.filter(node_id__in=node_ids))
+
+        now = timezone.now()
+        ArchivedWorkflowEvent.objects.bulk_create([_copy(event, ArchivedWorkflowEvent, archive_time=now) for event in events])
+        ArchivedWorkflowNode.objects.bulk_create([_copy(node, ArchivedWorkflowNode) for node in nodes])
+        ArchivedNodeApprover.objects.bulk_create([_copy(approver, ArchivedNodeApprover) for approver in approvers])
+
+        NodeApprover.objects.filter(id__in=[approver.id for approver in approvers]).delete()
+        WorkflowNode.objects.filter(id__in=node_ids).update(parent=None)  # 先断开父子关系，删除时无需逐个置空
+        WorkflowNode.objects.filter(id__in=node_ids).delete()
+        WorkflowEvent.objects.filter(id__in=event_ids).delete()
+    return len(events)
+
+
+class ArchiveInclusiveList(object):
+    """
+    按相同过滤条件和排序合并热表与归档表的事件，供分页器使用（支持count()和切片）。
+    取第n页时两边各取前n页的数据归并，与OFFSET翻页的扫描量相当
+    """
+    ordered = True
+
+    def __init__(self, hot_queryset, archive_queryset, default_ordering=('-create_time', '-id')):
+        ordering = list(hot_queryset.query.order_by) or list(default_ordering)
+        if not any(field.lstrip('-') in ('id', 'pk') for field in ordering):
+            ordering.append('-id')  # 保证排序稳定
+        self.ordering = ordering
+        self.querysets = [hot_queryset.order_by(*ordering), archive_queryset.order_by(*ordering)]
+
+    def count(self):
+        return sum(queryset.count() for queryset in self.querysets)
+
+    def compare(self, a, b):
+        for field in self.ordering:
+            name = field.lstrip('-')
+            x, y = getattr(a, name), getattr(b, name)
+            if x != y:
+                result = -1 if x < y else 1
+                return -result if field.startswith('-') else result
+        return 0
+
+    def __getitem__(self, item):
+        if not isinstance(item, slice):
+            return self[item:item + 1][0]
+        start, stop = item.start or 0, item.stop
+        key = functools.cmp_to_key(self.compare)
+        sources = [queryset[:stop] if stop is not None else queryset for queryset in self.querysets]
+        return list(itertools.islice(heapq.merge(*sources, key=key), start, stop))
+
+    def __len__(self):
+        return self.count()
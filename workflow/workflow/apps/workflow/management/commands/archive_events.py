@@ -0,0 +1,34 @@
+import datetime
+import time
+
+from django.core.management.base import BaseCommand
+from django.db import close_old_connections
+from django.utils import timezone
+
+from workflow.apps.workflow import archive
+
+
+class Command(BaseCommand):
+    help = '将结束超过保留期的工作流事件（通过/驳回）连同审批节点、审批人按批移入归档表，每批一个事务'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--days', type=int, default=180, help='保留期（天），结束时间早于该天数的事件被归档')
+        parser.add_argument('--batch-size', type=int, default=500, help='每批归档的事件数量')
+        parser.add_argument('--max-batches', type=int, default=0, help='最多归档的批数，0为不限制')
+        parser.add_argument('--sleep', type=float, default=0.0, help='每批之间的间隔（秒），降低对在线业务的影响')
+
+    def handle(self, *args, **options):
+        before = timezone.now() - datetime.timedelta(days=options['days'])
+        total = batches = 0
+        try:
+            while not options['max_batches'] or batches < options['max_batches']:
+                close_old_connections()
+                archived = archive.archive_batch(before, options['batch_size'])
+                total += archived
+                batches += 1
+                if archived < options['batch_size']:
+                    break
+                time.sleep(options['sleep'])
+        except KeyboardInterrupt:
+            pass
+        self.stdout.write(self.style.SUCCESS(f'共归档{total}个事件'))
@@ -0,0 +1,47 @@
+from django.core.management.base import BaseCommand, CommandError
+from django.db import transaction
+
+from workflow.apps.workflow.models import WorkflowEvent
+
+
+class Command(BaseCommand):
+    help = '回填/校验工作流事件的审批进度快照(WorkflowEvent.progress)'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=500, help='每批处理的事件数量')
+        parser.add_argument('--verify', action='store_true', help='只校验快照与实际进度是否一致，不写入')
+        parser.add_argument('--missing-only', action='store_true', help='只处理尚无快照的事件')
+
+    def handle(self, *args, **options):
+        batch_size, verify = options['batch_size'], options['verify']
+        queryset = WorkflowEvent.objects.only('id', 'progress').order_by('id')
+        if options['missing_only']:
+            queryset = queryset.filter(progress__isnull=True)
+
+        checked = mismatched = 0
+        last_id = 0
+        while True:
+            # 锁定本批事件后再计算并写入，审批（同样先锁事件）在此期间排队，不会被旧的进度覆盖
+            with transaction.atomic():
+                events = list(queryset.select_for_update().filter(id__gt=last_id)[:batch_size])
+                if not events:
+                    break
+                last_id = events[-1].id
+                WorkflowEvent.load_node_process(events)
+                stale = [event for event in events if event.progress != event._node_process]
+                checked += len(events)
+                mismatched += len(stale)
+                if verify:
+                    for event in stale:
+                        self.stdout.write(f'事件{event.id}的进度快照不一致')
+                    continue
+                for event in stale:
+                    event.progress = event._node_process
+                WorkflowEvent.objects.bulk_update(stale, ['progress'])
+
+        if verify:
+            if mismatched:
+                raise CommandError(f'共校验{checked}个事件，{mismatched}个快照不一致')
+            self.stdout.write(self.style.SUCCESS(f'共校验{checked}个事件，快照均一致'))
+        else:
+            self.stdout.write(self.style.SUCCESS(f'共检查{checked}个事件，更新{mismatched}个快照'))
@@ -0,0 +1,140 @@
+import datetime
+import random
+
+from django.contrib.auth.hashers import make_password
+from django.contrib.auth.models import Group
+from django.core.management.base import BaseCommand, CommandError
+from django.db import transaction
+from django.utils import timezone
+
+from workflow.apps.user.models import User, Department
+from workflow.apps.workflow.models import Component, FormField, Workflow, WorkflowChain, WorkflowEvent, WorkflowNode, NodeApprover
+from workflow.apps.workflow.models import Action, State
+from workflow.apps.workflow.routing import get_routing_plan, ApproverResolver
+from workflow.apps.workflow.serializers import WorkflowEventBulkSerializer
+
+
+class Command(BaseCommand):
+    help = '生成压测数据：用户、部门、角色、带条件分支审批链的工作流，以及批量的工作流事件/审批节点/审批人'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--prefix', default='load', help='生成数据的名称前缀，同一前缀只能生成一次')
+        parser.add_argument('--password', default='load123456', help='生成用户的登录密码，压测脚本使用')
+        parser.add_argument('--users', type=int, default=1000, help='用户数量')
+        parser.add_argument('--departments', type=int, default=20, help='部门数量')
+        parser.add_argument('--roles', type=int, default=20, help='角色数量')
+        parser.add_argument('--role-size', type=int, default=10, help='每个角色的成员数量')
+        parser.add_argument('--workflows', type=int, default=10, help='工作流数量')
+        parser.add_argument('--events', type=int, default=100000, help='工作流事件数量')
+        parser.add_argument('--finished-ratio', type=float, default=0.6, help='已审批完成（通过/驳回）的事件比例')
+        parser.add_argument('--days', type=int, default=90, help='事件创建时间分布在最近多少天内')
+        parser.add_argument('--batch-size', type=int, default=2000, help='每批插入的事件数量')
+        parser.add_argument('--seed', type=int, default=0, help='随机数种子，相同参数和种子生成相同的数据')
+
+    def handle(self, *args, **options):
+        self.rnd = random.Random(options['seed'])
+        self.prefix = options['prefix']
+        if User.objects.filter(username__startswith=f'{self.prefix}_').exists():
+            raise CommandError(f'前缀为{self.prefix}的数据已存在，请使用--prefix指定其他前缀')
+
+        user_ids = self.create_users(options['users'], options['password'], options['batch_size'])
+        department_ids = self.create_departments(options['departments'], user_ids)
+        role_ids = self.create_roles(options['roles'], options['role_size'], user_ids)
+        workflows = self.create_workflows(options['workflows'], user_ids, role_ids, department_ids)
+        self.create_events(options['events'], workflows, user_ids, options)
+
+    def create_users(self, count, password, batch_size):
+        password = make_password(password)  # 哈希计算较慢，所有用户共用同一个密码哈希
+        users = [User(username=f'{self.prefix}_user{i}', password=password) for i in range(count)]
+        User.objects.bulk_create(users, batch_size=batch_size)
+        user_ids = list(User.objects.filter(username__startswith=f'{self.prefix}_user').values_list('id', flat=True))
+        self.stdout.write(f'已生成{len(user_ids)}个用户')
+        return user_ids
+
+    def create_departments(self, count, user_ids):
+        Department.objects.bulk_create([
+            Department(name=f'{self.prefix}_部门{i}', code=f'{self.prefix}_dept{i}', leader_id=self.rnd.choice(user_ids))
+            for i in range(count)
+        ])
+        department_ids = list(Department.objects.filter(code__startswith=f'{self.prefix}_dept').values_list('id', flat=True))
+        self.stdout.write(f'已生成{len(department_ids)}个部门')
+        return department_ids
+
+    def create_roles(self, count, size, user_ids):
+        Group.objects.bulk_create([Group(name=f'{self.prefix}_role{i}') for i in range(count)])
+        role_ids = list(Group.objects.filter(name__startswith=f'{self.prefix}_role').values_list('id', flat=True))
+        User.groups.through.objects.bulk_create([
+            User.groups.through(group_id=role_id, user_id=user_id)
+            for role_id in role_ids for user_id in self.rnd.sample(user_ids, min(size, len(user_ids)))
+        ])
+        self.stdout.write(f'已生成{len(role_ids)}个角色')
+        return role_ids
+
+    def create_workflows(self, count, user_ids, role_ids, department_ids):
+        """每个工作流含一个天数字段，审批链为三个条件分支（>=5天、>=2天、默认），每个分支下1~3级审批"""
+        component = Component.objects.create(name=f'{self.prefix}_天数', ui_type=Component.UIType.INPUT, data_type=Component.DataType.INT)
+        approver_choices = [
+            lambda: {'type': WorkflowChain.Type.PERSON, 'person_id': self.rnd.choice(user_ids)},
+            lambda: {'type': WorkflowChain.Type.ROLE, 'role_id': self.rnd.choice(role_ids)},
+            lambda: {'type': WorkflowChain.Type.DEPART_LEADER, 'department_id': self.rnd.choice(department_ids)},
+        ]
+        workflows = []
+        with transaction.atomic():
+            for i in range(count):
+                workflow = Workflow.objects.create(name=f'{self.prefix}_工作流{i}')
+                field = FormField.objects.create(field_name='days', component=component, workflow=workflow, rank=1, required=True)
+                conditions = [(WorkflowChain.Condition.GTE, 5), (WorkflowChain.Condition.GTE, 2), (None, None)]
+                for rank, (condition, value) in enumerate(conditions, start=1):
+                    parent = None
+                    for depth in range(self.rnd.randint(1, 3)):
+                        branch = {'form_field': field, 'condition': condition, 'condition_value': value} if depth == 0 and condition else {}
+                        parent = WorkflowChain.objects.create(
+                            workflow=workflow, parent=parent, rank=rank if depth == 0 else 1,
+                            mode=self.rnd.choice([WorkflowChain.Mode.AND, WorkflowChain.Mode.OR]),
+                            **branch, **self.rnd.choice(approver_choices)(),
+                        )
+                workflows.append(workflow)
+        self.stdout.write(f'已生成{len(workflows)}个工作流')
+        return workflows
+
+    def create_events(self, count, workflows, user_ids, options):
+        """复用批量提交接口的写入逻辑（WorkflowEventBulkSerializer.create_batch），每批之后再将部分事件置为已完成"""
+        context = {'plans': {workflow.id: get_routing_plan(workflow) for workflow in workflows}}
+        resolver = ApproverResolver()
+        now = timezone.now()
+        batch_size = options['batch_size']
+        for start in range(0, count, batch_size):
+            batch = [
+                (index, {
+                    'requester_id': self.rnd.choice(user_ids),
+                    'workflow_id': self.rnd.choice(workflows).id,
+                    'form_fields': {'days': self.rnd.randint(0, 7)},
+                    'chain_approver_dict': {},
+                })
+                for index in range(start, min(start + batch_size, count))
+            ]
+            with transaction.atomic():
+                events = WorkflowEventBulkSerializer.create_batch(batch, context, resolver)
+                for event in events:
+                    event.create_time = event.update_time = now - datetime.timedelta(seconds=self.rnd.randint(0, options['days'] * 86400))
+                WorkflowEvent.objects.bulk_update(events, ['create_time', 'update_time'])
+                self.finish_events([event for event in events if self.rnd.random() < options['finished_ratio']])
+            self.stdout.write(f'已生成{start + len(batch)}/{count}个事件')
+
+    def finish_events(self, events):
+        """约八成通过（所有节点通过），其余在首节点驳回，并刷新进度快照"""
+        approved, rejected = [], []
+        for event in events:
+            (approved if self.rnd.random() < 0.8 else rejected).append(event.id)
+        now = timezone.now()
+        WorkflowNode.objects.filter(event_id__in=approved).update(state=State.APPROVED, finish_time=now)
+        NodeApprover.objects.filter(node__event_id__in=approved).update(action=Action.APPROVED, action_time=now)
+        WorkflowEvent.objects.filter(id__in=approved).update(state=State.APPROVED)
+        first_nodes = WorkflowNode.objects.filter(event_id__in=rejected, parent__isnull=True)
+        NodeApprover.objects.filter(node__in=first_nodes).update(action=Action.REJECTED, action_time=now)
+        first_nodes.update(state=State.REJECTED, finish_time=now)
+        WorkflowEvent.objects.filter(id__in=rejected).update(state=State.REJECTED)
+
+        for event in WorkflowEvent.load_node_process(events):
+            event.progress = event._node_process
+        WorkflowEvent.objects.bulk_update(events, ['progress'])
@@ -0,0 +1,30 @@
+from django.core.management.base import BaseCommand
+from django.db import transaction
+
+from workflow.apps.workflow.models import WorkflowEvent, EventFormValue, ArchivedWorkflowEvent
+
+
+class Command(BaseCommand):
+    help = '重建工作流事件（含归档事件）的表单值索引(EventFormValue)，用于上线前的存量事件或表单字段类型调整后'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=500, help='每批处理的事件数量')
+        parser.add_argument('--workflow-id', type=int, help='只处理该工作流的事件')
+
+    def handle(self, *args, **options):
+        batch_size = options['batch_size']
+        total = 0
+        for model in (WorkflowEvent, ArchivedWorkflowEvent):
+            queryset = model.objects.only('id', 'workflow_id', 'form_fields').order_by('id')
+            if options['workflow_id']:
+                queryset = queryset.filter(workflow_id=options['workflow_id'])
+            last_id = 0
+            while True:
+                events = list(queryset.filter(id__gt=last_id)[:batch_size])
+                if not events:
+                    break
+                last_id = events[-1].id
+                with transaction.atomic():
+                    EventFormValue.reindex_events(events)
+                total += len(events)
+        self.stdout.write(self.style.SUCCESS(f'共重建{total}个事件的表单值索引'))
@@ -0,0 +1,40 @@
+import time
+
+from django.core.management.base import BaseCommand
+from django.db import close_old_connections
+
+from workflow.apps.workflow import outbox
+
+
+class Command(BaseCommand):
+    help = '投递发件箱中的通知消息（审批通过/驳回邮件等），按批取出，失败按指数退避重试'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=100, help='每批取出的消息数量')
+        parser.add_argument('--interval', type=float, default=1.0, help='没有到期消息时的轮询间隔（秒）')
+        parser.add_argument('--max-attempts', type=int, default=8, help='最大投递次数，超过后标记为DEAD')
+        parser.add_argument('--backoff-base', type=int, default=10, help='重试间隔基数（秒），第n次失败后等待base*2^(n-1)秒')
+        parser.add_argument('--backoff-max', type=int, default=3600, help='最大重试间隔（秒）')
+        parser.add_argument('--once', action='store_true', help='投递完当前所有到期消息后退出')
+
+    def handle(self, *args, **options):
+        drain_kwargs = {
+            'batch_size': options['batch_size'],
+            'max_attempts': options['max_attempts'],
+            'backoff_base': options['backoff_base'],
+            'backoff_max': options['backoff_max'],
+        }
+        total_fetched = total_delivered = 0
+        try:
+            while True:
+                close_old_connections()
+                fetched, delivered = outbox.drain(**drain_kwargs)
+                total_fetched += fetched
+                total_delivered += delivered
+                if fetched < options['batch_size']:
+                    if options['once']:
+                        break
+                    time.sleep(options['interval'])
+        except KeyboardInterrupt:
+            pass
+        self.stdout.write(self.style.SUCCESS(f'共取出{total_fetched}条消息，投递成功{total_delivered}条'))
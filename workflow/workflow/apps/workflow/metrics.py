@@ -0,0 +1,36 @@
+"""
+工作流运行指标，通过/metrics以Prometheus文本格式输出（详见libs/utils/metrics_util.py）。
+计数在事务提交后累加，回滚的审批/事件不计入；积压类指标在抓取时查询数据库得到。
+"""
+from django.db.models import Count, Min
+from django.db.models.functions import Coalesce
+from django.utils import timezone
+
+from workflow.libs.utils.metrics_util import Counter, Histogram, collector
+
+__all__ = ['events_created', 'node_actions', 'node_action_seconds', 'node_action_done']
+
+events_created = Counter('workflow_events_created_total', '已创建的工作流事件数量', ['workflow'])
+node_actions = Counter('workflow_node_actions_total', '审批节点通过/驳回次数', ['action'])
+node_action_seconds = Histogram('workflow_node_action_seconds', '单次审批通过/驳回的耗时', ['action'])
+
+
+def node_action_done(action, seconds):
+    node_actions.inc(action=action)
+    node_action_seconds.observe(seconds, action=action)
+
+
+@collector
+def backlog():
+    from .models import WorkflowNode, State
+
+    processing = WorkflowNode.objects.filter(state=State.PROCESSING)
+    per_workflow = processing.order_by().values_list('event__workflow_id').annotate(count=Count('id'))
+    # 节点在事件提交时一并创建，非首节点从父节点审批通过时才开始等待
+    oldest = processing.aggregate(oldest=Min(Coalesce('parent__finish_time', 'create_time')))['oldest']
+    return [
+        ('workflow_processing_nodes', 'gauge', '审批中的节点数量',
+         [({'workflow': workflow_id}, count) for workflow_id, count in per_workflow]),
+        ('workflow_oldest_processing_node_age_seconds', 'gauge', '等待最久的审批中节点已等待的秒数（从进入审批算起）',
+         [({}, round((timezone.now() - oldest).total_seconds(), 3) if oldest else 0)]),
+    ]
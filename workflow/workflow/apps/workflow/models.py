@@ -1,16 +1,25 @@
+import datetime
+import functools
+import time
 import typing
-from collections import OrderedDict
+from collections import OrderedDict, Counter
 
 from django.contrib.auth.models import Group
 from django.db import models, transaction
+from django.utils import timezone
+from django.utils.dateparse import parse_date, parse_datetime
 from rest_framework import serializers
 from rest_framework.fields import ChoiceField
 
+from workflow.libs.utils.cache_util import LRUCache
 from workflow.libs.utils.common_util import sort_nodes_by_parent, chain_getattr
 from workflow.apps.user.models import User
 from workflow.libs.frameworks.validators import is_identifier, is_choice_format
+from . import metrics
 
-__all__ = ['Component', 'FormField', 'Workflow', 'WorkflowChain', 'WorkflowNode', 'WorkflowEvent']
+__all__ = ['Component', 'FormField', 'Workflow', 'WorkflowChain', 'WorkflowNode', 'WorkflowEvent', 'EventFormValue', 'OutboxMessage',
+           'ArchivedWorkflowEvent', 'ArchivedWorkflowNode', 'ArchivedNodeApprover',
+           'WorkflowDailyStat', 'ApproverDailyStat', 'WorkflowBacklog', 'ApproverBacklog', 'StatWatermark']
 
 
 class Action(models.TextChoices):
@@ -44,6 +53,7 @@ class Component(models.Model):
         DATA = 'DATA', '日期'
 
         @classmethod
+        @functools.lru_cache(maxsize=None)
         def map(cls):
             return {
                 cls.STR: serializers.CharField,
@@ -98,10 +108,17 @@ class FormField(models.Model):
         unique_together = [('workflow_id', 'field_name')]
 
 
+# 动态表单序列化器缓存，key为(工作流ID, 表单版本)
+FORM_SERIALIZER_CACHE_SIZE = 256
+_form_serializer_cache = LRUCache(maxsize=FORM_SERIALIZER_CACHE_SIZE)
+
+
 class Workflow(models.Model):
     """工作流。如请假流/报销流"""
     name = models.CharField(max_length=128, unique=True, verbose_name='工作流名称', help_text='如请假/报销等')
     comment = models.CharField(max_length=256, null=True, blank=True, verbose_name='备注')
+    chain_version = models.PositiveIntegerField(default=0, editable=False, verbose_name='审批链版本', help_text='每次替换审批链时递增，用于路由计划缓存失效')
+    form_version = models.PositiveIntegerField(default=0, editable=False, verbose_name='表单版本', help_text='每次替换表单字段时递增，用于表单序列化器缓存失效')
 
     class Meta:
         db_table = 'wf_workflow'
@@ -112,11 +129,27 @@ class Workflow(models.Model):
     def __str__(self):
         return self.name
 
-    def generate_form_serializer(self):
-        fields = self.form_fields.all()
+    def build_form_serializer(self):
+        fields = FormField.objects.filter(workflow_id=self.id).select_related('component')
         serializer_fields = {f.field_name: f.to_serializer_field() for f in fields}
+        # 顺带缓存字段类型，提交事件后写表单值索引时无需再查询
+        _form_serializer_cache.set((self.id, self.form_version, 'types'), {f.field_name: f.component.data_type for f in fields})
         return type('WorkflowFormSerializer', (serializers.Serializer,), serializer_fields)
 
+    def generate_form_serializer(self):
+        """获取动态表单序列化器类，按(工作流ID, 表单版本)缓存，表单字段被替换后版本递增，旧缓存自然失效"""
+        return _form_serializer_cache.get_or_set((self.id, self.form_version), self.build_form_serializer)
+
+    def get_form_field_types(self):
+        """表单字段的数据类型{字段名: Component.DataType}，与动态表单序列化器共用缓存"""
+        return _form_serializer_cache.get_or_set((self.id, self.form_version, 'types'), lambda: dict(
+            FormField.objects.filter(workflow_id=self.id).values_list('field_name', 'component__data_type')))
+
+    @classmethod
+    def invalidate_form_serializer(cls, workflow_id):
+        """清除本进程中该工作流的所有动态表单序列化器"""
+        _form_serializer_cache.invalidate(lambda key: str(key[0]) == str(workflow_id))
+
 
 class WorkflowChain(models.Model):
     """
@@ -190,18 +223,19 @@ class WorkflowChain(models.Model):
         return operator_map.get(self.condition, None)
 
     def get_approver(self, approvers: dict, requester: User):
-        """获取审批链中某个节点的审批人"""
-        elected_approver = None
-        if self.type == WorkflowChain.Type.ELECT and str(self.id) in approvers:
-            elected_approver = User.objects.filter(id=approvers[str(self.id)]).first()
-        approver_map = {
-            str(self.Type.SELF): [requester],
-            str(self.Type.ELECT): [elected_approver],
-            str(self.Type.PERSON): [self.person],
-            str(self.Type.ROLE): self.role.user_set.all() if self.role and self.role.user_set.all().exists() else [],
-            str(self.Type.DEPART_LEADER): [self.department.leader] if self.department else [],
-        }
-        return approver_map.get(self.type, [])
+        """获取审批链中某个节点的审批人，只查询该节点类型所需的数据"""
+        if self.type == self.Type.SELF:
+            return [requester]
+        if self.type == self.Type.ELECT:
+            user_id = approvers.get(str(self.id))
+            return list(User.objects.filter(id=user_id)) if user_id else []
+        if self.type == self.Type.PERSON:
+            return [self.person] if self.person_id else []
+        if self.type == self.Type.ROLE:
+            return list(self.role.user_set.all()) if self.role_id else []
+        if self.type == self.Type.DEPART_LEADER:
+            return [self.department.leader] if self.department_id else []
+        return []
 
 
 class WorkflowEvent(models.Model):
@@ -211,6 +245,10 @@ class WorkflowEvent(models.Model):
     state = models.CharField(max_length=16, choices=State.choices, default=State.PENDING, verbose_name='状态')
     # 根据不同工作流程链，存储不同信息。如请假会包含开始时间/结束时间
     form_fields = models.JSONField(default=dict, blank=True, verbose_name='表单信息')
+    submit_key = models.CharField(max_length=64, null=True, blank=True, unique=True, verbose_name='提交标识',
+                                  help_text='批量提交时用于回查事件ID，调用方传入时可防止重复提交')
+    # 审批进度快照，与node_process结构一致。生成节点、审批通过/驳回时在同一事务中刷新，读取时无需再查节点表
+    progress = models.JSONField(null=True, blank=True, editable=False, verbose_name='审批进度快照')
     create_time = models.DateTimeField(auto_now_add=True, verbose_name='创建时间')
     update_time = models.DateTimeField(auto_now=True, verbose_name='更新时间')
 
@@ -218,29 +256,150 @@ class WorkflowEvent(models.Model):
         db_table = 'wf_event'
         verbose_name = '工作流事件'
         verbose_name_plural = verbose_name
+        # 事件列表按requester_id/workflow_id/state过滤、按create_time排序（游标分页为-create_time,-id），排序列放在最后避免filesort
+        indexes = [
+            models.Index(fields=['requester', 'create_time'], name='wf_event_requester_idx'),
+            models.Index(fields=['workflow', 'state', 'create_time'], name='wf_event_workflow_state_idx'),
+            models.Index(fields=['state', 'create_time'], name='wf_event_state_idx'),
+            models.Index(fields=['create_time'], name='wf_event_create_time_idx'),
+        ]
+
+    archived = False  # 是否为归档事件（ArchivedWorkflowEvent），列表同时返回热表和归档表数据时用于区分
 
     def __str__(self):
         return f"{self.requester.username}-{self.workflow.name}-{self.get_state_display()}"
 
     def node_process(self):
-        """审批节点进度"""
-        node_objs = self.nodes.all()
-        nodes = []
-        for node in node_objs:
-            approvers = []
-            for a in node.nodeapprover_set.all():
-                approvers.append({'user_id': a.approver_id, 'username': User.objects.get(id=a.approver_id).username, 'state': a.action})
-            nodes.append({
-                'id': node.id,
-                'parent_id': node.parent_id,
-                'approvers': approvers,
-                'mode': node.mode,
-                'mode_display': node.get_mode_display(),
-                'actor': node.actor.username if node.actor else '',
-                'node_state': node.state,
-            })
-        order_nodes = sort_nodes_by_parent(nodes)
-        return order_nodes
+        """审批节点进度，优先读取快照"""
+        if hasattr(self, '_node_process'):
+            return self._node_process
+        if self.progress is not None:
+            return self.progress
+        self.load_node_process([self])
+        return self._node_process
+
+    def patch_progress(self, node_states: dict, approver_actions: dict):
+        """
+        就地更新进度快照（不保存），无快照时重新计算。
+        node_states: {node_id: state}，approver_actions: {(node_id, approver_id): action}
+        """
+        if self.progress is None:
+            self.load_node_process([self])
+            self.progress = self._node_process
+            return
+        for node in self.progress:
+            node['node_state'] = node_states.get(node['id'], node['node_state'])
+            for approver in node['approvers']:
+                approver['state'] = approver_actions.get((node['id'], approver['user_id']), approver['state'])
+        self._node_process = self.progress
+
+    def refresh_progress(self):
+        """根据当前审批节点重新计算并保存审批进度快照"""
+        self.load_node_process([self])
+        self.progress = self._node_process
+        self.save(update_fields=['progress'])
+
+    @classmethod
+    def load_node_process(cls, events):
+        """批量计算审批节点进度并挂到各事件实例上，固定两次查询，与事件数量无关"""
+        events = list(events)
+        event_nodes = {event.id: [] for event in events}
+        nodes = {}
+        node_values = WorkflowNode.objects.filter(event_id__in=event_nodes).order_by('id').values(
+            'id', 'event_id', 'parent_id', 'mode', 'state', 'actor__username')
+        for node in node_values:
+            nodes[node['id']] = {
+                'id': node['id'],
+                'parent_id': node['parent_id'],
+                'approvers': [],
+                'mode': node['mode'],
+                'mode_display': WorkflowNode.Mode(node['mode']).label,
+                'actor': node['actor__username'] or '',
+                'node_state': node['state'],
+            }
+            event_nodes[node['event_id']].append(nodes[node['id']])
+        approver_values = NodeApprover.objects.filter(node_id__in=nodes).order_by('id').values(
+            'node_id', 'approver_id', 'approver__username', 'action')
+        for a in approver_values:
+            nodes[a['node_id']]['approvers'].append({'user_id': a['approver_id'], 'username': a['approver__username'], 'state': a['action']})
+        for event in events:
+            event._node_process = sort_nodes_by_parent(event_nodes[event.id])
+        return events
+
+
+class NodeActionContext(object):
+    """
+    某个用户对审批节点执行审批动作所需的上下文：该用户的审批人记录、节点上各动作的审批人数量、父节点状态、子节点ID及状态。
+    用户的审批人记录和各动作数量由一次分组查询得到（走(node, action, approver)覆盖索引，不取出全部审批人），
+    lock=True时对节点和事件行加行锁（须在事务中调用）。
+    加载后挂在节点实例的action_context上，同一请求中IsApprover、validate_action、change_node_state、change_event_state共用。
+    """
+
+    def __init__(self, node, user_id, approver_row, action_counts, parent_state, child_id, child_state, locked=False):
+        self.node = node
+        self.user_id = user_id
+        self.approver_row = approver_row  # {'id', 'approver_id', 'action'}，不是审批人时为None
+        self.action_counts = action_counts  # {action: 审批人数量}
+        self.parent_state = parent_state
+        self.child_id = child_id
+        self.child_state = child_state
+        self.locked = locked
+
+    @classmethod
+    def load(cls, node: 'WorkflowNode', user_id, lock=False):
+        if lock:
+            locked = WorkflowNode.objects.select_for_update().select_related('event').get(id=node.id)
+            node.state, node.mode, node.parent_id, node.event = locked.state, locked.mode, locked.parent_id, locked.event
+        context = cls.build([node], user_id, locked=lock)[node.id]
+        node.action_context = context
+        return context
+
+    @classmethod
+    def load_many(cls, node_ids, user_id, lock=False):
+        """批量加载多个节点的上下文，返回{node_id: context}，不存在的节点不在结果中"""
+        queryset = WorkflowNode.objects.select_related('event').filter(id__in=node_ids).order_by('id')  # 按ID加锁，避免死锁
+        if lock:
+            queryset = queryset.select_for_update()
+        return cls.build(list(queryset), user_id, locked=lock)
+
+    @classmethod
+    def build(cls, nodes: list, user_id, locked=False):
+        """两次查询取出用户的审批人记录、各动作数量及上下游节点状态"""
+        node_ids = [node.id for node in nodes]
+        rows, counts = {}, {node_id: {} for node_id in node_ids}
+        grouped = NodeApprover.objects.filter(node_id__in=node_ids).order_by().values('node_id', 'action').annotate(
+            count=models.Count('id'), mine=models.Max(models.Case(models.When(approver_id=user_id, then='id'))))
+        for row in grouped:
+            counts[row['node_id']][row['action']] = row['count']
+            if row['mine'] is not None:
+                rows[row['node_id']] = {'id': row['mine'], 'approver_id': user_id, 'action': row['action']}
+        parent_ids = [node.parent_id for node in nodes if node.parent_id]
+        states, children = {}, {}
+        for n in WorkflowNode.objects.filter(models.Q(id__in=parent_ids) | models.Q(parent_id__in=node_ids)).values('id', 'parent_id', 'state'):
+            states[n['id']] = n['state']
+            if n['parent_id'] in counts:
+                children[n['parent_id']] = n['id']
+        contexts = {}
+        for node in nodes:
+            child_id = children.get(node.id)
+            contexts[node.id] = cls(node, user_id, rows.get(node.id), counts[node.id], states.get(node.parent_id), child_id,
+                                    states.get(child_id), locked)
+        return contexts
+
+    def record_action(self, action):
+        """记录用户的审批动作，同步更新各动作数量"""
+        self.action_counts[self.approver_row['action']] -= 1
+        self.action_counts[action] = self.action_counts.get(action, 0) + 1
+        self.approver_row['action'] = action
+
+    @property
+    def any_acted(self):
+        """是否已有审批人通过或驳回"""
+        return any(count for action, count in self.action_counts.items() if action != Action.PENDING)
+
+    @property
+    def all_approved(self):
+        return self.action_counts.get(Action.APPROVED, 0) == sum(self.action_counts.values())
 
 
 class WorkflowNode(models.Model):
@@ -261,6 +420,8 @@ class WorkflowNode(models.Model):
     actor = models.ForeignKey('user.User', null=True, on_delete=models.SET_NULL, verbose_name='执行者',
                               help_text='实际执行者，可能是权限更高的角色如人事')
     action_time = models.DateTimeField(auto_now=True, verbose_name='更新时间')
+    finish_time = models.DateTimeField(null=True, blank=True, editable=False, verbose_name='审批完成时间',
+                                       help_text='节点通过或驳回的时间，只在审批时写入一次，修改备注等不会改变')
     create_time = models.DateTimeField(auto_now_add=True, verbose_name='创建时间')
     comment = models.CharField(max_length=256, null=True, blank=True, verbose_name='备注')
 
@@ -268,126 +429,234 @@ class WorkflowNode(models.Model):
         db_table = 'wf_node'
         verbose_name = '工作流节点'
         verbose_name_plural = verbose_name
+        indexes = [
+            # 按状态过滤（积压指标只扫描审批中的节点），带上create_time使按创建时间排序无需临时排序
+            models.Index(fields=['state', 'create_time'], name='wf_node_state_idx'),
+            # 按事件取节点（审批进度、批量生成节点回查ID），可附带state过滤
+            models.Index(fields=['event', 'state'], name='wf_node_event_state_idx'),
+            # 统计汇总按节点审批完成时间增量读取（见analytics.py）
+            models.Index(fields=['finish_time'], name='wf_node_finish_time_idx'),
+        ]
 
     def __str__(self):
         return f"{self.event.requester.username}-{self.event.workflow.name}-" \
                f"{self.get_action_display()}({getattr(self.approver, 'username', '')})"
 
-    def validate_action(self, approver: User):
-        """校验是否有权限执行审批操作"""
-        if approver not in self.approvers.all():
+    def validate_action(self, approver: User, context: 'NodeActionContext' = None):
+        """校验是否有权限执行审批操作，context为审批时已加载（并加锁）的节点上下文"""
+        if context is None or context.user_id != approver.id:
+            context = NodeActionContext.load(self, approver.id)
+        row = context.approver_row
+        if row is None:
             return False, '不是审批人'
-        if self.mode == self.Mode.OR and NodeApprover.objects.filter(node_id=self.id).exclude(action=Action.PENDING).exists():
+        if self.mode == self.Mode.OR and context.any_acted:
             return False, '已被或签成员审批'
-        if hasattr(self, 'children') and getattr(self, 'children').state != Action.PENDING:  # 下一节点已经在审批中或审批完成
+        if context.child_state is not None and context.child_state != State.PENDING:  # 下一节点已经在审批中或审批完成
             return False, '禁止操作，下一节点已经审批完成'
-        if self.parent and self.parent.state != Action.APPROVED:  # 上一节点审批尚未通过
+        if self.parent_id and context.parent_state != State.APPROVED:  # 上一节点审批尚未通过
             return False, '禁止操作，父节点审批尚未通过'
+        if self.state != State.PROCESSING:
+            return False, '当前节点不在审批中'
+        if row['action'] != Action.PENDING:
+            return False, '已审批过，不能重复操作'
         return True, ''
 
-    def change_node_state(self, action: typing.Literal[Action.APPROVED, Action.REJECTED]):
-        """修改审批节点状态"""
+    def change_node_state(self, action: typing.Literal[Action.APPROVED, Action.REJECTED], context: 'NodeActionContext', commit=True):
+        """修改审批节点状态，审批人动作已通过context.record_action记录。commit=False时只修改内存中的状态，由调用方批量保存"""
         if action == Action.REJECTED:
             self.state = State.REJECTED
+        elif self.mode == self.Mode.OR or context.all_approved:
+            self.state = State.APPROVED
         else:
-            nas = NodeApprover.objects.filter(node_id=self.id)
-            if self.mode == self.Mode.OR:
-                self.state = State.APPROVED
-                if hasattr(self, 'children'):
-                    self.children.state = State.PROCESSING
-                    self.children.save()
-            else:
-                if all(action == Action.APPROVED for action in nas.values_list('action', flat=True)):
-                    self.state = State.APPROVED
-                    if hasattr(self, 'children'):
-                        self.children.state = State.PROCESSING
-                        self.children.save()
-                else:
-                    self.state = State.PROCESSING
-        self.save()
+            self.state = State.PROCESSING
+        if self.state != State.PROCESSING:
+            self.finish_time = timezone.now()
+        if commit:
+            self.save(update_fields=['state', 'finish_time', 'action_time'])
+        if self.state == State.APPROVED and context.child_id is not None:
+            if commit:
+                WorkflowNode.objects.filter(id=context.child_id).update(state=State.PROCESSING)
+            context.child_state = State.PROCESSING
         return self.state
 
-    def change_event_state(self, action: typing.Literal[Action.APPROVED, Action.REJECTED]):
-        """修改审批事件状态"""
+    def change_event_state(self, action: typing.Literal[Action.APPROVED, Action.REJECTED], context: 'NodeActionContext', commit=True):
+        """修改审批事件状态，并就地更新进度快照。须在change_node_state之后调用，commit=False时由调用方批量保存"""
         if action == Action.REJECTED:
             self.event.state = State.REJECTED
-            return self.event.save()
-        if self.mode == self.Mode.OR or \
-           (self.mode == self.Mode.AND and all(action == Action.APPROVED for action in NodeApprover.objects.filter(node_id=self.id).values_list('action', flat=True))):
+        elif self.state == State.APPROVED and context.child_id is None:  # 最后一个节点审批通过
             self.event.state = State.APPROVED
-            return self.event.save()
-        if self.mode == self.Mode.AND and NodeApprover.objects.filter(node_id=self.id, action=Action.PENDING).exists():
+        else:
             self.event.state = State.PROCESSING
-            return self.event.save()
+        node_states = {self.id: self.state}
+        if context.child_id is not None:
+            node_states[context.child_id] = context.child_state
+        self.event.patch_progress(node_states, {(self.id, context.user_id): context.approver_row['action']})
+        if commit:
+            self.event.save(update_fields=['state', 'progress', 'update_time'])
+        return self.event.state
+
+    def do_action(self, approver: User, action: typing.Literal[Action.APPROVED, Action.REJECTED], comment=None):
+        """
+        执行审批动作。锁定节点和事件行后读取审批人记录与上下游节点状态，
+        并发审批（如会签成员同时审批）时会在锁上排队，后者读到的是前者提交后的状态。
+        同一事务中IsApprover已加锁加载过上下文时直接复用
+        """
+        start = time.perf_counter()
+        with transaction.atomic():
+            context = getattr(self, 'action_context', None)
+            if context is None or not context.locked or context.user_id != approver.id:
+                context = NodeActionContext.load(self, approver.id, lock=True)
+            self.action_context = None  # 上下文只在本次审批中使用
+            can_do_action, msg = self.validate_action(approver, context)
+            if not can_do_action:
+                raise Exception(f'当前节点不允许审批-{msg}')
+
+            NodeApprover.objects.filter(id=context.approver_row['id']).update(action=action, comment=comment, action_time=timezone.now())
+            context.record_action(action)
+            self.change_node_state(action, context)
+            self.change_event_state(action, context)
+
+            # 信号在审批事务中发送，处理函数写入发件箱，与审批结果一同提交（详见signals.py）
+            from .signals import node_approved, node_rejected
+            signal = node_approved if action == Action.APPROVED else node_rejected
+            signal.send(sender=self.__class__, instance=self)
+            elapsed = time.perf_counter() - start
+            transaction.on_commit(lambda: metrics.node_action_done(action, elapsed))
 
     def approve(self, approver: User, comment=None):
         """审批通过"""
-        can_do_action, msg = self.validate_action(approver)
-        if not can_do_action:
-            raise Exception(f'当前节点不允许审批-{msg}')
-
-        an = NodeApprover.objects.filter(approver_id=approver.id, node_id=self.id).first()
-        with transaction.atomic():
-            an.action = Action.APPROVED
-            an.comment = comment
-            an.save()
-            self.change_node_state(Action.APPROVED)
-            self.change_event_state(Action.APPROVED)
-
-        from .signals import node_approved
-        node_approved.send(sender=self.__class__, instance=self)
+        self.do_action(approver, Action.APPROVED, comment)
 
     def reject(self, approver: User, comment=None):
         """审批拒绝"""
-        can_do_action, msg = self.validate_action(approver)
-        if not can_do_action:
-            raise Exception(f'当前节点不允许审批-{msg}')
-
-        an = NodeApprover.objects.filter(approver_id=approver.id, node_id=self.id).first()
-        with transaction.atomic():
-            an.action = Action.REJECTED
-            an.comment = comment
-            an.save()
-            self.change_node_state(Action.REJECTED)
-            self.change_event_state(Action.REJECTED)
+        self.do_action(approver, Action.REJECTED, comment)
 
-        from .signals import node_rejected
-        node_rejected.send(sender=self.__class__, instance=self)
+    @classmethod
+    def batch_action(cls, approver: User, action: typing.Literal[Action.APPROVED, Action.REJECTED], comments: dict, batch_size=100):
+        """
+        批量审批，comments: {node_id: comment}。返回[{'id': node_id, 'success': True/False, 'msg': ''}, ...]
+        每batch_size个节点一个事务：批量加锁加载上下文、逐个校验，再批量写入审批人、节点、子节点和事件，查询数与节点数量无关。
+        审批信号在事务中逐个节点发送，处理函数写入的发件箱消息在事务结束前一次性批量插入。
+        """
+        from . import outbox
+        from .signals import node_approved, node_rejected
+        signal = node_approved if action == Action.APPROVED else node_rejected
+
+        results = {}
+        node_ids = list(comments)
+        for start in range(0, len(node_ids), batch_size):
+            chunk = node_ids[start:start + batch_size]
+            with transaction.atomic(), outbox.collect():
+                contexts = NodeActionContext.load_many(chunk, approver.id, lock=True)
+                acted, event_ids = [], set()
+                for node_id in chunk:
+                    context = contexts.get(node_id)
+                    if context is None:
+                        results[node_id] = (False, '节点不存在')
+                        continue
+                    node = context.node
+                    can_do_action, msg = node.validate_action(approver, context)
+                    if can_do_action and node.event_id in event_ids:
+                        can_do_action, msg = False, '同一事件的多个节点不能一起审批'
+                    if not can_do_action:
+                        results[node_id] = (False, msg)
+                        continue
+                    event_ids.add(node.event_id)
+                    context.record_action(action)
+                    node.change_node_state(action, context, commit=False)
+                    acted.append((node, context))
+                if not acted:
+                    continue
+
+                now = timezone.now()
+                NodeApprover.objects.bulk_update([
+                    NodeApprover(id=context.approver_row['id'], action=action, comment=comments[node.id], action_time=now)
+                    for node, context in acted
+                ], ['action', 'comment', 'action_time'])
+                for node, _ in acted:
+                    node.action_time = now
+                    if node.state != State.PROCESSING:
+                        node.finish_time = now
+                cls.objects.bulk_update([node for node, _ in acted], ['state', 'finish_time', 'action_time'])
+                cls.objects.filter(id__in=[c.child_id for n, c in acted if c.child_state == State.PROCESSING]).update(state=State.PROCESSING)
+
+                events = [node.event for node, _ in acted]
+                for event in WorkflowEvent.load_node_process([e for e in events if e.progress is None]):
+                    event.progress = event._node_process
+                for node, context in acted:
+                    node.change_event_state(action, context, commit=False)
+                    node.event.update_time = now
+                WorkflowEvent.objects.bulk_update(events, ['state', 'progress', 'update_time'])
+
+                for node, _ in acted:
+                    results[node.id] = (True, '')
+                    signal.send(sender=cls, instance=node)
+                transaction.on_commit(functools.partial(metrics.node_actions.inc, len(acted), action=action))
+        return [{'id': node_id, 'success': results[node_id][0], 'msg': results[node_id][1]} for node_id in node_ids]
 
     @classmethod
     def generate_workflow_node(cls, event: WorkflowEvent, chain_approver_dict: dict):
         """生成审批节点
             当为审批者为发起人自选时需要传chain_approver_dict: {'chain_id': 'user_id', ...}
+            审批链预先编译为路由计划并缓存（详见routing.py），此处单次遍历命中的分支路径即可
         """
-        parent_node = None
-        next_chains = event.workflow.chains.filter(parent__isnull=True).all()  # 找到最靠前的审批节点链
-        if not next_chains.exists():
+        from .routing import get_routing_plan, ApproverResolver
+
+        plan = get_routing_plan(event.workflow)
+        if not plan.branches:
             raise Exception('此工作流尚未设置审批链，请联系管理员配置审批链')
 
-        def recursion_create_node(parent_node, next_chains):
-            """递归创建审批节点"""
-            with transaction.atomic():
-                for chain in next_chains:
-                    approvers = chain.get_approver(chain_approver_dict, event.requester)
-                    if chain == next_chains.last():  # 非条件分支节点或条件分支的最后一个默认分支
-                        condition = '1 == 1'
-                    else:
-                        actual_value = int(event.form_fields.get(chain.form_field.field_name))
-                        condition = f'{actual_value} {chain.operator} {chain.condition_value}'
-                    if eval(condition):
-                        state = State.PROCESSING if parent_node is None else State.PENDING  # 首节点设置状态为进行中
-                        parent_node = WorkflowNode.objects.create(event=event, mode=chain.mode, parent=parent_node, state=state, comment=chain.comment)
-                        parent_node.approvers.add(*approvers)
-                        next_chains = chain.children.all().order_by('rank')
-                        has_find_branch = True
-                    else:
-                        continue
-                    if next_chains.count() > 0:
-                        recursion_create_node(parent_node, next_chains)
-                    if has_find_branch:  # 一旦找到满足条件分支，终止循环
-                        break
+        chain_approver_dict = chain_approver_dict or {}
+        path = plan.route(event.form_fields)
+        resolver = ApproverResolver()
+        resolver.prefetch([branch.approver for branch in path], chain_approver_dict)
+        parent_node = None
+        with transaction.atomic():
+            for branch in path:
+                approvers = resolver.resolve(branch.approver, chain_approver_dict, event.requester_id)
+                state = State.PROCESSING if parent_node is None else State.PENDING  # 首节点设置状态为进行中
+                parent_node = WorkflowNode.objects.create(event=event, mode=branch.mode, parent=parent_node, state=state, comment=branch.comment)
+                parent_node.approvers.add(*approvers)
+            event.refresh_progress()
+            transaction.on_commit(lambda: metrics.events_created.inc(workflow=event.workflow_id))
 
-        recursion_create_node(parent_node, next_chains)
+    @classmethod
+    def bulk_generate_workflow_node(cls, routed_events: list):
+        """批量生成审批节点
+            routed_events: [(event, [(branch, [approver_id, ...]), ...]), ...]，event须已入库，列表为路由命中的分支及其审批人
+            按层级批量插入节点（同一层的节点一次插入、一次回查ID），最后一次性插入审批人，查询数只与审批链深度有关
+        """
+        parent_map = {event.id: None for event, _ in routed_events}  # event_id: 上一层节点ID
+        node_approvers = []
+        level = 0
+        with transaction.atomic():
+            while True:
+                level_items = [(event, path[level]) for event, path in routed_events if len(path) > level]
+                if not level_items:
+                    break
+                state = State.PROCESSING if level == 0 else State.PENDING  # 首节点设置状态为进行中
+                cls.objects.bulk_create([
+                    cls(event_id=event.id, mode=branch.mode, parent_id=parent_map[event.id], state=state, comment=branch.comment)
+                    for event, (branch, _) in level_items
+                ])
+                if level == 0:
+                    created = cls.objects.filter(event_id__in=[event.id for event, _ in level_items], parent__isnull=True)
+                else:
+                    created = cls.objects.filter(parent_id__in=[parent_map[event.id] for event, _ in level_items])
+                node_map = dict(created.values_list('event_id', 'id'))
+                for event, (_, approver_ids) in level_items:
+                    node_id = node_map[event.id]
+                    node_approvers.extend(NodeApprover(node_id=node_id, approver_id=i) for i in dict.fromkeys(approver_ids))
+                    parent_map[event.id] = node_id
+                level += 1
+            NodeApprover.objects.bulk_create(node_approvers)
+
+            events = WorkflowEvent.load_node_process([event for event, _ in routed_events])
+            for event in events:
+                event.progress = event._node_process
+            WorkflowEvent.objects.bulk_update(events, ['progress'])
+            for workflow_id, count in Counter(event.workflow_id for event in events).items():
+                transaction.on_commit(functools.partial(metrics.events_created.inc, count, workflow=workflow_id))
 
 
 class NodeApprover(models.Model):
@@ -397,8 +666,336 @@ class NodeApprover(models.Model):
     approver = models.ForeignKey('user.User', on_delete=models.CASCADE, verbose_name='审批人')
     action = models.CharField(max_length=16, choices=Action.choices, default=Action.PENDING, verbose_name='动作')
     comment = models.CharField(max_length=256, null=True, blank=True, verbose_name='备注')
+    action_time = models.DateTimeField(null=True, blank=True, verbose_name='审批时间')
 
     class Meta:
         db_table = 'wf_node_approver'
         verbose_name = '审批节点-审批人'
         verbose_name_plural = verbose_name
+        indexes = [
+            # 待我审批：按审批人+动作定位，带上node_id使回表关联节点时无需再读行数据
+            models.Index(fields=['approver', 'action', 'node'], name='wf_node_approver_inbox_idx'),
+            # 审批时按节点统计各动作的审批人数量并定位当前用户的记录（NodeActionContext），覆盖索引无需回表
+            models.Index(fields=['node', 'action', 'approver'], name='wf_node_approver_node_idx'),
+            # 校验某用户是否为节点审批人
+            models.Index(fields=['approver', 'node'], name='wf_node_approver_user_idx'),
+            # 统计汇总按审批时间增量读取（见analytics.py）
+            models.Index(fields=['action_time'], name='wf_node_approver_time_idx'),
+        ]
+
+
+class EventFormValue(models.Model):
+    """
+    表单值索引。事件创建时将form_fields中有类型的字段值（按Component.DataType）投影到对应类型的列，
+    报表类查询（如第三季度请假超过3天）走(field_name, 值)索引，不必逐行解析form_fields。
+    event_id不设外键：事件归档后ID不变，热表和归档表共用本表；事件被删除后残留的行不影响过滤结果
+    """
+    COLUMNS = {
+        Component.DataType.INT: 'int_value',
+        Component.DataType.STR: 'str_value',
+        Component.DataType.DATA: 'date_value',
+        Component.DataType.DATETIME: 'datetime_value',
+    }
+
+    event_id = models.BigIntegerField(verbose_name='工作流事件ID')
+    workflow = models.ForeignKey('Workflow', on_delete=models.CASCADE, related_name='+', verbose_name='工作流')
+    field_name = models.CharField(max_length=64, verbose_name='字段名称')
+    int_value = models.BigIntegerField(null=True, blank=True, verbose_name='整数值')
+    str_value = models.CharField(max_length=255, null=True, blank=True, verbose_name='字符串值')
+    date_value = models.DateField(null=True, blank=True, verbose_name='日期值')
+    datetime_value = models.DateTimeField(null=True, blank=True, verbose_name='日期时间值')
+
+    class Meta:
+        db_table = 'wf_event_form_value'
+        verbose_name = '工作流事件表单值索引'
+        verbose_name_plural = verbose_name
+        # 字段名等值+值的等值/范围定位，带上workflow、event使按工作流过滤和取事件ID都无需回表
+        indexes = [
+            models.Index(fields=['field_name', 'int_value', 'workflow', 'event_id'], name='wf_form_value_int_idx'),
+            models.Index(fields=['field_name', 'str_value', 'workflow', 'event_id'], name='wf_form_value_str_idx'),
+            models.Index(fields=['field_name', 'date_value', 'workflow', 'event_id'], name='wf_form_value_date_idx'),
+            models.Index(fields=['field_name', 'datetime_value', 'workflow', 'event_id'], name='wf_form_value_datetime_idx'),
+            models.Index(fields=['event_id'], name='wf_form_value_event_idx'),
+        ]
+
+    @staticmethod
+    def to_python(data_type, value):
+        """将表单值（或查询参数）转为对应列的值，无法转换时抛出ValueError"""
+        if isinstance(value, (list, dict, bool)) or value is None:
+            raise ValueError(f'不支持的值：{value!r}')
+        if data_type == Component.DataType.INT:
+            return int(value)
+        if data_type == Component.DataType.STR:
+            value = str(value)
+            if len(value) > 255:
+                raise ValueError('字符串过长')
+            return value
+        if data_type == Component.DataType.DATA:
+            result = value if isinstance(value, datetime.date) else parse_date(str(value))
+        elif data_type == Component.DataType.DATETIME:
+            # form_values_to_json按当前时区格式化，不含时区信息；过滤时允许只传日期
+            result = parse_datetime(str(value)) or parse_date(str(value))
+            if result is not None and not isinstance(result, datetime.datetime):
+                result = datetime.datetime.combine(result, datetime.time())
+            if result is not None and timezone.is_naive(result):
+                result = timezone.make_aware(result)
+        else:
+            raise ValueError(f'未知的数据类型：{data_type}')
+        if result is None:
+            raise ValueError(f'格式有误：{value}')
+        return result
+
+    @classmethod
+    def build(cls, events, workflows: dict = None):
+        """生成一批事件（热表或归档表）的表单值索引行，workflows为{工作流ID: 工作流}，未传时按批查询"""
+        events = list(events)
+        if workflows is None:
+            workflows = Workflow.objects.only('id', 'form_version').in_bulk({event.workflow_id for event in events})
+        field_types = {}
+        rows = []
+        for event in events:
+            if event.workflow_id not in field_types:
+                field_types[event.workflow_id] = workflows[event.workflow_id].get_form_field_types()
+            types = field_types[event.workflow_id]
+            for name, value in (event.form_fields or {}).items():
+                if name not in types:
+                    continue
+                try:
+                    value = cls.to_python(types[name], value)
+                except (TypeError, ValueError):  # 多选等非标量值、超长字符串不建索引
+                    continue
+                rows.append(cls(event_id=event.id, workflow_id=event.workflow_id, field_name=name, **{cls.COLUMNS[types[name]]: value}))
+        return rows
+
+    @classmethod
+    def index_events(cls, events, workflows: dict = None):
+        """事件入库（已有ID）后，在同一事务中批量写入表单值索引"""
+        cls.objects.bulk_create(cls.build(events, workflows), batch_size=1000)
+
+    @classmethod
+    def reindex_events(cls, events, workflows: dict = None):
+        """表单值被修改（或需要重建）时，删除事件原有的索引行后重新写入，须在修改事件的事务中调用"""
+        events = list(events)
+        cls.objects.filter(event_id__in=[event.id for event in events]).delete()
+        cls.index_events(events, workflows)
+
+    @classmethod
+    def filter_events(cls, queryset, filters: list, workflow_id=None):
+        """
+        按表单值过滤事件（热表或归档表），filters: [(字段名, 查找方式, 原始值), ...]，查找方式为exact/gt/gte/lt/lte/in。
+        字段类型取自表单字段定义，传了workflow_id时只看该工作流；同名字段在各工作流中类型不同时，按能转换的类型取并集。
+        每个条件为一个id IN (索引子查询)，条件之间为且。值无法转换或字段不存在时抛出ValueError
+        """
+        if not filters:
+            return queryset
+        fields = FormField.objects.filter(field_name__in={name for name, _, _ in filters})
+        if workflow_id is not None:
+            fields = fields.filter(workflow_id=workflow_id)
+        field_types = {}
+        for name, data_type in fields.values_list('field_name', 'component__data_type').distinct():
+            field_types.setdefault(name, set()).add(data_type)
+
+        for name, lookup, raw in filters:
+            if name not in field_types:
+                raise ValueError(f'表单字段{name}不存在')
+            condition = models.Q()
+            for data_type in sorted(field_types[name]):
+                try:
+                    if lookup == 'in':
+                        value = [cls.to_python(data_type, item) for item in raw.split(',')]
+                    else:
+                        value = cls.to_python(data_type, raw)
+                except (TypeError, ValueError):
+                    continue
+                condition |= models.Q(**{'field_name': name, f'{cls.COLUMNS[data_type]}__{lookup}': value})
+            if not condition:
+                raise ValueError(f'表单字段{name}的值格式有误：{raw}')
+            values = cls.objects.filter(condition)
+            if workflow_id is not None:
+                values = values.filter(workflow_id=workflow_id)
+            queryset = queryset.filter(id__in=values.values('event_id'))
+        return queryset
+
+
+class OutboxMessage(models.Model):
+    """
+    事务性发件箱。审批信号的处理函数在审批事务中写入消息，事务提交后由run_outbox_worker异步投递（如发送邮件），
+    投递成功后删除；失败按指数退避重试，超过最大次数后标记为DEAD等待人工处理。
+    """
+    class State(models.TextChoices):
+        PENDING = 'PENDING', '待投递'
+        DEAD = 'DEAD', '投递失败'
+
+    topic = models.CharField(max_length=64, verbose_name='主题')
+    payload = models.JSONField(default=dict, blank=True, verbose_name='消息内容')
+    state = models.CharField(max_length=16, choices=State.choices, default=State.PENDING, verbose_name='状态')
+    attempts = models.PositiveIntegerField(default=0, verbose_name='已投递次数')
+    next_attempt_time = models.DateTimeField(default=timezone.now, verbose_name='下次投递时间')
+    last_error = models.TextField(default='', blank=True, verbose_name='最近一次错误')
+    create_time = models.DateTimeField(auto_now_add=True, verbose_name='创建时间')
+
+    class Meta:
+        db_table = 'wf_outbox'
+        verbose_name = '通知发件箱'
+        verbose_name_plural = verbose_name
+        indexes = [
+            models.Index(fields=['state', 'next_attempt_time'], name='wf_outbox_due_idx'),
+        ]
+
+    def __str__(self):
+        return f"{self.topic}-{self.id}"
+
+
+"""====================归档（冷数据）==================="""
+# 已结束且超过保留期的事件由archive_events命令连同节点、审批人移入以下归档表，ID保持不变，字段与热表一致。
+# 归档事件一定带有进度快照，读取时无需查询归档节点表；submit_key在归档后不再参与重复提交校验
+
+
+class ArchivedWorkflowEvent(models.Model):
+    """已归档的工作流事件"""
+    id = models.BigIntegerField(primary_key=True)
+    requester = models.ForeignKey('user.User', on_delete=models.CASCADE, related_name='archived_events', verbose_name='申请人')
+    workflow = models.ForeignKey('Workflow', on_delete=models.PROTECT, related_name='archived_events', verbose_name='工作流')
+    state = models.CharField(max_length=16, choices=State.choices, verbose_name='状态')
+    form_fields = models.JSONField(default=dict, blank=True, verbose_name='表单信息')
+    submit_key = models.CharField(max_length=64, null=True, blank=True, verbose_name='提交标识')
+    progress = models.JSONField(null=True, blank=True, editable=False, verbose_name='审批进度快照')
+    create_time = models.DateTimeField(verbose_name='创建时间')
+    update_time = models.DateTimeField(verbose_name='更新时间')
+    archive_time = models.DateTimeField(default=timezone.now, verbose_name='归档时间')
+
+    archived = True
+
+    class Meta:
+        db_table = 'wf_event_archive'
+        verbose_name = '工作流事件（归档）'
+        verbose_name_plural = verbose_name
+        indexes = [
+            models.Index(fields=['requester', 'create_time'], name='wf_event_archive_requester_idx'),
+            models.Index(fields=['create_time'], name='wf_event_archive_time_idx'),
+        ]
+
+    def __str__(self):
+        return f"{self.requester.username}-{self.workflow.name}-{self.get_state_display()}"
+
+    def node_process(self):
+        return self.progress or []
+
+
+class ArchivedWorkflowNode(models.Model):
+    """已归档的审批节点"""
+    id = models.BigIntegerField(primary_key=True)
+    event = models.ForeignKey('ArchivedWorkflowEvent', related_name='nodes', on_delete=models.CASCADE, verbose_name='工作流事件')
+    parent_id = models.BigIntegerField(null=True, blank=True, verbose_name='父节点ID')
+    mode = models.CharField(max_length=16, choices=WorkflowNode.Mode.choices, verbose_name='审批方式')
+    state = models.CharField(max_length=16, choices=State.choices, verbose_name='状态')
+    actor = models.ForeignKey('user.User', null=True, on_delete=models.SET_NULL, related_name='+', verbose_name='执行者')
+    action_time = models.DateTimeField(verbose_name='更新时间')
+    finish_time = models.DateTimeField(null=True, blank=True, verbose_name='审批完成时间')
+    create_time = models.DateTimeField(verbose_name='创建时间')
+    comment = models.CharField(max_length=256, null=True, blank=True, verbose_name='备注')
+
+    class Meta:
+        db_table = 'wf_node_archive'
+        verbose_name = '工作流节点（归档）'
+        verbose_name_plural = verbose_name
+
+
+class ArchivedNodeApprover(models.Model):
+    """已归档的审批节点-审批人"""
+    id = models.BigIntegerField(primary_key=True)
+    node = models.ForeignKey('ArchivedWorkflowNode', on_delete=models.CASCADE, verbose_name='节点')
+    approver = models.ForeignKey('user.User', on_delete=models.CASCADE, related_name='+', verbose_name='审批人')
+    action = models.CharField(max_length=16, choices=Action.choices, verbose_name='动作')
+    comment = models.CharField(max_length=256, null=True, blank=True, verbose_name='备注')
+    action_time = models.DateTimeField(null=True, blank=True, verbose_name='审批时间')
+
+    class Meta:
+        db_table = 'wf_node_approver_archive'
+        verbose_name = '审批节点-审批人（归档）'
+        verbose_name_plural = verbose_name
+
+
+"""====================统计汇总==================="""
+# 审批统计的汇总表，由rollup_stats命令按水位线增量更新（见analytics.py），统计接口只读汇总表，耗时与历史数据量无关。
+# 日期按当前时区（TIME_ZONE）划分
+
+
+class WorkflowDailyStat(models.Model):
+    """工作流每日统计"""
+    workflow = models.ForeignKey('Workflow', on_delete=models.CASCADE, related_name='+', verbose_name='工作流')
+    day = models.DateField(verbose_name='日期')
+    events_created = models.PositiveIntegerField(default=0, verbose_name='发起事件数')
+    events_approved = models.PositiveIntegerField(default=0, verbose_name='通过事件数')
+    events_rejected = models.PositiveIntegerField(default=0, verbose_name='驳回事件数')
+    nodes_approved = models.PositiveIntegerField(default=0, verbose_name='通过节点数')
+    nodes_rejected = models.PositiveIntegerField(default=0, verbose_name='驳回节点数')
+    approve_seconds = models.FloatField(default=0, verbose_name='节点通过总耗时（秒）', help_text='节点从进入审批到通过的耗时之和')
+
+    class Meta:
+        db_table = 'wf_stat_workflow_daily'
+        verbose_name = '工作流每日统计'
+        verbose_name_plural = verbose_name
+        unique_together = [('workflow', 'day')]
+        indexes = [
+            models.Index(fields=['day'], name='wf_stat_workflow_day_idx'),
+        ]
+
+
+class ApproverDailyStat(models.Model):
+    """审批人每日统计"""
+    approver = models.ForeignKey('user.User', on_delete=models.CASCADE, related_name='+', verbose_name='审批人')
+    workflow = models.ForeignKey('Workflow', on_delete=models.CASCADE, related_name='+', verbose_name='工作流')
+    day = models.DateField(verbose_name='日期')
+    approved = models.PositiveIntegerField(default=0, verbose_name='通过次数')
+    rejected = models.PositiveIntegerField(default=0, verbose_name='驳回次数')
+    response_seconds = models.FloatField(default=0, verbose_name='处理总耗时（秒）', help_text='节点进入审批到该审批人处理的耗时之和')
+
+    class Meta:
+        db_table = 'wf_stat_approver_daily'
+        verbose_name = '审批人每日统计'
+        verbose_name_plural = verbose_name
+        unique_together = [('approver', 'workflow', 'day')]
+        indexes = [
+            models.Index(fields=['workflow', 'day'], name='wf_stat_approver_wf_day_idx'),
+            models.Index(fields=['day'], name='wf_stat_approver_day_idx'),
+        ]
+
+
+class WorkflowBacklog(models.Model):
+    """工作流当前积压（审批中的节点），每次汇总时整体刷新"""
+    workflow = models.OneToOneField('Workflow', primary_key=True, on_delete=models.CASCADE, related_name='+', verbose_name='工作流')
+    processing_nodes = models.PositiveIntegerField(default=0, verbose_name='审批中节点数')
+    oldest_time = models.DateTimeField(verbose_name='等待最久的审批中节点进入审批的时间')
+
+    class Meta:
+        db_table = 'wf_stat_workflow_backlog'
+        verbose_name = '工作流积压'
+        verbose_name_plural = verbose_name
+
+
+class ApproverBacklog(models.Model):
+    """审批人当前积压（待我审批），每次汇总时整体刷新"""
+    approver = models.OneToOneField('user.User', primary_key=True, on_delete=models.CASCADE, related_name='+', verbose_name='审批人')
+    pending_nodes = models.PositiveIntegerField(default=0, verbose_name='待审批节点数')
+    oldest_time = models.DateTimeField(verbose_name='等待最久的待审批节点进入审批的时间')
+
+    class Meta:
+        db_table = 'wf_stat_approver_backlog'
+        verbose_name = '审批人积压'
+        verbose_name_plural = verbose_name
+
+
+class StatWatermark(models.Model):
+    """统计汇总的水位线：此时间之前（含）的审批、事件已计入汇总表"""
+    name = models.CharField(max_length=64, unique=True, verbose_name='名称')
+    value = models.DateTimeField(verbose_name='水位线')
+    update_time = models.DateTimeField(auto_now=True, verbose_name='更新时间')
+
+    class Meta:
+        db_table = 'wf_stat_watermark'
+        verbose_name = '统计水位线'
+        verbose_name_plural = verbose_name
+
+    def __str__(self):
+        return f'{self.name}-{self.value}'
@@ -0,0 +1,90 @@
+"""
+事务性发件箱。
+信号处理函数通过enqueue写入消息，与审批在同一事务中提交；通知的实际发送由handler注册的投递函数完成，
+run_outbox_worker命令调用drain按批取出到期消息投递，失败按指数退避重试，进程崩溃时未投递的消息仍留在表中。
+"""
+import datetime
+import logging
+import threading
+from contextlib import contextmanager
+
+from django.db import connection, transaction
+from django.utils import timezone
+
+from .models import OutboxMessage
+
+__all__ = ['handler', 'enqueue', 'collect', 'drain']
+
+logger = logging.getLogger(__name__)
+
+_handlers = {}
+_local = threading.local()
+
+
+def handler(topic):
+    """注册某个主题的投递函数，投递函数接收消息内容payload，抛出异常表示投递失败"""
+    def decorator(func):
+        _handlers[topic] = func
+        return func
+    return decorator
+
+
+def enqueue(topic, payload: dict):
+    """写入一条待投递消息，须在业务事务中调用；处于collect上下文中时先缓存，退出时批量写入"""
+    message = OutboxMessage(topic=topic, payload=payload)
+    buffer = getattr(_local, 'buffer', None)
+    if buffer is not None:
+        buffer.append(message)
+    else:
+        message.save()
+    return message
+
+
+@contextmanager
+def collect():
+    """批量审批等场景下，将上下文中产生的消息合并为一次批量插入"""
+    previous = getattr(_local, 'buffer', None)
+    _local.buffer = []
+    try:
+        yield
+        OutboxMessage.objects.bulk_create(_local.buffer)
+    finally:
+        _local.buffer = previous
+
+
+def backoff_seconds(attempts, base=10, maximum=3600):
+    """第attempts次失败后的重试间隔：base * 2^(attempts-1)，不超过maximum"""
+    return min(maximum, base * 2 ** (attempts - 1))
+
+
+def drain(batch_size=100, max_attempts=8, backoff_base=10, backoff_max=3600):
+    """
+    取出一批到期消息并投递，返回(取出数量, 投递成功数量)。
+    取出时对消息行加锁（数据库支持时跳过已被其他worker锁定的行），投递成功的消息删除，失败的更新重试时间。
+    """
+    now = timezone.now()
+    with transaction.atomic():
+        queryset = OutboxMessage.objects.filter(state=OutboxMessage.State.PENDING, next_attempt_time__lte=now).order_by('id')
+        queryset = queryset.select_for_update(skip_locked=connection.features.has_select_for_update_skip_locked)
+        messages = list(queryset[:batch_size])
+        delivered, failed = [], []
+        for message in messages:
+            func = _handlers.get(message.topic)
+            try:
+                if func is None:
+                    raise LookupError(f'未注册投递函数的消息主题：{message.topic}')
+                with transaction.atomic():
+                    func(message.payload)
+            except Exception as e:
+                logger.exception('发件箱消息投递失败：%s', message)
+                message.attempts += 1
+                message.last_error = repr(e)
+                message.next_attempt_time = now + datetime.timedelta(seconds=backoff_seconds(message.attempts, backoff_base, backoff_max))
+                if message.attempts >= max_attempts:
+                    message.state = OutboxMessage.State.DEAD
+                failed.append(message)
+            else:
+                delivered.append(message.id)
+        OutboxMessage.objects.filter(id__in=delivered).delete()
+        OutboxMessage.objects.bulk_update(failed, ['attempts', 'last_error', 'next_attempt_time', 'state'])
+    return len(messages), len(delivered)
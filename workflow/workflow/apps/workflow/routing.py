@@ -0,0 +1,238 @@
+"""
+审批链路由计划。
+将工作流的WorkflowChain树一次性编译为内存中的路由计划（有序分支、条件运算函数、审批人描述），
+按(工作流ID, 审批链版本)缓存在进程内LRU中，创建事件时单次遍历即可确定命中的审批路径，无需eval和逐层查询。
+命中路径的审批人由ApproverResolver按类型批量解析，角色成员、部门领导、人员各一次查询。
+"""
+import operator
+import typing
+
+from workflow.libs.utils.cache_util import LRUCache
+from workflow.apps.user.models import User, Department
+from .models import Workflow, WorkflowChain
+
+__all__ = ['ApproverSpec', 'Branch', 'RoutingPlan', 'compile_routing_plan', 'get_routing_plan',
+           'invalidate_routing_plan', 'invalidate_role_members', 'ApproverResolver']
+
+# WorkflowChain.operator返回的运算符与python运算函数的映射关系
+OPERATORS = {
+    '<': operator.lt,
+    '<=': operator.le,
+    '==': operator.eq,
+    '>': operator.gt,
+    '>=': operator.ge,
+}
+
+ROUTING_PLAN_CACHE_SIZE = 256
+# 角色成员缓存，本进程内由m2m_changed信号清除，其他进程依赖ttl过期
+ROLE_MEMBER_CACHE_SIZE = 1024
+ROLE_MEMBER_CACHE_TTL = 60
+
+_plan_cache = LRUCache(maxsize=ROUTING_PLAN_CACHE_SIZE)
+_role_member_cache = LRUCache(maxsize=ROLE_MEMBER_CACHE_SIZE, ttl=ROLE_MEMBER_CACHE_TTL)
+
+
+class ApproverSpec(typing.NamedTuple):
+    """审批人描述，只保存ID，在路由时按类型解析为具体用户"""
+    chain_id: int
+    type: str
+    person_id: typing.Optional[int]
+    role_id: typing.Optional[int]
+    department_id: typing.Optional[int]
+
+
+class Branch(object):
+    """路由计划中的一个分支，对应一个WorkflowChain节点"""
+    __slots__ = ('chain_id', 'field_name', 'operator', 'condition_value', 'mode', 'comment', 'approver', 'children')
+
+    def __init__(self, chain: WorkflowChain):
+        self.chain_id = chain.id
+        self.field_name = chain.form_field.field_name if chain.form_field_id else None
+        self.operator = OPERATORS.get(chain.operator) if self.field_name and chain.condition_value is not None else None
+        self.condition_value = chain.condition_value
+        self.mode = chain.mode
+        self.comment = chain.comment
+        self.approver = ApproverSpec(chain.id, chain.type, chain.person_id, chain.role_id, chain.department_id)
+        self.children = []
+
+    @property
+    def is_default(self):
+        """无条件分支：非条件分支节点或条件分支的最后一个默认分支"""
+        return self.operator is None
+
+    def match(self, form_fields: dict):
+        if self.is_default:
+            return True
+        actual_value = form_fields.get(self.field_name)
+        if actual_value is None:  # 表单未填写该字段，视为未命中
+            return False
+        return self.operator(int(actual_value), self.condition_value)
+
+
+class RoutingPlan(object):
+    """编译后的工作流审批链"""
+
+    def __init__(self, workflow_id, version, branches):
+        self.workflow_id = workflow_id
+        self.version = version
+        self.branches = branches
+
+    def route(self, form_fields: dict):
+        """根据表单值，返回命中的审批分支路径（从首节点到末节点）"""
+        path = []
+        branches = self.branches
+        while branches:
+            branch = next((b for b in branches if b.match(form_fields)), None)
+            if branch is None:
+                break
+            path.append(branch)
+            branches = branch.children
+        return path
+
+    def iter_branches(self):
+        """遍历计划中的所有分支"""
+        pending = list(reversed(self.branches))
+        while pending:
+            branch = pending.pop()
+            yield branch
+            pending.extend(reversed(branch.children))
+
+    @property
+    def elect_chain_ids(self):
+        """审批人类型为发起人自选的审批链节点ID"""
+        return [b.chain_id for b in self.iter_branches() if b.approver.type == WorkflowChain.Type.ELECT]
+
+
+def compile_routing_plan(workflow_id, version=0):
+    """一次查询取出整棵审批链，按parent分组并以rank排序，编译为路由计划"""
+    chains = WorkflowChain.objects.filter(workflow_id=workflow_id).select_related('form_field').order_by('rank', 'id')
+    branch_map = {chain.id: Branch(chain) for chain in chains}
+    roots = []
+    for chain in chains:
+        siblings = branch_map[chain.parent_id].children if chain.parent_id in branch_map else roots
+        siblings.append(branch_map[chain.id])
+
+    # 同级分支中rank最大的为默认分支，无论是否配置了条件都直接命中
+    pending = [roots]
+    while pending:
+        siblings = pending.pop()
+        if siblings:
+            siblings[-1].operator = None
+        pending.extend(b.children for b in siblings)
+    return RoutingPlan(workflow_id, version, roots)
+
+
+def get_routing_plan(workflow: Workflow):
+    """获取工作流的路由计划，缓存key带有审批链版本号，其他进程修改审批链后旧计划自然失效"""
+    key = (workflow.id, workflow.chain_version)
+    return _plan_cache.get_or_set(key, lambda: compile_routing_plan(workflow.id, workflow.chain_version))
+
+
+def invalidate_routing_plan(workflow_id):
+    """审批链被替换后，清除本进程中该工作流的所有路由计划"""
+    _plan_cache.invalidate(lambda key: str(key[0]) == str(workflow_id))
+
+
+def invalidate_role_members(role_ids=None):
+    """角色成员变更后清除本进程中的成员缓存，role_ids为None时全部清除；其他进程的缓存由ttl过期"""
+    if role_ids is None:
+        _role_member_cache.clear()
+        return
+    for role_id in role_ids:
+        _role_member_cache.pop(role_id)
+
+
+class ApproverResolver(object):
+    """
+    审批人解析器，返回审批人ID。
+    解析前先调用prefetch传入本次路由命中的所有审批人描述，按类型各用一次查询批量加载：
+    角色成员（进程内短期缓存）、部门领导、指定人员及自选审批人；未预加载的描述在resolve时再单独补查。
+    """
+
+    def __init__(self, known_user_ids=None):
+        self.known_user_ids = set(known_user_ids or ())  # 已确认存在的用户ID
+        self.checked_user_ids = set(self.known_user_ids)
+        self.role_members = {}  # role_id: [user_id, ...]
+        self.department_leaders = {}  # department_id: [leader_id]
+
+    def prefetch(self, specs, approvers: dict = None):
+        """批量加载specs所需的审批人，approvers为发起人自选的审批人{'chain_id': 'user_id'}"""
+        role_ids, department_ids, user_ids = set(), set(), set()
+        for spec in specs:
+            if spec.type == WorkflowChain.Type.ROLE and spec.role_id:
+                role_ids.add(spec.role_id)
+            elif spec.type == WorkflowChain.Type.DEPART_LEADER and spec.department_id:
+                department_ids.add(spec.department_id)
+            elif spec.type == WorkflowChain.Type.PERSON and spec.person_id:
+                user_ids.add(spec.person_id)
+            elif spec.type == WorkflowChain.Type.ELECT and approvers:
+                user_id = self.to_user_id(approvers.get(str(spec.chain_id)))
+                if user_id is not None:
+                    user_ids.add(user_id)
+        self.load_role_members(role_ids - self.role_members.keys())
+        self.load_department_leaders(department_ids - self.department_leaders.keys())
+        self.load_users(user_ids - self.checked_user_ids)
+
+    def load_role_members(self, role_ids):
+        missing = []
+        for role_id in role_ids:
+            members = _role_member_cache.get(role_id)
+            if members is None:
+                missing.append(role_id)
+            else:
+                self.role_members[role_id] = members
+        if not missing:
+            return
+        loaded = {role_id: [] for role_id in missing}
+        rows = User.groups.through.objects.filter(group_id__in=missing).order_by('user_id').values_list('group_id', 'user_id')
+        for role_id, user_id in rows:
+            loaded[role_id].append(user_id)
+        for role_id, members in loaded.items():
+            members = tuple(members)
+            _role_member_cache.set(role_id, members)
+            self.role_members[role_id] = members
+
+    def load_department_leaders(self, department_ids):
+        if not department_ids:
+            return
+        leaders = dict(Department.objects.filter(id__in=department_ids).values_list('id', 'leader_id'))
+        for department_id in department_ids:
+            self.department_leaders[department_id] = (leaders[department_id],) if department_id in leaders else ()
+
+    def load_users(self, user_ids):
+        if not user_ids:
+            return
+        self.known_user_ids |= set(User.objects.filter(id__in=user_ids).values_list('id', flat=True))
+        self.checked_user_ids |= user_ids
+
+    @staticmethod
+    def to_user_id(value):
+        try:
+            return int(value)
+        except (TypeError, ValueError):
+            return None
+
+    def existing_users(self, user_id):
+        if user_id is None:
+            return []
+        if user_id not in self.checked_user_ids:
+            self.load_users({user_id})
+        return [user_id] if user_id in self.known_user_ids else []
+
+    def resolve(self, spec: ApproverSpec, approvers: dict, requester_id):
+        """按审批人类型返回审批人ID列表，只使用该类型所需的数据"""
+        if spec.type == WorkflowChain.Type.SELF:
+            return [requester_id]
+        if spec.type == WorkflowChain.Type.ELECT:
+            return self.existing_users(self.to_user_id(approvers.get(str(spec.chain_id))))
+        if spec.type == WorkflowChain.Type.PERSON:
+            return self.existing_users(spec.person_id)
+        if spec.type == WorkflowChain.Type.ROLE and spec.role_id:
+            if spec.role_id not in self.role_members:
+                self.load_role_members({spec.role_id})
+            return list(self.role_members[spec.role_id])
+        if spec.type == WorkflowChain.Type.DEPART_LEADER and spec.department_id:
+            if spec.department_id not in self.department_leaders:
+                self.load_department_leaders({spec.department_id})
+            return list(self.department_leaders[spec.department_id])
+        return []
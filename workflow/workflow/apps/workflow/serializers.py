@@ -1,16 +1,34 @@
 import datetime
+import uuid
 
-from django.db import transaction
+from django.db import transaction, DatabaseError
+from django.db.models import F
+from django.utils import timezone
 from rest_framework import serializers
 from rest_framework.serializers import ModelSerializer
 
 from workflow.libs.frameworks.serializers import DisplayModelSerializer
+from workflow.apps.user.models import User, ResourceVersion
 from .models import *
+from .models import Action
+from .routing import invalidate_routing_plan, get_routing_plan, ApproverResolver
 from ..user.serializers import UserSerializer
 
 
 __all__ = ['ComponentSerializer', 'FormFieldSerializer', 'WorkFlowSerializer', 'WorkFlowChainSerializer',
-           'WorkFlowNodeSerializer', 'WorkflowEventSerializer']
+           'WorkFlowNodeSerializer', 'WorkflowNodeInboxSerializer', 'WorkflowNodeBatchActionSerializer', 'WorkflowEventSerializer',
+           'WorkflowEventBulkSerializer', 'StatQuerySerializer']
+
+
+def form_values_to_json(form_fields: dict):
+    """将特殊格式的值如DateTimeField/FileField/ForeignKey等转为可json序列化的值"""
+    for key, value in form_fields.items():
+        if isinstance(value, datetime.datetime):
+            form_fields[key] = value.strftime('%Y-%m-%d %H:%M:%S')
+        elif isinstance(value, datetime.date):
+            form_fields[key] = value.strftime('%Y-%m-%d')
+        # TODO 处理其他无法json序列化的字段
+    return form_fields
 
 
 class ComponentSerializer(ModelSerializer):
@@ -27,6 +45,7 @@ class FormFieldSerializer(ModelSerializer):
     class Meta:
         model = FormField
         fields = '__all__'
+        validators = []  # 创建时先删除该工作流的全部字段，字段名称是否重复由视图在请求数据内检查，不逐个查询数据库
         extra_kwargs = {
             'workflow': {'required': False},
             'component': {'required': False},
@@ -42,24 +61,47 @@ class WorkFlowSerializer(ModelSerializer):
 
 class WorkFlowChainListSerializer(serializers.ListSerializer):
     @classmethod
-    def recursion_create_chain(cls, validated_data, parent=None, created_chains=None):
-        """递归创建审批链节点"""
-        if created_chains is None:
-            created_chains = []
-        for data in validated_data:
-            serializer = WorkFlowChainSerializer(data=data)
-            serializer.is_valid(raise_exception=True)
-            children = data.pop('children', [])
-            chain = WorkflowChain.objects.create(parent=parent, **data)
-            created_chains.append(chain)
-            cls.recursion_create_chain(children, parent=chain, created_chains=created_chains)
+    def bulk_create_chain(cls, validated_data, workflow_id):
+        """
+        按层级批量创建审批链节点：同一层的节点一次插入、一次按ID顺序回查（插入前已清空该工作流的审批链），
+        查询数只与审批链深度有关
+        """
+        created_chains = []
+        level = [(None, data) for data in validated_data]  # [(父节点, 节点数据), ...]
+        while level:
+            chains, children = [], []
+            for parent, data in level:
+                serializer = WorkFlowChainSerializer(data=data)
+                serializer.is_valid(raise_exception=True)
+                data = dict(data)
+                children.append(data.pop('children', []))
+                chains.append(WorkflowChain(parent=parent, **data))
+            WorkflowChain.objects.bulk_create(chains)
+            if level[0][0] is None:
+                created = WorkflowChain.objects.filter(workflow_id=workflow_id, parent__isnull=True)
+            else:
+                created = WorkflowChain.objects.filter(parent__in=[parent for parent, _ in level])
+            for chain, chain_id in zip(chains, created.order_by('id').values_list('id', flat=True)):
+                chain.id = chain_id
+            created_chains.extend(chains)
+            level = [(chain, data) for chain, items in zip(chains, children) for data in items]
         return created_chains
 
+    def validate(self, attrs):
+        if len({data.get('workflow_id') for data in attrs}) > 1:
+            raise serializers.ValidationError('审批链节点须属于同一工作流')
+        return attrs
+
     def create(self, validated_data):
-        with transaction.atomic():
+        with transaction.atomic(), ResourceVersion.collect():
             workflow_id = validated_data[0].get('workflow_id', None) if len(validated_data) > 0 else None
+            # 递增审批链版本号，使各进程缓存的路由计划失效；先于替换执行，锁住工作流行，同一工作流的并发替换串行执行
+            Workflow.objects.filter(id=workflow_id).update(chain_version=F('chain_version') + 1)
             WorkflowChain.objects.filter(workflow_id=workflow_id).delete()  # 不支持编辑，想要修改流程链，走创建逻辑
-            return self.recursion_create_chain(validated_data)
+            created_chains = self.bulk_create_chain(validated_data, workflow_id)
+            ResourceVersion.bump(ResourceVersion.WORKFLOW)  # 批量插入不发送post_save信号
+            transaction.on_commit(lambda: invalidate_routing_plan(workflow_id))
+        return created_chains
 
 
 class WorkFlowChainSerializer(ModelSerializer):
@@ -78,12 +120,66 @@ class WorkFlowChainSerializer(ModelSerializer):
         list_serializer_class = WorkFlowChainListSerializer
 
 
+class WorkflowNodeEventSerializer(ModelSerializer):
+
+    class Meta:
+        model = WorkflowEvent
+        exclude = ('progress',)
+
+
 class WorkFlowNodeSerializer(ModelSerializer):
+    """关联对象须由查询预先select_related('event', 'actor')、prefetch_related('approvers')"""
+    event = WorkflowNodeEventSerializer(read_only=True, label='工作流事件')
+    actor = UserSerializer(read_only=True, label='执行者')
+    approvers = UserSerializer(many=True, read_only=True, label='审批人')
 
     class Meta:
         model = WorkflowNode
         fields = '__all__'
-        depth = 1
+        # 状态只能经审批接口修改（同时刷新事件的进度快照），修改接口只允许改备注
+        read_only_fields = ('state', 'mode', 'parent', 'action_time')
+
+
+class WorkflowNodeInboxEventSerializer(DisplayModelSerializer):
+    requester = UserSerializer(read_only=True, label='发起人')
+    workflow = WorkFlowSerializer(read_only=True, label='工作流')
+
+    class Meta:
+        model = WorkflowEvent
+        fields = ('id', 'requester', 'workflow', 'state', 'form_fields', 'create_time')
+
+
+class WorkflowNodeInboxSerializer(DisplayModelSerializer):
+    """待我审批的节点，只输出审批列表所需字段，关联对象须由查询预先select_related"""
+    event = WorkflowNodeInboxEventSerializer(read_only=True, label='工作流事件')
+
+    class Meta:
+        model = WorkflowNode
+        fields = ('id', 'event', 'parent', 'mode', 'state', 'comment', 'create_time')
+
+
+class WorkflowNodeBatchItemSerializer(serializers.Serializer):
+    id = serializers.IntegerField(label='节点ID')
+    comment = serializers.CharField(max_length=256, required=False, allow_null=True, allow_blank=True, label='备注')
+
+
+class WorkflowNodeBatchActionSerializer(serializers.Serializer):
+    """批量审批"""
+    action = serializers.ChoiceField(choices=[Action.APPROVED, Action.REJECTED], label='审批动作')
+    nodes = WorkflowNodeBatchItemSerializer(many=True, allow_empty=False, label='审批节点')
+
+    def validate_nodes(self, value):
+        if len({item['id'] for item in value}) != len(value):
+            raise serializers.ValidationError('节点ID重复')
+        return value
+
+
+class WorkflowEventListSerializer(serializers.ListSerializer):
+    def to_representation(self, data):
+        # 序列化前批量计算整页中尚无进度快照的事件的审批进度，避免逐行查询
+        events = list(data.all() if hasattr(data, 'all') else data)
+        WorkflowEvent.load_node_process([event for event in events if event.progress is None])
+        return super(WorkflowEventListSerializer, self).to_representation(events)
 
 
 class WorkflowEventSerializer(DisplayModelSerializer):
@@ -92,37 +188,36 @@ class WorkflowEventSerializer(DisplayModelSerializer):
     requester = UserSerializer(read_only=True, label='发起人')
     workflow_id = serializers.IntegerField(write_only=True, label='工作流ID')
     workflow = WorkFlowSerializer(read_only=True, label='工作流')
-    node_process = serializers.ListField(label='审批进度')
+    node_process = serializers.ListField(read_only=True, label='审批进度')
+    archived = serializers.BooleanField(read_only=True, label='是否已归档')
     chain_approver_dict = serializers.DictField(child=serializers.CharField(), allow_empty=True, allow_null=True, required=False, write_only=True)
 
     class Meta:
         model = WorkflowEvent
-        fields = '__all__'
-        read_only_fields = ('state',)
+        exclude = ('progress',)  # 进度快照通过node_process输出
+        read_only_fields = ('state', 'submit_key')
+        list_serializer_class = WorkflowEventListSerializer
 
     def __init__(self, *args, **kwargs):
         # 根据不同工作流，动态生成表单序列化器字段
+        # 视图已取出工作流时（OPTIONS元数据）通过context['form_workflow']传入
         super(WorkflowEventSerializer, self).__init__(*args, **kwargs)
-        workflow_id = None
-        if hasattr(self, 'initial_data'):
-            workflow_id = self.initial_data.get('workflow_id')
-        if not workflow_id:
-            return
-        wf = Workflow.objects.filter(id=workflow_id).first()
+        wf = self.context.get('form_workflow')
+        if wf is None:
+            workflow_id = None
+            if hasattr(self, 'initial_data'):
+                workflow_id = self.initial_data.get('workflow_id')
+            if not workflow_id:
+                return
+            wf = Workflow.objects.filter(id=workflow_id).first()
         if not wf:
             return
         self.fields['form_fields'] = wf.generate_form_serializer()()
 
     def to_internal_value(self, data):
-        # 将特殊格式的值如DateTimeField/FileField/ForeignKey等转为可json序列化的值
         result = super(WorkflowEventSerializer, self).to_internal_value(data)
         if 'form_fields' in result:
-            for key, value in result['form_fields'].items():
-                if isinstance(value, datetime.datetime):
-                    result['form_fields'][key] = value.strftime('%Y-%m-%d %H:%M:%S')
-                elif isinstance(value, datetime.date):
-                    result['form_fields'][key] = value.strftime('%Y-%m-%d')
-                # TODO 处理其他无法json序列化的字段
+            form_values_to_json(result['form_fields'])
         return result
 
     def validate_chain_approver_dict(self, value):
@@ -139,4 +234,167 @@ class WorkflowEventSerializer(DisplayModelSerializer):
         with transaction.atomic():
             instance = super(WorkflowEventSerializer, self).create(validated_data)
             WorkflowNode.generate_workflow_node(instance, chain_approver_dict)
+            EventFormValue.index_events([instance], {instance.workflow_id: instance.workflow})
+        return instance
+
+    def update(self, instance, validated_data):
+        """修改表单信息或工作流时，在同一事务中重建表单值索引"""
+        validated_data.pop('chain_approver_dict', None)
+        with transaction.atomic():
+            instance = super(WorkflowEventSerializer, self).update(instance, validated_data)
+            if 'form_fields' in validated_data or 'workflow_id' in validated_data:
+                EventFormValue.reindex_events([instance], {instance.workflow_id: instance.workflow})
         return instance
+
+
+class WorkflowEventBulkSerializer(serializers.Serializer):
+    """
+    批量提交工作流事件中的单个事件。
+    工作流、表单序列化器、路由计划、发起人等由submit预先按批加载后放在context中，逐项校验时不再查询数据库。
+    """
+    batch_size = 500
+
+    requester_id = serializers.IntegerField(label='发起人ID')
+    workflow_id = serializers.IntegerField(label='工作流ID')
+    form_fields = serializers.DictField(default=dict, label='表单信息')
+    chain_approver_dict = serializers.DictField(child=serializers.IntegerField(), allow_empty=True, allow_null=True, required=False)
+    submit_key = serializers.CharField(max_length=64, required=False, allow_null=True, label='提交标识')
+
+    def validate_requester_id(self, value):
+        if value not in self.context['user_ids']:
+            raise serializers.ValidationError('发起人不存在')
+        return value
+
+    def validate_workflow_id(self, value):
+        if value not in self.context['workflows']:
+            raise serializers.ValidationError('工作流不存在')
+        if not self.context['plans'][value].branches:
+            raise serializers.ValidationError('此工作流尚未设置审批链，请联系管理员配置审批链')
+        return value
+
+    def validate_submit_key(self, value):
+        if value and value in self.context['used_submit_keys']:
+            raise serializers.ValidationError('重复提交')
+        return value
+
+    def validate(self, attrs):
+        workflow_id = attrs['workflow_id']
+        form_serializer = self.context['form_serializers'][workflow_id](data=attrs['form_fields'])
+        if not form_serializer.is_valid():
+            raise serializers.ValidationError({'form_fields': form_serializer.errors})
+        attrs['form_fields'] = form_values_to_json(dict(form_serializer.validated_data))
+
+        chain_approver_dict = attrs.get('chain_approver_dict') or {}
+        for chain_id in self.context['plans'][workflow_id].elect_chain_ids:
+            if str(chain_id) not in chain_approver_dict:
+                raise serializers.ValidationError({'chain_approver_dict': f'自选审批人节点未指定审批人【chain_id:{chain_id}】'})
+            if chain_approver_dict[str(chain_id)] not in self.context['user_ids']:
+                raise serializers.ValidationError({'chain_approver_dict': f'自选审批人不存在【chain_id:{chain_id}】'})
+        attrs['chain_approver_dict'] = {k: str(v) for k, v in chain_approver_dict.items()}
+        if attrs.get('submit_key'):
+            self.context['used_submit_keys'].add(attrs['submit_key'])
+        return attrs
+
+    @classmethod
+    def build_context(cls, items: list):
+        """按批加载校验所需的数据，查询数与事件数量无关"""
+        def to_int_set(values):
+            ids = set()
+            for value in values:
+                try:
+                    ids.add(int(value))
+                except (TypeError, ValueError):
+                    pass
+            return ids
+
+        user_ids = to_int_set(item.get('requester_id') for item in items)
+        for item in items:
+            if isinstance(item.get('chain_approver_dict'), dict):
+                user_ids |= to_int_set(item['chain_approver_dict'].values())
+        submit_keys = [item['submit_key'] for item in items if isinstance(item.get('submit_key'), str)]
+
+        workflows = Workflow.objects.in_bulk(to_int_set(item.get('workflow_id') for item in items))
+        return {
+            'workflows': workflows,
+            'form_serializers': {wf_id: wf.generate_form_serializer() for wf_id, wf in workflows.items()},
+            'plans': {wf_id: get_routing_plan(wf) for wf_id, wf in workflows.items()},
+            'user_ids': set(User.objects.filter(id__in=user_ids).values_list('id', flat=True)),
+            'used_submit_keys': set(WorkflowEvent.objects.filter(submit_key__in=submit_keys).values_list('submit_key', flat=True)),
+        }
+
+    @classmethod
+    def submit(cls, items: list):
+        """
+        批量提交工作流事件，返回与items一一对应的结果：
+            成功：{'index': 0, 'success': True, 'id': 1, 'submit_key': 'xxx'}
+            失败：{'index': 1, 'success': False, 'errors': {...}}
+        校验通过的事件每batch_size个为一批，在同一事务中批量写入事件、审批节点和审批人。
+        """
+        context = cls.build_context([item for item in items if isinstance(item, dict)])
+        results = [None] * len(items)
+        valid_items = []
+        for index, item in enumerate(items):
+            serializer = cls(data=item, context=context)
+            if serializer.is_valid():
+                valid_items.append((index, serializer.validated_data))
+            else:
+                results[index] = {'index': index, 'success': False, 'errors': serializer.errors}
+
+        resolver = ApproverResolver(known_user_ids=context['user_ids'])
+        for start in range(0, len(valid_items), cls.batch_size):
+            batch = valid_items[start:start + cls.batch_size]
+            try:
+                events = cls.create_batch(batch, context, resolver)
+            except DatabaseError as e:
+                for index, _ in batch:
+                    results[index] = {'index': index, 'success': False, 'errors': {'non_field_errors': [str(e)]}}
+                continue
+            for (index, _), event in zip(batch, events):
+                results[index] = {'index': index, 'success': True, 'id': event.id, 'submit_key': event.submit_key}
+        return results
+
+    @classmethod
+    def create_batch(cls, batch: list, context: dict, resolver: ApproverResolver):
+        """批量写入一批事件及其审批节点、表单值索引"""
+        events = [
+            WorkflowEvent(requester_id=data['requester_id'], workflow_id=data['workflow_id'], form_fields=data['form_fields'],
+                          submit_key=data.get('submit_key') or uuid.uuid4().hex)
+            for _, data in batch
+        ]
+        with transaction.atomic():
+            WorkflowEvent.objects.bulk_create(events)
+            # 部分数据库(如MySQL)批量插入后不返回主键，通过submit_key回查
+            id_map = dict(WorkflowEvent.objects.filter(submit_key__in=[e.submit_key for e in events]).values_list('submit_key', 'id'))
+            paths = []
+            for event in events:
+                event.id = id_map[event.submit_key]
+                paths.append(context['plans'][event.workflow_id].route(event.form_fields))
+            # 整批命中的审批人一次性预加载，自选审批人已在build_context中校验过（known_user_ids）
+            resolver.prefetch(branch.approver for path in paths for branch in path)
+            routed_events = [
+                (event, [(branch, resolver.resolve(branch.approver, data['chain_approver_dict'], event.requester_id)) for branch in path])
+                for event, path, (_, data) in zip(events, paths, batch)
+            ]
+            WorkflowNode.bulk_generate_workflow_node(routed_events)
+            EventFormValue.index_events(events, context.get('workflows'))
+        return events
+
+
+class StatQuerySerializer(serializers.Serializer):
+    """统计接口的查询参数，日期范围默认为截至今天的最近30天"""
+    default_days = 30
+    max_days = 366
+
+    start = serializers.DateField(required=False, label='开始日期')
+    end = serializers.DateField(required=False, label='结束日期')
+    workflow_id = serializers.IntegerField(required=False, label='工作流ID')
+    approver_id = serializers.IntegerField(required=False, label='审批人ID')
+
+    def validate(self, attrs):
+        end = attrs.setdefault('end', timezone.localdate())
+        start = attrs.setdefault('start', end - datetime.timedelta(days=self.default_days - 1))
+        if start > end:
+            raise serializers.ValidationError('开始日期不能晚于结束日期')
+        if (end - start).days >= self.max_days:
+            raise serializers.ValidationError(f'日期范围不能超过{self.max_days}天')
+        return attrs
@@ -1,6 +1,11 @@
-
+from django.db import transaction
 from django.dispatch import receiver, Signal
-from django.db.models.signals import post_save, pre_save
+from django.db.models.signals import post_save, pre_save, post_delete, m2m_changed
+
+from workflow.apps.user.models import User, ResourceVersion
+from . import outbox
+from .models import WorkflowEvent, Workflow, FormField, WorkflowChain, Component
+from .routing import invalidate_role_members
 
 """====================信号定义==================="""
 node_approved = Signal()
@@ -8,16 +13,59 @@ node_rejected = Signal()
 
 
 """====================信号捕获==================="""
+# 信号在审批事务中发送，处理函数只写入发件箱，通知的发送由run_outbox_worker异步完成，不占用审批请求的耗时
 
 
 @receiver(node_approved)
 def on_node_approved(sender, instance, **kwargs):
-    # 发送邮件给申请者
-    print('发送邮件给申请者:你的审批已经通过了xxx的审批', instance.event.requester.email)
-    # 发送邮件提醒给下一级审批者
-    # 更改工作流事件状态
+    outbox.enqueue('node_approved', {'node_id': instance.id, 'event_id': instance.event_id})
 
 
 @receiver(node_rejected)
 def on_node_rejected(sender, instance, **kwargs):
+    outbox.enqueue('node_rejected', {'node_id': instance.id, 'event_id': instance.event_id})
+
+
+@receiver(m2m_changed, sender=User.groups.through)
+def on_role_members_changed(sender, instance, action, reverse, pk_set, **kwargs):
+    """用户与角色关系变更后清除角色成员缓存：reverse为True时instance为角色，否则pk_set为角色ID"""
+    if action not in ('post_add', 'post_remove', 'post_clear'):
+        return
+    if reverse:
+        role_ids = [instance.pk]
+    else:
+        role_ids = None if action == 'post_clear' else list(pk_set)
+    transaction.on_commit(lambda: invalidate_role_members(role_ids))
+
+
+@receiver(post_save, sender=Workflow)
+@receiver(post_delete, sender=Workflow)
+@receiver(post_save, sender=FormField)
+@receiver(post_delete, sender=FormField)
+@receiver(post_save, sender=WorkflowChain)
+@receiver(post_delete, sender=WorkflowChain)
+def on_workflow_definition_changed(sender, **kwargs):
+    """工作流、表单字段、审批链写入时递增工作流资源版本，用于条件GET（批量替换表单/审批链时在ResourceVersion.collect()中合并为一次）"""
+    ResourceVersion.bump(ResourceVersion.WORKFLOW)
+
+
+@receiver(post_save, sender=Component)
+@receiver(post_delete, sender=Component)
+def on_component_changed(sender, **kwargs):
+    ResourceVersion.bump(ResourceVersion.COMPONENT)
+
+
+"""====================消息投递==================="""
+
+
+@outbox.handler('node_approved')
+def notify_node_approved(payload):
+    event = WorkflowEvent.objects.select_related('requester').get(id=payload['event_id'])
+    # 发送邮件给申请者
+    print('发送邮件给申请者:你的审批已经通过了xxx的审批', event.requester.email)
+    # 发送邮件提醒给下一级审批者
+
+
+@outbox.handler('node_rejected')
+def notify_node_rejected(payload):
     pass
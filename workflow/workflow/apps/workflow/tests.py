@@ -1,3 +1,858 @@
-from django.test import TestCase
+import datetime
+import io
+import json
+import os
+import subprocess
+import sys
+import tempfile
+import time
+import unittest
+from unittest import mock
 
-# Create your tests here.
+from django.conf import settings
+from django.contrib.auth.models import Group
+from django.core.management import call_command, CommandError
+from django.db import connection
+from django.db.models import Case, Count, Max, When
+from django.test import TestCase, override_settings
+from django.utils import timezone
+from rest_framework.test import APIClient
+
+from workflow.apps.user.models import User, Department
+from workflow.libs.frameworks import metadata
+from workflow.libs.frameworks.middleware import ProfilingMiddleware
+from workflow.libs.utils.metrics_util import registry
+from workflow.libs.utils.test_util import QueryBudgetMixin
+from .models import *
+from .models import Action, State, NodeApprover, NodeActionContext, ArchivedWorkflowEvent, ArchivedWorkflowNode, ArchivedNodeApprover
+from . import outbox
+from . import analytics, archive, models, routing
+from .routing import get_routing_plan, ApproverResolver, invalidate_role_members
+
+
+class CacheIsolatedTestCase(TestCase):
+    """进程内缓存的key含数据库ID，测试回滚后ID会被复用，每个测试类和测试前后都须清除"""
+
+    @staticmethod
+    def clear_process_caches():
+        models._form_serializer_cache.clear()
+        routing._plan_cache.clear()
+        routing._role_member_cache.clear()
+        metadata._metadata_cache.clear()
+
+    @classmethod
+    def setUpClass(cls):
+        cls.clear_process_caches()
+        super(CacheIsolatedTestCase, cls).setUpClass()
+
+    def setUp(self):
+        super(CacheIsolatedTestCase, self).setUp()
+        self.clear_process_caches()
+        self.addCleanup(self.clear_process_caches)
+
+
+class WorkflowFixtureMixin(object):
+    """
+    请假工作流：days >= 3 时 部门领导(会签) --> HR角色(会签)，否则 HR角色(或签)
+    """
+
+    @classmethod
+    def create_fixture(cls):
+        cls.requester = User.objects.create(username='requester')
+        cls.leader = User.objects.create(username='leader')
+        cls.hr1 = User.objects.create(username='hr1')
+        cls.hr2 = User.objects.create(username='hr2')
+        cls.outsider = User.objects.create(username='outsider')
+        cls.hr = Group.objects.create(name='hr')
+        cls.hr.user_set.add(cls.hr1, cls.hr2)
+        cls.department = Department.objects.create(name='研发部', code='rd', leader=cls.leader)
+
+        cls.workflow = Workflow.objects.create(name='请假')
+        component = Component.objects.create(name='天数', ui_type=Component.UIType.INPUT, data_type=Component.DataType.INT)
+        cls.days = FormField.objects.create(field_name='days', component=component, workflow=cls.workflow, rank=1, required=True)
+        long_leave = WorkflowChain.objects.create(workflow=cls.workflow, form_field=cls.days, condition=WorkflowChain.Condition.GTE,
+                                                  condition_value=3, rank=1, type=WorkflowChain.Type.DEPART_LEADER,
+                                                  department=cls.department)
+        WorkflowChain.objects.create(workflow=cls.workflow, parent=long_leave, rank=1, type=WorkflowChain.Type.ROLE,
+                                     role=cls.hr, mode=WorkflowChain.Mode.AND)
+        WorkflowChain.objects.create(workflow=cls.workflow, rank=2, type=WorkflowChain.Type.ROLE, role=cls.hr,
+                                     mode=WorkflowChain.Mode.OR)
+
+    def create_event(self, days):
+        event = WorkflowEvent.objects.create(requester=self.requester, workflow=self.workflow, form_fields={'days': days})
+        WorkflowNode.generate_workflow_node(event, {})
+        return event
+
+    def get_nodes(self, event):
+        return list(WorkflowNode.objects.filter(event=event).order_by('id'))
+
+
+class WorkflowNodeActionTestCase(WorkflowFixtureMixin, CacheIsolatedTestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.create_fixture()
+
+    def assertProgressSnapshot(self, event):
+        event = WorkflowEvent.objects.get(id=event.id)
+        snapshot = event.progress
+        WorkflowEvent.load_node_process([event])
+        self.assertEqual(snapshot, event._node_process)
+
+    def test_backfill_progress_command(self):
+        event = self.create_event(days=5)
+        WorkflowEvent.objects.filter(id=event.id).update(progress=[])
+        with self.assertRaises(CommandError):
+            call_command('backfill_event_progress', verify=True, stdout=io.StringIO())
+        call_command('backfill_event_progress', stdout=io.StringIO())
+        call_command('backfill_event_progress', verify=True, stdout=io.StringIO())
+        self.assertProgressSnapshot(event)
+
+    def test_node_update_keeps_state(self):
+        event = self.create_event(days=1)
+        node, = self.get_nodes(event)
+        client = APIClient()
+        client.force_authenticate(self.hr1)
+        response = client.patch(f'/api/v1/workflow/workflow_nodes/{node.id}/', {'state': State.APPROVED, 'comment': '备注'}, format='json')
+        self.assertEqual((response.status_code, response.data['state'], response.data['comment']), (200, State.PROCESSING, '备注'))
+        self.assertProgressSnapshot(event)
+
+    def test_and_chain_flow(self):
+        event = self.create_event(days=5)
+        first, second = self.get_nodes(event)
+        self.assertEqual((first.state, second.state), (State.PROCESSING, State.PENDING))
+
+        first.approve(self.leader)
+        event.refresh_from_db()
+        second.refresh_from_db()
+        self.assertEqual((event.state, second.state), (State.PROCESSING, State.PROCESSING))
+
+        second.approve(self.hr1)
+        event.refresh_from_db()
+        second.refresh_from_db()
+        self.assertEqual((event.state, second.state), (State.PROCESSING, State.PROCESSING))
+
+        second.approve(self.hr2)
+        event.refresh_from_db()
+        second.refresh_from_db()
+        self.assertEqual((event.state, second.state), (State.APPROVED, State.APPROVED))
+        self.assertProgressSnapshot(event)
+
+    def test_or_node_approved_by_one_member(self):
+        event = self.create_event(days=1)
+        node, = self.get_nodes(event)
+        node.approve(self.hr2)
+        event.refresh_from_db()
+        self.assertEqual(event.state, State.APPROVED)
+        with self.assertRaisesMessage(Exception, '已被或签成员审批'):
+            WorkflowNode.objects.get(id=node.id).approve(self.hr1)
+        self.assertProgressSnapshot(event)
+
+    def test_reject_ends_event(self):
+        event = self.create_event(days=5)
+        first, second = self.get_nodes(event)
+        first.approve(self.leader)
+        second.refresh_from_db()
+        second.reject(self.hr1, comment='不批')
+        event.refresh_from_db()
+        self.assertEqual(event.state, State.REJECTED)
+        self.assertEqual(NodeApprover.objects.get(node=second, approver=self.hr1).comment, '不批')
+        with self.assertRaisesMessage(Exception, '当前节点不在审批中'):
+            WorkflowNode.objects.get(id=second.id).approve(self.hr2)
+        self.assertProgressSnapshot(event)
+
+    def test_invalid_actions(self):
+        event = self.create_event(days=5)
+        first, second = self.get_nodes(event)
+        with self.assertRaisesMessage(Exception, '不是审批人'):
+            first.approve(self.outsider)
+        with self.assertRaisesMessage(Exception, '父节点审批尚未通过'):
+            second.approve(self.hr1)
+        first.approve(self.leader)
+        with self.assertRaisesMessage(Exception, '下一节点已经审批完成'):
+            WorkflowNode.objects.get(id=first.id).reject(self.leader)
+
+    def test_approve_query_budget(self):
+        event = self.create_event(days=5)
+        first, second = self.get_nodes(event)
+        # 加锁读节点+事件、当前用户的审批人记录及各动作数量、上下游节点，更新审批人、节点、子节点、事件，写入发件箱，外加savepoint
+        with self.assertNumQueries(10):
+            first.approve(self.leader)
+        second = WorkflowNode.objects.get(id=second.id)
+        with self.assertNumQueries(9):
+            second.approve(self.hr1)
+        second = WorkflowNode.objects.get(id=second.id)
+        with self.assertNumQueries(9):
+            second.reject(self.hr2)
+
+    def test_batch_action(self):
+        events = [self.create_event(days=5) for _ in range(3)]
+        first_nodes = [self.get_nodes(event)[0] for event in events]
+        comments = {node.id: f'同意{node.id}' for node in first_nodes}
+        comments[0] = None
+        with self.assertNumQueries(10):
+            results = WorkflowNode.batch_action(self.leader, Action.APPROVED, comments)
+        self.assertEqual([r['success'] for r in results], [True, True, True, False])
+        self.assertEqual(results[-1]['msg'], '节点不存在')
+        for event, node in zip(events, first_nodes):
+            event.refresh_from_db()
+            self.assertEqual(event.state, State.PROCESSING)
+            self.assertEqual(NodeApprover.objects.get(node=node).comment, f'同意{node.id}')
+            self.assertEqual([n.state for n in self.get_nodes(event)], [State.APPROVED, State.PROCESSING])
+            self.assertProgressSnapshot(event)
+
+        second_nodes = [self.get_nodes(event)[1] for event in events]
+        results = WorkflowNode.batch_action(self.hr1, Action.REJECTED, {node.id: None for node in second_nodes})
+        self.assertTrue(all(r['success'] for r in results))
+        results = WorkflowNode.batch_action(self.hr2, Action.APPROVED, {node.id: None for node in second_nodes})
+        self.assertEqual({r['msg'] for r in results}, {'当前节点不在审批中'})
+        self.assertEqual(set(WorkflowEvent.objects.filter(id__in=[e.id for e in events]).values_list('state', flat=True)), {State.REJECTED})
+
+
+class ApproverResolverTestCase(WorkflowFixtureMixin, CacheIsolatedTestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.create_fixture()
+
+    def test_prefetch_batches_by_type(self):
+        plan = get_routing_plan(self.workflow)
+        resolver = ApproverResolver()
+        with self.assertNumQueries(2):  # 角色成员、部门领导各一次
+            resolver.prefetch(branch.approver for branch in plan.iter_branches())
+        with self.assertNumQueries(0):
+            path = plan.route({'days': 5})
+            self.assertEqual([resolver.resolve(b.approver, {}, self.requester.id) for b in path],
+                             [[self.leader.id], [self.hr1.id, self.hr2.id]])
+        with self.assertNumQueries(1):  # 角色成员已缓存
+            ApproverResolver().prefetch(branch.approver for branch in plan.iter_branches())
+
+    def test_role_member_cache_invalidated_on_group_change(self):
+        plan = get_routing_plan(self.workflow)
+        role_spec = plan.route({'days': 1})[0].approver
+        ApproverResolver().prefetch([role_spec])
+        with self.captureOnCommitCallbacks(execute=True):
+            self.hr.user_set.add(self.outsider)
+        resolver = ApproverResolver()
+        self.assertEqual(resolver.resolve(role_spec, {}, None), [self.hr1.id, self.hr2.id, self.outsider.id])
+        with self.captureOnCommitCallbacks(execute=True):
+            self.hr1.groups.remove(self.hr)
+        self.assertEqual(ApproverResolver().resolve(role_spec, {}, None), [self.hr2.id, self.outsider.id])
+
+
+@override_settings(MIDDLEWARE=['workflow.libs.frameworks.middleware.ProfilingMiddleware'] + settings.MIDDLEWARE)
+class ProfilingMiddlewareTestCase(WorkflowFixtureMixin, CacheIsolatedTestCase):
+    client_class = APIClient
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.create_fixture()
+
+    def test_server_timing_and_slow_query_stack(self):
+        self.create_event(days=5)
+        self.client.force_authenticate(self.requester)
+        with mock.patch.object(ProfilingMiddleware, 'slow_query_ms', 0), self.assertLogs('workflow.profiling', 'WARNING') as logs:
+            response = self.client.get('/api/v1/workflow/workflow_events/')
+        timings = dict(item.split(';', 1)[0:2] for item in response['Server-Timing'].split(', '))
+        self.assertEqual(set(timings), {'total', 'view', 'serialize', 'render', 'db'})
+        record = json.loads(logs.records[0].getMessage())
+        self.assertEqual((record['status'], record['queries']), (200, len(record['slow_queries'])))
+        self.assertTrue(any('apps/workflow' in frame for query in record['slow_queries'] for frame in query['stack']))
+
+    def test_sampling(self):
+        self.client.force_authenticate(self.requester)
+        with mock.patch.object(ProfilingMiddleware, 'sample_rate', 0):
+            response = self.client.get('/api/v1/workflow/workflows/')
+        self.assertNotIn('Server-Timing', response)
+
+
+class MetricsTestCase(WorkflowFixtureMixin, CacheIsolatedTestCase):
+    client_class = APIClient
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.create_fixture()
+
+    def get_metrics(self):
+        response = self.client.get('/metrics')
+        self.assertEqual(response.status_code, 200)
+        samples = {}
+        for line in response.content.decode().splitlines():
+            if line and not line.startswith('#'):
+                name, value = line.rsplit(' ', 1)
+                samples[name] = float(value)
+        return samples
+
+    def test_counters_and_backlog(self):
+        before = self.get_metrics()
+        with self.captureOnCommitCallbacks(execute=True):
+            event = self.create_event(days=1)
+        node, = self.get_nodes(event)
+        after_create = self.get_metrics()
+        self.assertEqual(after_create[f'workflow_processing_nodes{{workflow="{self.workflow.id}"}}'], 1)
+        self.assertGreaterEqual(after_create['workflow_oldest_processing_node_age_seconds'], 0)
+
+        self.client.force_authenticate(self.hr1)
+        with self.captureOnCommitCallbacks(execute=True):
+            self.client.post(f'/api/v1/workflow/workflow_nodes/{node.id}/approve/', {}, format='json')
+        after = self.get_metrics()
+        created = f'workflow_events_created_total{{workflow="{self.workflow.id}"}}'
+        approved = 'workflow_node_actions_total{action="APPROVED"}'
+        latency = 'workflow_node_action_seconds_count{action="APPROVED"}'
+        request = 'workflow_http_request_seconds_count{view="WorkflowNodeViewSet",action="approve_view",method="POST",status="2xx"}'
+        for name in (created, approved, latency, request):
+            self.assertEqual(after.get(name, 0) - before.get(name, 0), 1, name)
+        self.assertNotIn(f'workflow_processing_nodes{{workflow="{self.workflow.id}"}}', after)
+
+    def test_backlog_age_counts_from_processing_start(self):
+        event = self.create_event(days=5)
+        first, second = self.get_nodes(event)
+        WorkflowNode.objects.filter(event=event).update(create_time=timezone.now() - datetime.timedelta(days=2))
+        first.approve(self.leader)
+        self.assertLess(self.get_metrics()['workflow_oldest_processing_node_age_seconds'], 3600)
+
+    def test_merge_process_files(self):
+        event = self.create_event(days=1)
+        with self.captureOnCommitCallbacks(execute=True):
+            self.get_nodes(event)[0].approve(self.hr1)
+        with tempfile.TemporaryDirectory() as directory, override_settings(METRICS_DIR=directory):
+            self.client.get('/metrics')
+            with open(os.path.join(directory, f'{os.getpid()}.json')) as f:
+                snapshot = json.load(f)
+            with open(os.path.join(directory, '0.json'), 'w') as f:  # 模拟另一个worker进程
+                json.dump(snapshot, f)
+            counter = registry.metrics['workflow_node_actions_total']
+            self.assertEqual(registry.load()['workflow_node_actions_total'], {key: 2 * value for key, value in counter.values.items()})
+
+    def test_idle_worker_flushes_pending_updates(self):
+        counter = registry.metrics['workflow_node_actions_total']
+        with tempfile.TemporaryDirectory() as directory, override_settings(METRICS_DIR=directory, METRICS_FLUSH_INTERVAL=0.2):
+            registry.flush()
+            counter.inc(action=Action.APPROVED)  # 距上次写入不足间隔，由定时器补写
+            expected = counter.values[(Action.APPROVED,)]
+            time.sleep(0.5)  # 本进程之后不再有更新
+            script = (
+                'import json, django; django.setup()\n'
+                'from django.conf import settings; settings.METRICS_DIR = %r\n'
+                'from workflow.apps.workflow import metrics\n'
+                'from workflow.libs.utils.metrics_util import registry\n'
+                'print(json.dumps(registry.load()["workflow_node_actions_total"].get(("APPROVED",), 0)))'
+            ) % directory
+            root = os.path.dirname(os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__)))))
+            env = dict(os.environ, PYTHONPATH=os.pathsep.join([root, os.environ.get('PYTHONPATH', '')]))
+            output = subprocess.run([sys.executable, '-c', script], env=env, capture_output=True, text=True, check=True).stdout
+        self.assertEqual(json.loads(output), expected)
+
+
+class OutboxTestCase(WorkflowFixtureMixin, CacheIsolatedTestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.create_fixture()
+
+    def test_signals_write_outbox_and_drain_delivers(self):
+        event = self.create_event(days=1)
+        node, = self.get_nodes(event)
+        node.approve(self.hr1)
+        message = OutboxMessage.objects.get()
+        self.assertEqual((message.topic, message.payload), ('node_approved', {'node_id': node.id, 'event_id': event.id}))
+
+        self.assertEqual(outbox.drain(), (1, 1))
+        self.assertFalse(OutboxMessage.objects.exists())
+
+    def test_failed_delivery_backs_off_then_dies(self):
+        calls = []
+        self.addCleanup(outbox._handlers.pop, 'test_failure', None)
+
+        @outbox.handler('test_failure')
+        def fail(payload):
+            calls.append(payload)
+            raise RuntimeError('smtp down')
+
+        outbox.enqueue('test_failure', {'n': 1})
+        with self.assertLogs(outbox.logger, 'ERROR'):
+            self.assertEqual(outbox.drain(max_attempts=2), (1, 0))
+        message = OutboxMessage.objects.get()
+        self.assertEqual((message.attempts, message.state), (1, OutboxMessage.State.PENDING))
+        self.assertIn('smtp down', message.last_error)
+        self.assertEqual(outbox.drain(max_attempts=2), (0, 0))  # 未到重试时间
+
+        OutboxMessage.objects.update(next_attempt_time=message.create_time)
+        with self.assertLogs(outbox.logger, 'ERROR'):
+            outbox.drain(max_attempts=2)
+        message.refresh_from_db()
+        self.assertEqual((message.attempts, message.state, len(calls)), (2, OutboxMessage.State.DEAD, 2))
+
+
+class MetadataTestCase(WorkflowFixtureMixin, CacheIsolatedTestCase):
+    client_class = APIClient
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.create_fixture()
+
+    def setUp(self):
+        super(MetadataTestCase, self).setUp()
+        self.client.force_authenticate(self.requester)
+
+    def test_cached_per_view(self):
+        response = self.client.options('/api/v1/workflow/components/')
+        self.assertIn('name', response.data['actions']['POST'])
+        with self.assertNumQueries(2):  # 只有ATOMIC_REQUESTS的savepoint
+            self.assertEqual(self.client.options('/api/v1/workflow/components/').data, response.data)
+        self.client.force_authenticate(None)
+        self.assertEqual(self.client.options('/api/v1/workflow/components/').status_code, 401)
+
+    def test_form_schema_versioned(self):
+        workflow = Workflow.objects.create(name='报销')  # 无审批链引用表单字段，可以替换表单
+        text = Component.objects.create(name='事由', ui_type=Component.UIType.INPUT, data_type=Component.DataType.STR)
+        FormField.objects.create(field_name='amount', component=self.days.component, workflow=workflow, rank=1)
+        url = f'/api/v1/workflow/workflow_events/?workflow_id={workflow.id}'
+        self.assertEqual(list(self.client.options(url).data['actions']['POST']['form_fields']['children']), ['amount'])
+        self.assertNotIn('children', self.client.options('/api/v1/workflow/workflow_events/').data['actions']['POST']['form_fields'])
+        with self.assertNumQueries(3):  # 查询表单版本，外加savepoint
+            self.client.options(url)
+
+        fields = [{'workflow_id': workflow.id, 'component_id': self.days.component_id, 'field_name': 'amount', 'rank': 1},
+                  {'workflow_id': workflow.id, 'component_id': text.id, 'field_name': 'reason', 'rank': 2}]
+        self.assertEqual(self.client.post('/api/v1/workflow/form_fields/', fields, format='json').status_code, 201)
+        children = self.client.options(url).data['actions']['POST']['form_fields']['children']
+        self.assertEqual(list(children), ['amount', 'reason'])
+
+
+class ArchiveTestCase(WorkflowFixtureMixin, CacheIsolatedTestCase):
+    client_class = APIClient
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.create_fixture()
+
+    def setUp(self):
+        super(ArchiveTestCase, self).setUp()
+        self.approved, self.rejected, self.processing = [self.create_event(days=1) for _ in range(3)]
+        WorkflowNode.objects.get(event=self.approved).approve(self.hr1)
+        WorkflowNode.objects.get(event=self.rejected).reject(self.hr2)
+        past = timezone.now() - datetime.timedelta(days=30)
+        for days, event in enumerate([self.approved, self.rejected, self.processing]):
+            WorkflowEvent.objects.filter(id=event.id).update(create_time=past + datetime.timedelta(days=days), update_time=past)
+        self.client.force_authenticate(self.requester)
+
+    def archive(self):
+        return call_command('archive_events', days=7, batch_size=1, stdout=io.StringIO())
+
+    def test_archive_batches(self):
+        before = timezone.now() - datetime.timedelta(days=7)
+        progress = WorkflowEvent.objects.get(id=self.approved.id).node_process()
+        self.assertEqual(archive.archive_batch(before, batch_size=1), 1)
+        self.assertEqual(archive.archive_batch(before, batch_size=5), 1)
+        self.assertEqual(archive.archive_batch(before, batch_size=5), 0)
+
+        self.assertEqual(list(WorkflowEvent.objects.values_list('id', flat=True)), [self.processing.id])
+        self.assertFalse(WorkflowNode.objects.exclude(event=self.processing).exists())
+        self.assertEqual(ArchivedWorkflowNode.objects.count(), 2)
+        self.assertEqual(ArchivedNodeApprover.objects.count(), 4)
+        self.assertEqual(ArchivedWorkflowEvent.objects.get(id=self.approved.id).node_process(), progress)
+
+    def test_read_paths(self):
+        self.archive()
+        url = '/api/v1/workflow/workflow_events/'
+        self.assertEqual([e['id'] for e in self.client.get(f'{url}?page_size=10').data['results']], [self.processing.id])
+        with self.assertNumQueries(6):  # 两边各COUNT和取一页，外加savepoint
+            results = self.client.get(f'{url}?include_archived=true&page_size=10').data['results']
+        self.assertEqual([(e['id'], e['archived']) for e in results],
+                         [(self.processing.id, False), (self.rejected.id, True), (self.approved.id, True)])
+        self.assertEqual(results[1]['node_process'][0]['node_state'], State.REJECTED)
+        results = self.client.get(f'{url}?include_archived=true&state=APPROVED&ordering=create_time&page_size=1&page=1').data
+        self.assertEqual([e['id'] for e in results['results']], [self.approved.id])
+
+        results = self.client.get(f'{url}my_event/?include_archived=true&page_size=10').data['results']
+        self.assertEqual(len(results), 3)
+        self.client.force_authenticate(self.hr1)
+        self.assertEqual(self.client.get(f'{url}my_event/?include_archived=true&page_size=10').data['results'], [])
+
+        self.assertEqual(self.client.get(f'{url}{self.approved.id}/').status_code, 404)
+        response = self.client.get(f'{url}{self.approved.id}/?include_archived=true')
+        self.assertEqual((response.status_code, response.data['state']), (200, State.APPROVED))
+
+
+class CursorPaginationTestCase(WorkflowFixtureMixin, CacheIsolatedTestCase):
+    client_class = APIClient
+    url = '/api/v1/workflow/workflow_events/?pagination=cursor&page_size=2'
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.create_fixture()
+
+    def setUp(self):
+        super(CursorPaginationTestCase, self).setUp()
+        self.events = [self.create_event(days=1) for _ in range(5)]
+        # 前4个事件创建时间相同，须按id继续定位
+        WorkflowEvent.objects.filter(id__in=[e.id for e in self.events[:4]]).update(create_time=self.events[0].create_time)
+        self.client.force_authenticate(self.requester)
+
+    def test_keyset_pages(self):
+        pages, url = [], self.url
+        while url:
+            with self.assertNumQueries(3) as context:  # 取一页，外加savepoint，没有COUNT
+                data = self.client.get(url).data
+            self.assertNotIn('OFFSET', ' '.join(query['sql'] for query in context.captured_queries))
+            pages.append(data)
+            url = data['next']
+        ids = [e['id'] for page in pages for e in page['results']]
+        self.assertEqual(ids, [self.events[4].id] + [e.id for e in reversed(self.events[:4])])
+        self.assertIsNone(pages[0]['previous'])
+
+        previous = self.client.get(pages[2]['previous']).data
+        self.assertEqual(previous['results'], pages[1]['results'])
+        self.assertEqual(self.client.get(previous['previous']).data['results'], pages[0]['results'])
+        self.assertEqual(self.client.get(f'{self.url}&cursor=bad').status_code, 404)
+
+
+class FormValueIndexTestCase(WorkflowFixtureMixin, CacheIsolatedTestCase):
+    client_class = APIClient
+    url = '/api/v1/workflow/workflow_events/'
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.create_fixture()
+        date = Component.objects.create(name='日期', ui_type=Component.UIType.DATEPICKER, data_type=Component.DataType.DATA)
+        text = Component.objects.create(name='类型', ui_type=Component.UIType.RADIO, data_type=Component.DataType.STR)
+        FormField.objects.create(field_name='start', component=date, workflow=cls.workflow, rank=2)
+        FormField.objects.create(field_name='type', component=text, workflow=cls.workflow, rank=3, choices=['婚假', '产假'])
+
+    def setUp(self):
+        super(FormValueIndexTestCase, self).setUp()
+        self.client.force_authenticate(self.requester)
+        self.events = [
+            self.client.post(self.url, {'requester_id': self.requester.id, 'workflow_id': self.workflow.id,
+                                        'form_fields': {'days': days, 'start': start, 'type': type_}}, format='json').data['id']
+            for days, start, type_ in [(1, '2021-07-01', '婚假'), (5, '2021-08-15', '产假'), (4, '2021-10-08', '婚假')]
+        ]
+
+    def query(self, params):
+        response = self.client.get(f'{self.url}?page_size=10&{params}')
+        return sorted(e['id'] for e in response.data['results'])
+
+    def test_projection(self):
+        values = EventFormValue.objects.filter(event_id=self.events[1]).order_by('field_name')
+        self.assertEqual([(v.field_name, v.int_value, v.str_value, v.date_value) for v in values],
+                         [('days', 5, None, None), ('start', None, None, datetime.date(2021, 8, 15)), ('type', None, '产假', None)])
+
+    def test_filters(self):
+        first, second, third = self.events
+        self.assertEqual(self.query('form.days__gt=3'), [second, third])
+        self.assertEqual(self.query(f'workflow_id={self.workflow.id}&form.days__gt=3&form.start__gte=2021-07-01&form.start__lt=2021-10-01'),
+                         [second])
+        self.assertEqual(self.query('form.type=婚假'), [first, third])
+        self.assertEqual(self.query('form.days__in=1,4'), [first, third])
+        self.assertEqual(self.client.get(f'{self.url}?form.days=abc').status_code, 400)
+        self.assertEqual(self.client.get(f'{self.url}?form.missing=1').status_code, 400)
+
+    def test_update_reindexes(self):
+        response = self.client.patch(f'{self.url}{self.events[0]}/', {'workflow_id': self.workflow.id, 'form_fields': {'days': 9}},
+                                     format='json')
+        self.assertEqual(response.status_code, 200, response.data)
+        self.assertEqual(self.query('form.days__gt=5'), [self.events[0]])
+        self.assertEqual(self.query('form.days__lt=5'), [self.events[2]])
+        self.assertEqual(self.query('form.type=婚假'), [self.events[2]])  # 未提交的字段不再保留索引
+
+    def test_archived_events(self):
+        WorkflowNode.objects.get(event_id=self.events[0]).approve(self.hr1)
+        WorkflowEvent.objects.filter(id=self.events[0]).update(update_time=timezone.now() - datetime.timedelta(days=30),
+                                                               create_time=timezone.now() - datetime.timedelta(days=30))
+        call_command('archive_events', days=7, stdout=io.StringIO())
+        self.assertEqual(self.query('form.type=婚假'), [self.events[2]])
+        self.assertEqual(self.query('form.type=婚假&include_archived=true'), [self.events[0], self.events[2]])
+
+    def test_rebuild_command(self):
+        EventFormValue.objects.all().delete()
+        call_command('index_form_values', stdout=io.StringIO())
+        self.assertEqual(EventFormValue.objects.count(), 9)
+        self.assertEqual(self.query('form.days__lte=4'), [self.events[0], self.events[2]])
+
+
+class AnalyticsTestCase(WorkflowFixtureMixin, CacheIsolatedTestCase):
+    client_class = APIClient
+    url = '/api/v1/workflow/workflow_stats/'
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.create_fixture()
+
+    def setUp(self):
+        super(AnalyticsTestCase, self).setUp()
+        self.short, self.long, self.pending = self.create_event(days=1), self.create_event(days=5), self.create_event(days=1)
+        WorkflowNode.objects.get(event=self.short).approve(self.hr1)
+        leader_node, hr_node = self.get_nodes(self.long)
+        leader_node.approve(self.leader)
+        WorkflowNode.objects.get(id=hr_node.id).approve(self.hr1)
+        WorkflowNode.objects.get(id=hr_node.id).reject(self.hr2)
+        self.client.force_authenticate(self.leader)
+
+    def workflow_stat(self):
+        return WorkflowDailyStat.objects.values(
+            'events_created', 'events_approved', 'events_rejected', 'nodes_approved', 'nodes_rejected').get(workflow=self.workflow)
+
+    def approver_stats(self):
+        return {stat.approver.username: (stat.approved, stat.rejected) for stat in ApproverDailyStat.objects.select_related('approver')}
+
+    def test_incremental_rollup(self):
+        watermark = analytics.rollup(lag=0)
+        self.assertEqual(self.workflow_stat(), {'events_created': 3, 'events_approved': 1, 'events_rejected': 1,
+                                                'nodes_approved': 2, 'nodes_rejected': 1})
+        self.assertEqual(self.approver_stats(), {'hr1': (2, 0), 'hr2': (0, 1), 'leader': (1, 0)})
+        self.assertEqual(WorkflowBacklog.objects.get().processing_nodes, 1)
+        self.assertEqual(dict(ApproverBacklog.objects.values_list('approver__username', 'pending_nodes')), {'hr1': 1, 'hr2': 1})
+
+        self.assertEqual(analytics.rollup(lag=0, now=watermark), watermark)  # 水位线之前的数据不重复计入
+        WorkflowNode.objects.get(event=self.pending).approve(self.hr2)
+        analytics.rollup(lag=0)
+        self.assertEqual(self.workflow_stat()['events_approved'], 2)
+        self.assertEqual(self.approver_stats()['hr2'], (1, 1))
+        self.assertFalse(WorkflowBacklog.objects.exists())
+        self.assertFalse(ApproverBacklog.objects.exists())
+
+        incremental = self.workflow_stat(), self.approver_stats()
+        analytics.rebuild(lag=0)
+        self.assertEqual((self.workflow_stat(), self.approver_stats()), incremental)
+
+    def test_backlog_starts_when_node_is_processing(self):
+        event = self.create_event(days=5)
+        leader_node, hr_node = self.get_nodes(event)
+        submitted = timezone.now() - datetime.timedelta(days=2)
+        WorkflowNode.objects.filter(event__in=[event, self.pending]).update(create_time=submitted)
+        leader_node.approve(self.leader)
+        analytics.rollup(lag=0)
+        self.assertEqual(WorkflowBacklog.objects.get().oldest_time, submitted)  # 首节点从创建时间算起
+        hr1_backlog = ApproverBacklog.objects.get(approver=self.hr1)
+        self.assertEqual(hr1_backlog.pending_nodes, 2)
+        self.assertEqual(hr1_backlog.oldest_time, submitted)
+        WorkflowNode.objects.get(event=self.pending).approve(self.hr1)
+        analytics.rollup(lag=0)
+        self.assertEqual(WorkflowBacklog.objects.get().oldest_time, WorkflowNode.objects.get(id=leader_node.id).finish_time)
+
+    def test_node_edit_not_counted_again(self):
+        watermark = analytics.rollup(lag=0)
+        before = self.workflow_stat(), self.approver_stats(), WorkflowDailyStat.objects.get().approve_seconds
+        node = WorkflowNode.objects.get(event=self.short)
+        self.assertEqual(self.client.patch(f'/api/v1/workflow/workflow_nodes/{node.id}/', {'comment': 'x'}).status_code, 200)
+        edited = WorkflowNode.objects.get(id=node.id)
+        self.assertEqual((edited.comment, edited.finish_time), ('x', node.finish_time))
+        self.assertGreater(edited.action_time, watermark)  # 更新时间已越过水位线
+        analytics.rollup(lag=0)
+        self.assertEqual((self.workflow_stat(), self.approver_stats(), WorkflowDailyStat.objects.get().approve_seconds), before)
+
+    def test_endpoints(self):
+        call_command('rollup_stats', once=True, lag=0, stdout=io.StringIO())
+        with self.assertNumQueries(5):  # 水位线、每日统计、积压，外加savepoint
+            data = self.client.get(self.url).data
+        self.assertIsNotNone(data['watermark'])
+        result, = data['results']
+        self.assertEqual((result['workflow_id'], result['events_created'], result['rejection_rate'], result['processing_nodes']),
+                         (self.workflow.id, 3, 0.5, 1))
+        self.assertGreaterEqual(result['avg_approve_seconds'], 0)
+
+        day, = self.client.get(f'{self.url}daily/?workflow_id={self.workflow.id}').data['results']
+        self.assertEqual((day['day'], day['nodes_approved']), (timezone.localdate(), 2))
+
+        approvers = {row['username']: row for row in self.client.get(f'{self.url}approvers/').data['results']}
+        self.assertEqual((approvers['hr2']['rejection_rate'], approvers['hr2']['pending_nodes']), (1.0, 1))
+        self.assertEqual(approvers['leader']['pending_nodes'], 0)
+        self.assertEqual(self.client.get(f'{self.url}?start=2021-10-01&end=2021-09-01').status_code, 400)
+        self.assertEqual(self.client.get(f'{self.url}?start=2020-01-01&end=2021-09-01').status_code, 400)
+
+
+@unittest.skipUnless(connection.vendor == 'sqlite', 'EXPLAIN输出格式依赖SQLite')
+class QueryPlanTestCase(CacheIsolatedTestCase):
+    """常用查询的执行计划，防止索引被删除或查询改写后退化为全表扫描/临时排序"""
+
+    def assertUsesIndex(self, queryset, index_name):
+        plan = queryset.explain()
+        self.assertIn(f'INDEX {index_name}', plan)
+        self.assertNotIn('USE TEMP B-TREE', plan)
+
+    def test_event_list(self):
+        self.assertUsesIndex(WorkflowEvent.objects.filter(requester_id=1).order_by('-create_time', '-id'), 'wf_event_requester_idx')
+        self.assertUsesIndex(WorkflowEvent.objects.filter(workflow_id=1, state=State.PROCESSING).order_by('-create_time'),
+                             'wf_event_workflow_state_idx')
+        self.assertUsesIndex(WorkflowEvent.objects.filter(state=State.PROCESSING).order_by('create_time'), 'wf_event_state_idx')
+        self.assertUsesIndex(WorkflowEvent.objects.order_by('-create_time', '-id'), 'wf_event_create_time_idx')
+
+    def test_node_lookups(self):
+        self.assertUsesIndex(WorkflowNode.objects.filter(event_id=1, state=State.PROCESSING), 'wf_node_event_state_idx')
+        self.assertUsesIndex(NodeApprover.objects.filter(node_id=1, action=Action.PENDING), 'wf_node_approver_node_idx')
+        self.assertUsesIndex(NodeApprover.objects.filter(approver_id=1, node_id=1), 'wf_node_approver_user_idx')
+
+    def test_action_context(self):
+        context = NodeActionContext.build([WorkflowNode(id=1)], 1)
+        queryset = NodeApprover.objects.filter(node_id__in=[1]).order_by().values('node_id', 'action').annotate(
+            count=Count('id'), mine=Max(Case(When(approver_id=1, then='id'))))
+        self.assertIn('COVERING INDEX wf_node_approver_node_idx', queryset.explain())
+        self.assertIsNone(context[1].approver_row)
+
+    def test_rollup_windows(self):
+        now = timezone.now()
+        window = {'__gt': now - datetime.timedelta(minutes=1), '__lte': now}
+        self.assertUsesIndex(WorkflowNode.objects.filter(**{f'finish_time{k}': v for k, v in window.items()}), 'wf_node_finish_time_idx')
+        self.assertUsesIndex(NodeApprover.objects.filter(**{f'action_time{k}': v for k, v in window.items()}), 'wf_node_approver_time_idx')
+
+    def test_form_values(self):
+        values = EventFormValue.objects.filter(field_name='days', int_value__gt=3).values('event_id')
+        self.assertIn('COVERING INDEX wf_form_value_int_idx', values.explain())
+        self.assertIn('COVERING INDEX wf_form_value_date_idx',
+                      EventFormValue.objects.filter(field_name='start', date_value__range=('2021-07-01', '2021-09-30'), workflow_id=1)
+                      .values('event_id').explain())
+
+    def test_inbox(self):
+        queryset = WorkflowNode.objects.filter(state=State.PROCESSING, nodeapprover__approver_id=1, nodeapprover__action=Action.PENDING)
+        self.assertIn('COVERING INDEX wf_node_approver_inbox_idx', queryset.explain())
+
+
+class EndpointQueryBudgetMixin(QueryBudgetMixin):
+    """
+    工作流接口的SQL查询数预算，数据规模由scale控制：
+    请假工作流含多个条件分支（部门领导会签-->HR会签、指定人员-->HR或签、默认发起人自审），HR角色有scale个成员，
+    共有2*scale个事件及对应的审批节点，其中一半事件的首节点已审批通过
+    """
+    client_class = APIClient
+    prefix = '/api/v1/workflow'
+
+    @classmethod
+    def setUpTestData(cls):
+        n = cls.scale
+        cls.requester = User.objects.create(username='requester')
+        cls.leader = User.objects.create(username='leader')
+        cls.hr_members = [User.objects.create(username=f'hr{i}') for i in range(n)]
+        cls.hr = Group.objects.create(name='hr')
+        cls.hr.user_set.add(*cls.hr_members)
+        department = Department.objects.create(name='研发部', code='rd', leader=cls.leader)
+
+        cls.workflow = Workflow.objects.create(name='请假')
+        component = Component.objects.create(name='天数', ui_type=Component.UIType.INPUT, data_type=Component.DataType.INT)
+        days = FormField.objects.create(field_name='days', component=component, workflow=cls.workflow, rank=0, required=True)
+        for i in range(n):
+            text = Component.objects.create(name=f'文本{i}', ui_type=Component.UIType.INPUT, data_type=Component.DataType.STR)
+            FormField.objects.create(field_name=f'remark{i}', component=text, workflow=cls.workflow, rank=i + 1, required=False)
+
+        long_leave = WorkflowChain.objects.create(workflow=cls.workflow, form_field=days, condition=WorkflowChain.Condition.GTE,
+                                                  condition_value=3, rank=1, type=WorkflowChain.Type.DEPART_LEADER, department=department)
+        WorkflowChain.objects.create(workflow=cls.workflow, parent=long_leave, rank=1, type=WorkflowChain.Type.ROLE, role=cls.hr)
+        short_leave = WorkflowChain.objects.create(workflow=cls.workflow, form_field=days, condition=WorkflowChain.Condition.GTE,
+                                                   condition_value=1, rank=2, type=WorkflowChain.Type.PERSON, person=cls.leader)
+        WorkflowChain.objects.create(workflow=cls.workflow, parent=short_leave, rank=1, type=WorkflowChain.Type.ROLE, role=cls.hr,
+                                     mode=WorkflowChain.Mode.OR)
+        WorkflowChain.objects.create(workflow=cls.workflow, rank=3, type=WorkflowChain.Type.SELF)
+
+        cls.events = []
+        for i in range(2 * n):
+            event = WorkflowEvent.objects.create(requester=cls.requester, workflow=cls.workflow, form_fields={'days': 5 if i % 2 else 1})
+            WorkflowNode.generate_workflow_node(event, {})
+            cls.events.append(event)
+        for event in cls.events[:n]:
+            WorkflowNode.objects.filter(event=event, parent__isnull=True).get().approve(cls.leader)
+
+    def setUp(self):
+        super(EndpointQueryBudgetMixin, self).setUp()
+        self.client.force_authenticate(self.requester)
+
+    def test_definition_endpoints(self):
+        # 比未做条件GET时多一次资源版本查询
+        self.assertQueryBudget(4, 'get', f'{self.prefix}/workflows/')
+        self.assertQueryBudget(4, 'get', f'{self.prefix}/workflows/{self.workflow.id}/')
+        self.assertQueryBudget(4, 'get', f'{self.prefix}/components/')
+        self.assertQueryBudget(4, 'get', f'{self.prefix}/components/{Component.objects.first().id}/')
+        self.assertQueryBudget(5, 'get', f'{self.prefix}/form_fields/?workflow_id={self.workflow.id}')
+        self.assertQueryBudget(4, 'get', f'{self.prefix}/workflow_chains/chain_tree/?workflow_id={self.workflow.id}')
+
+    def test_definition_writes(self):
+        n = self.scale
+        draft = Workflow.objects.create(name='草稿')
+        component = Component.objects.first()
+        fields = [{'workflow_id': draft.id, 'component_id': component.id, 'field_name': f'field{i}', 'rank': i} for i in range(n)]
+        self.assertQueryBudget(8, 'post', f'{self.prefix}/form_fields/', fields)  # 批量插入，与字段数量无关
+        self.assertEqual(FormField.objects.filter(workflow=draft).count(), n)
+        fields[-1]['field_name'] = fields[0]['field_name']
+        self.assertQueryBudget(2, 'post', f'{self.prefix}/form_fields/', fields, status_code=400)  # 字段名称重复
+
+        # n个条件分支，每个分支下一个子节点：按层级批量插入，查询数只与审批链深度有关
+        days = FormField.objects.get(workflow=self.workflow, field_name='days')
+        chains = [{'workflow_id': self.workflow.id, 'form_field_id': days.id, 'condition': WorkflowChain.Condition.GTE,
+                   'condition_value': n - i, 'rank': i, 'type': WorkflowChain.Type.PERSON, 'person_id': self.leader.id,
+                   'children': [{'workflow_id': self.workflow.id, 'rank': 1, 'type': WorkflowChain.Type.ROLE, 'role_id': self.hr.id}]}
+                  for i in range(n)]
+        self.assertQueryBudget(14, 'post', f'{self.prefix}/workflow_chains/', chains)
+        tree = self.client.get(f'{self.prefix}/workflow_chains/chain_tree/?workflow_id={self.workflow.id}').data
+        self.assertEqual([(chain['condition_value'], [child['type'] for child in chain['children']]) for chain in tree],
+                         [(n - i, [WorkflowChain.Type.ROLE]) for i in range(n)])
+
+        self.assertQueryBudget(5, 'patch', f'{self.prefix}/workflows/{self.workflow.id}/', {'comment': '修改'})
+        self.assertQueryBudget(6, 'put', f'{self.prefix}/workflows/{self.workflow.id}/', {'name': '请假', 'comment': '修改'})
+        self.assertQueryBudget(15, 'delete', f'{self.prefix}/workflows/{draft.id}/', status_code=204)  # 级联查询各关联表，删除n个表单字段
+
+        self.assertQueryBudget(5, 'patch', f'{self.prefix}/components/{component.id}/', {'name': '请假天数'})
+        self.assertQueryBudget(5, 'put', f'{self.prefix}/components/{component.id}/',
+                               {'name': '天数', 'ui_type': Component.UIType.INPUT, 'data_type': Component.DataType.INT})
+        unused = Component.objects.create(name='备用', ui_type=Component.UIType.INPUT, data_type=Component.DataType.STR)
+        self.assertQueryBudget(6, 'delete', f'{self.prefix}/components/{unused.id}/', status_code=204)
+
+    def test_definition_not_modified(self):
+        for url in [f'{self.prefix}/workflows/', f'{self.prefix}/components/', f'{self.prefix}/form_fields/?workflow_id={self.workflow.id}',
+                    f'{self.prefix}/workflow_chains/chain_tree/?workflow_id={self.workflow.id}']:
+            response = self.client.get(url)
+            # 只查询资源版本，外加savepoint
+            self.assertQueryBudget(3, 'get', url, status_code=304, HTTP_IF_NONE_MATCH=response['ETag'])
+            self.assertQueryBudget(3, 'get', url, status_code=304, HTTP_IF_MODIFIED_SINCE=response['Last-Modified'])
+
+        url = f'{self.prefix}/workflow_chains/chain_tree/?workflow_id={self.workflow.id}'
+        etag = self.client.get(url)['ETag']
+        self.client.patch(f'{self.prefix}/workflows/{self.workflow.id}/', {'comment': '修改'}, format='json')
+        self.assertEqual(self.client.get(url, HTTP_IF_NONE_MATCH=etag).status_code, 200)
+
+    def test_event_endpoints(self):
+        self.assertQueryBudget(3, 'get', f'{self.prefix}/workflow_events/')
+        self.assertQueryBudget(3, 'get', f'{self.prefix}/workflow_events/?pagination=cursor')
+        self.assertQueryBudget(3, 'get', f'{self.prefix}/workflow_events/{self.events[-1].id}/')
+        self.assertQueryBudget(3, 'get', f'{self.prefix}/workflow_events/my_event/')
+        data = {'requester_id': self.requester.id, 'workflow_id': self.workflow.id, 'form_fields': {'days': 5}}
+        self.assertQueryBudget(24, 'post', f'{self.prefix}/workflow_events/', data)  # 含写入表单值索引
+        items = [dict(data, form_fields={'days': (0, 1, 5)[i % 3]}) for i in range(3 * self.scale)]  # 覆盖所有分支
+        self.assertQueryBudget(21, 'post', f'{self.prefix}/workflow_events/bulk/', items)
+
+        event = self.events[-1]
+        self.assertQueryBudget(9, 'patch', f'{self.prefix}/workflow_events/{event.id}/',
+                               {'workflow_id': self.workflow.id, 'form_fields': {'days': 4}})  # 含重建表单值索引
+        self.assertQueryBudget(9, 'put', f'{self.prefix}/workflow_events/{event.id}/', data)
+        self.assertQueryBudget(9, 'delete', f'{self.prefix}/workflow_events/{event.id}/', status_code=204)
+
+    def test_node_endpoints(self):
+        node = WorkflowNode.objects.filter(event=self.events[1], parent__isnull=False).get()  # 首节点已审批通过
+        self.assertQueryBudget(4, 'get', f'{self.prefix}/workflow_nodes/')
+        self.assertQueryBudget(4, 'get', f'{self.prefix}/workflow_nodes/{node.id}/')
+        self.assertQueryBudget(6, 'patch', f'{self.prefix}/workflow_nodes/{node.id}/', {'comment': '备注'})
+        self.assertQueryBudget(6, 'put', f'{self.prefix}/workflow_nodes/{node.id}/', {'comment': '备注'})
+
+        self.client.force_authenticate(self.hr_members[0])
+        self.assertQueryBudget(3, 'get', f'{self.prefix}/workflow_nodes/inbox/')
+        self.assertQueryBudget(12, 'post', f'{self.prefix}/workflow_nodes/{node.id}/approve/', {'comment': '同意'})
+
+        self.client.force_authenticate(self.leader)
+        self.assertQueryBudget(7, 'post', f'{self.prefix}/workflow_nodes/{node.id}/approve/', {}, status_code=403)  # 不是审批人
+        nodes = WorkflowNode.objects.filter(event__in=self.events[self.scale:], parent__isnull=True)
+        self.assertQueryBudget(12, 'post', f'{self.prefix}/workflow_nodes/batch_action/',
+                               {'action': Action.APPROVED, 'nodes': [{'id': n.id} for n in nodes]})
+
+
+    def test_stat_endpoints(self):
+        analytics.rollup(lag=0)
+        # 水位线、每日统计（各工作流/审批人）、积压，外加savepoint
+        self.assertQueryBudget(5, 'get', f'{self.prefix}/workflow_stats/')
+        self.assertQueryBudget(4, 'get', f'{self.prefix}/workflow_stats/daily/?workflow_id={self.workflow.id}')
+        self.assertQueryBudget(5, 'get', f'{self.prefix}/workflow_stats/approvers/')
+
+
+class SmallEndpointQueryBudgetTestCase(EndpointQueryBudgetMixin, CacheIsolatedTestCase):
+    scale = 2
+
+
+class LargeEndpointQueryBudgetTestCase(EndpointQueryBudgetMixin, CacheIsolatedTestCase):
+    scale = 8
@@ -9,6 +9,7 @@ router.register('form_fields', WorkflowFormFieldViewSet, 'form_fields')
 router.register('workflow_chains', WorkflowChainViewSet, 'workflow_chains')
 router.register('workflow_nodes', WorkflowNodeViewSet, 'workflow_nodes')
 router.register('workflow_events', WorkflowEventViewSet, 'workflow_events')
+router.register('workflow_stats', WorkflowStatViewSet, 'workflow_stats')
 
 urlpatterns = [
 ]
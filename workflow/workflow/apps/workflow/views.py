@@ -1,19 +1,32 @@
+import re
+
 from django.db import transaction
+from django.db.models import F
+from django.http import Http404
 from rest_framework import status, mixins
 from rest_framework.decorators import action
+from rest_framework.exceptions import ValidationError
+from rest_framework.generics import get_object_or_404
 from rest_framework.response import Response
 from rest_framework.viewsets import ModelViewSet, GenericViewSet
 
+from workflow.apps.user.models import ResourceVersion
 from workflow.libs.frameworks.permissions import IsApprover
+from workflow.libs.frameworks.views import ConditionalGetMixin
+from workflow.libs.utils.common_util import build_tree
 from .models import *
+from .models import Action, State
+from . import analytics
+from .archive import ArchiveInclusiveList
 from .serializers import *
 
 
 __all__ = ['ComponentViewSet', 'WorkflowFormFieldViewSet', 'WorkflowViewSet', 'WorkflowChainViewSet',
-           'WorkflowNodeViewSet', 'WorkflowEventViewSet']
+           'WorkflowNodeViewSet', 'WorkflowEventViewSet', 'WorkflowStatViewSet']
 
 
-class ComponentViewSet(ModelViewSet):
+class ComponentViewSet(ConditionalGetMixin, ModelViewSet):
+    conditional_resources = (ResourceVersion.COMPONENT,)
     filter_fields = ()
     search_fields = filter_fields
 
@@ -21,9 +34,11 @@ class ComponentViewSet(ModelViewSet):
     serializer_class = ComponentSerializer
 
 
-class WorkflowFormFieldViewSet(mixins.CreateModelMixin,
+class WorkflowFormFieldViewSet(ConditionalGetMixin,
+                               mixins.CreateModelMixin,
                                mixins.ListModelMixin,
                                GenericViewSet):
+    conditional_resources = (ResourceVersion.WORKFLOW,)
     filter_fields = ('workflow_id',)
     search_fields = filter_fields
 
@@ -33,26 +48,41 @@ class WorkflowFormFieldViewSet(mixins.CreateModelMixin,
     def create(self, request, *args, **kwargs):
         if not isinstance(request.data, list) or len(request.data) == 0:
             return Response('数据格式有误，要求为非空列表。', status=status.HTTP_400_BAD_REQUEST)
-        with transaction.atomic():
+        field_serializers = [self.get_serializer(data=data) for data in request.data]
+        for serializer in field_serializers:
+            serializer.is_valid(raise_exception=True)
+        field_names = [serializer.validated_data['field_name'] for serializer in field_serializers]
+        if len(set(field_names)) != len(field_names):
+            return Response('字段名称重复。', status=status.HTTP_400_BAD_REQUEST)
+        with transaction.atomic(), ResourceVersion.collect():
             workflow_id = request.data[0].get('workflow_id', None)
             FormField.objects.filter(workflow_id=workflow_id).delete()  # 不支持编辑，想要修改表单字段，走创建逻辑
-            for data in request.data:
-                serializer = self.get_serializer(data=data)
-                serializer.is_valid(raise_exception=True)
-                serializer.save()
+            FormField.objects.bulk_create([FormField(**serializer.validated_data) for serializer in field_serializers])
+            ResourceVersion.bump(ResourceVersion.WORKFLOW)  # 批量插入不发送post_save信号
+            # 递增表单版本号，使各进程缓存的动态表单序列化器失效
+            Workflow.objects.filter(id=workflow_id).update(form_version=F('form_version') + 1)
+            transaction.on_commit(lambda: Workflow.invalidate_form_serializer(workflow_id))
         return Response(status=status.HTTP_201_CREATED)
 
 
-class WorkflowViewSet(ModelViewSet):
+class WorkflowViewSet(ConditionalGetMixin, ModelViewSet):
+    conditional_resources = (ResourceVersion.WORKFLOW,)
     filter_fields = ('name', 'comment')
     search_fields = filter_fields
 
     queryset = Workflow.objects.all()
     serializer_class = WorkFlowSerializer
 
+    def perform_destroy(self, instance):
+        with ResourceVersion.collect():  # 级联删除表单字段、审批链时逐行信号的版本递增合并为一次
+            instance.delete()
+
 
-class WorkflowChainViewSet(mixins.CreateModelMixin,
+class WorkflowChainViewSet(ConditionalGetMixin,
+                           mixins.CreateModelMixin,
                            GenericViewSet):
+    conditional_resources = (ResourceVersion.WORKFLOW,)
+    conditional_actions = ('chain_tree',)
     filter_fields = ()
     search_fields = filter_fields
 
@@ -121,46 +151,162 @@ class WorkflowChainViewSet(mixins.CreateModelMixin,
         workflow_id = request.query_params.get('workflow_id', None)
         if not workflow_id:
             return Response(data={'msg': '请求参数缺失。'}, status=status.HTTP_400_BAD_REQUEST)
-        chains_queryset = WorkflowChain.objects.filter(workflow_id=workflow_id)
+        chains_queryset = WorkflowChain.objects.filter(workflow_id=workflow_id).select_related('workflow').order_by('rank', 'id')
         chains = WorkFlowChainSerializer(chains_queryset, many=True).data
-        tree = [chain for chain in chains if chain['parent_id'] is None]
-        for chain in chains:
-            chain['children'] = [c for c in chains if chain['id'] == c['parent_id']]
+        tree = build_tree(chains)
         return Response(data=tree, status=status.HTTP_200_OK)
 
 
 class WorkflowEventViewSet(ModelViewSet):
     ordering_fields = ('create_time', 'update_time')
+    cursor_ordering = ('-create_time', '-id')  # ?pagination=cursor时的游标排序
     filter_fields = ('requester_id', 'workflow_id', 'state')
     search_fields = filter_fields
+    form_filter_pattern = re.compile(r'form\.(\w+?)(?:__(gt|gte|lt|lte|in))?')  # 表单值过滤参数，见filter_queryset
 
-    queryset = WorkflowEvent.objects.all()
+    queryset = WorkflowEvent.objects.select_related('requester', 'workflow')
+    archive_queryset = ArchivedWorkflowEvent.objects.select_related('requester', 'workflow')
     serializer_class = WorkflowEventSerializer
 
-    @action(methods=['get'], detail=False, url_path='my_event', name='my_event')
-    def my_event(self, request, **kwargs):
-        # 我发起的审批，为防止数据泄漏，不通过接口查询参数实现
-        queryset = self.filter_queryset(queryset=self.queryset).filter(requester=request.user)
+    def include_archived(self):
+        """?include_archived=true时列表、详情和我的事件同时返回已归档的事件（只读，分页固定为页码分页）"""
+        return self.request.query_params.get('include_archived') in ('true', '1')
 
+    def paginate_events(self, queryset, archive_queryset):
+        if self.include_archived():
+            queryset = ArchiveInclusiveList(queryset, self.filter_queryset(archive_queryset))
         page = self.paginate_queryset(queryset)
         if page is not None:
             serializer = self.get_serializer(page, many=True)
             return self.get_paginated_response(serializer.data)
 
-        serializer = self.get_serializer(queryset, many=True)
+        serializer = self.get_serializer(list(queryset[:]) if self.include_archived() else queryset, many=True)
         return Response(serializer.data)
 
+    def filter_queryset(self, queryset):
+        """
+        在默认过滤之外支持按表单值过滤（走EventFormValue索引），如：
+            ?workflow_id=1&form.days__gt=3&form.start__gte=2021-07-01&form.start__lt=2021-10-01
+            ?form.type=婚假  ?form.type__in=婚假,产假
+        """
+        queryset = super(WorkflowEventViewSet, self).filter_queryset(queryset)
+        filters = []
+        for key, value in self.request.query_params.items():
+            match = self.form_filter_pattern.fullmatch(key)
+            if match:
+                filters.append((match.group(1), match.group(2) or 'exact', value))
+        workflow_id = self.request.query_params.get('workflow_id', '')
+        try:
+            return EventFormValue.filter_events(queryset, filters, int(workflow_id) if workflow_id.isdigit() else None)
+        except ValueError as e:
+            raise ValidationError({'form': [str(e)]})
+
+    def list(self, request, *args, **kwargs):
+        return self.paginate_events(self.filter_queryset(self.get_queryset()), self.archive_queryset)
+
+    def retrieve(self, request, *args, **kwargs):
+        if not self.include_archived():
+            return super(WorkflowEventViewSet, self).retrieve(request, *args, **kwargs)
+        try:
+            instance = self.get_object()
+        except Http404:
+            instance = get_object_or_404(self.archive_queryset, pk=kwargs[self.lookup_field])
+            self.check_object_permissions(request, instance)
+        return Response(self.get_serializer(instance).data)
+
+    def get_metadata_variant(self, request):
+        """OPTIONS ?workflow_id=xx 时元数据中包含该工作流的动态表单结构(form_fields)，按(工作流ID, 表单版本)缓存"""
+        workflow_id = request.query_params.get('workflow_id', '')
+        if not workflow_id.isdigit():
+            return None
+        self.form_workflow = Workflow.objects.filter(id=workflow_id).only('id', 'form_version').first()
+        if self.form_workflow is None:
+            return None
+        return 'form', self.form_workflow.id, self.form_workflow.form_version
+
+    def get_serializer_context(self):
+        context = super(WorkflowEventViewSet, self).get_serializer_context()
+        if getattr(self, 'form_workflow', None) is not None:
+            context['form_workflow'] = self.form_workflow
+        return context
+
+    @action(methods=['post'], detail=False, url_path='bulk', name='bulk')
+    def bulk(self, request, **kwargs):
+        """ 批量提交工作流事件，request.data:
+            [
+                {
+                    "requester_id": 1,
+                    "workflow_id": 1,
+                    "form_fields": {"days": 3},
+                    "chain_approver_dict": {},
+                    "submit_key": "hr-2021-10-0001"
+                },
+                ...
+            ]
+            逐项返回结果，部分失败不影响其他事件的提交
+        """
+        if not isinstance(request.data, list) or len(request.data) == 0:
+            return Response('数据格式有误，要求为非空列表。', status=status.HTTP_400_BAD_REQUEST)
+        results = WorkflowEventBulkSerializer.submit(request.data)
+        success = any(result['success'] for result in results)
+        return Response(data=results, status=status.HTTP_201_CREATED if success else status.HTTP_400_BAD_REQUEST)
+
+    @action(methods=['get'], detail=False, url_path='my_event', name='my_event')
+    def my_event(self, request, **kwargs):
+        # 我发起的审批，为防止数据泄漏，不通过接口查询参数实现
+        queryset = self.filter_queryset(queryset=self.queryset).filter(requester=request.user)
+        return self.paginate_events(queryset, self.archive_queryset.filter(requester=request.user))
+
 
 class WorkflowNodeViewSet(mixins.RetrieveModelMixin,
                           mixins.UpdateModelMixin,
                           mixins.ListModelMixin,
                           GenericViewSet):
+    cursor_ordering = ('-create_time', '-id')  # ?pagination=cursor时的游标排序
     filter_fields = ()
     search_fields = filter_fields
 
-    queryset = WorkflowNode.objects.all()
+    queryset = WorkflowNode.objects.select_related('event', 'actor').prefetch_related('approvers')
     serializer_class = WorkFlowNodeSerializer
 
+    def get_queryset(self):
+        if self.action in ('approve_view', 'reject_view'):
+            # 审批只需节点本身，审批人记录由IsApprover加载的NodeActionContext提供，不预取全部审批人
+            return WorkflowNode.objects.all()
+        return super(WorkflowNodeViewSet, self).get_queryset()
+
+    @action(methods=['get'], detail=False, url_path='inbox', name='inbox')
+    def inbox(self, request, **kwargs):
+        """待我审批：进行中且当前用户尚未处理的节点，从审批人索引出发一次关联查询事件/发起人/工作流"""
+        queryset = WorkflowNode.objects.filter(
+            state=State.PROCESSING,
+            nodeapprover__approver_id=request.user.id,
+            nodeapprover__action=Action.PENDING,
+        ).select_related('event', 'event__requester', 'event__workflow').defer('event__progress').order_by('-id')
+
+        page = self.paginate_queryset(queryset)
+        if page is not None:
+            serializer = WorkflowNodeInboxSerializer(page, many=True)
+            return self.get_paginated_response(serializer.data)
+
+        serializer = WorkflowNodeInboxSerializer(queryset, many=True)
+        return Response(serializer.data)
+
+    @action(methods=['post'], detail=False, url_path='batch_action', name='batch_action')
+    def batch_action(self, request, **kwargs):
+        """ 批量审批，request.data:
+            {
+                "action": "APPROVED",  // 或REJECTED
+                "nodes": [{"id": 1, "comment": "同意"}, {"id": 2}]
+            }
+            逐个节点返回结果，校验不通过的节点不影响其他节点
+        """
+        serializer = WorkflowNodeBatchActionSerializer(data=request.data)
+        serializer.is_valid(raise_exception=True)
+        comments = {item['id']: item.get('comment') for item in serializer.validated_data['nodes']}
+        results = WorkflowNode.batch_action(request.user, serializer.validated_data['action'], comments)
+        return Response(data=results, status=status.HTTP_200_OK)
+
     @action(methods=['post'], detail=True, url_path='approve', name='approve', permission_classes=[IsApprover])
     def approve_view(self, request, pk=None):
         comment = request.data.get('comment')
@@ -174,3 +320,35 @@ class WorkflowNodeViewSet(mixins.RetrieveModelMixin,
         obj = self.get_object()
         obj.reject(approver=request.user, comment=comment)
         return Response(data={'msg': '已驳回'}, status=status.HTTP_200_OK)
+
+
+class WorkflowStatViewSet(GenericViewSet):
+    """
+    审批统计，只读取rollup_stats增量维护的汇总表，耗时与历史数据量无关。
+    查询参数：start/end（日期，默认最近30天）、workflow_id、approver_id（仅approvers），
+    返回的watermark为汇总截至的时间，之后的审批要等下次汇总才计入
+    """
+    pagination_class = None
+    filter_backends = ()
+
+    def stat_response(self, func, *keys):
+        serializer = StatQuerySerializer(data=self.request.query_params)
+        serializer.is_valid(raise_exception=True)
+        params = serializer.validated_data
+        watermark = StatWatermark.objects.filter(name=analytics.WATERMARK_NAME).values_list('value', flat=True).first()
+        results = func(params['start'], params['end'], **{key: params.get(key) for key in keys})
+        return Response({'watermark': watermark, 'start': params['start'], 'end': params['end'], 'results': results})
+
+    def list(self, request, *args, **kwargs):
+        """各工作流：发起/通过/驳回事件数、节点平均通过耗时、驳回率、当前积压"""
+        return self.stat_response(analytics.workflow_summary, 'workflow_id')
+
+    @action(methods=['get'], detail=False, url_path='daily', name='daily')
+    def daily(self, request, **kwargs):
+        """按天的趋势，未指定workflow_id时为所有工作流之和"""
+        return self.stat_response(analytics.workflow_daily, 'workflow_id')
+
+    @action(methods=['get'], detail=False, url_path='approvers', name='approvers')
+    def approvers(self, request, **kwargs):
+        """各审批人：通过/驳回次数、平均处理耗时、驳回率、当前待审批数"""
+        return self.stat_response(analytics.approver_summary, 'workflow_id', 'approver_id')
@@ -0,0 +1,63 @@
+"""
+CachedTokenAuthentication：带缓存的Token认证，替代rest_framework.authentication.TokenAuthentication，
+省去每个请求一次的authtoken_token JOIN auth_user查询。
+配置TOKEN_AUTH_SHARED_CACHE（django CACHES别名，如redis）时，Token到用户的解析结果只缓存在共享缓存中（有效期TOKEN_AUTH_CACHE_TTL），
+Token删除（含重新生成）、用户修改或删除时由signals清除，对所有进程立即生效；各进程不另存本地副本，否则其他进程会在本地过期前继续放行。
+未配置时缓存在本进程的LRU中（TOKEN_AUTH_CACHE_SIZE/TOKEN_AUTH_CACHE_TTL），signals只能清除当前进程的结果，
+只适用于单进程部署，多个uwsgi worker时须配置共享缓存。
+命中/未命中次数见/metrics中的workflow_token_auth_cache_total。
+"""
+import copy
+import hashlib
+
+from django.conf import settings
+from django.core.cache import caches
+from rest_framework.authentication import TokenAuthentication
+
+from workflow.libs.utils.cache_util import LRUCache
+from workflow.libs.utils.metrics_util import Counter
+
+TOKEN_AUTH_CACHE_SIZE = getattr(settings, 'TOKEN_AUTH_CACHE_SIZE', 10000)
+TOKEN_AUTH_CACHE_TTL = getattr(settings, 'TOKEN_AUTH_CACHE_TTL', 60)
+_token_cache = LRUCache(maxsize=TOKEN_AUTH_CACHE_SIZE, ttl=TOKEN_AUTH_CACHE_TTL)
+
+token_auth_cache = Counter('workflow_token_auth_cache_total', 'Token认证缓存命中(hit)/未命中(miss)次数', ['result'])
+
+
+def _shared_cache():
+    alias = getattr(settings, 'TOKEN_AUTH_SHARED_CACHE', None)
+    return caches[alias] if alias else None
+
+
+def _shared_key(key):
+    """共享缓存中不保存明文token"""
+    return 'token_auth:' + hashlib.sha256(key.encode()).hexdigest()
+
+
+def invalidate_tokens(keys):
+    """清除本进程及共享缓存中这些token的解析结果"""
+    keys = list(keys)
+    for key in keys:
+        _token_cache.pop(key)
+    shared = _shared_cache()
+    if shared is not None and keys:
+        shared.delete_many([_shared_key(key) for key in keys])
+
+
+class CachedTokenAuthentication(TokenAuthentication):
+
+    def authenticate_credentials(self, key):
+        shared = _shared_cache()
+        result = _token_cache.get(key) if shared is None else shared.get(_shared_key(key))
+        if result is not None:
+            token_auth_cache.inc(result='hit')
+            user, token = result
+            return copy.copy(user), token  # 缓存的用户对象为多个请求共用，每个请求使用副本
+
+        token_auth_cache.inc(result='miss')
+        user, token = super(CachedTokenAuthentication, self).authenticate_credentials(key)  # 无效token或用户已禁用时抛出异常，不缓存
+        if shared is None:
+            _token_cache.set(key, (user, token))
+        else:
+            shared.set(_shared_key(key), (user, token), TOKEN_AUTH_CACHE_TTL)
+        return copy.copy(user), token
@@ -8,6 +8,12 @@ from rest_framework.metadata import BaseMetadata
 from rest_framework.request import clone_request
 from rest_framework.utils.field_mapping import ClassLookupDict
 
+from workflow.libs.utils.cache_util import LRUCache
+
+# OPTIONS元数据缓存，key为(视图类, 序列化器类, 是否有POST权限, 视图提供的变体key)
+METADATA_CACHE_SIZE = 512
+_metadata_cache = LRUCache(maxsize=METADATA_CACHE_SIZE)
+
 
 class SimpleMetadata(BaseMetadata):
     """
@@ -63,6 +69,29 @@ class SimpleMetadata(BaseMetadata):
         return fields
 
     def determine_metadata(self, request, view):
+        """
+        元数据只取决于视图类、序列化器类和权限校验结果，按此缓存，权限校验仍逐个请求执行。
+        视图可定义get_metadata_variant(request)，返回影响元数据的额外key（须可哈希，如工作流ID+表单版本），
+        返回None时与不定义相同。缓存的结果为多个请求共用，调用方不应修改
+        """
+        variant = view.get_metadata_variant(request) if hasattr(view, 'get_metadata_variant') else None
+        serializer_class = view.get_serializer_class() if hasattr(view, 'get_serializer_class') else None
+        allowed = self.has_post_permission(request, view) if serializer_class is not None else False
+        key = (type(view), serializer_class, allowed, variant)
+        return _metadata_cache.get_or_set(key, lambda: self.build_metadata(request, view, allowed))
+
+    def has_post_permission(self, request, view):
+        view.request = clone_request(request, 'POST')
+        try:
+            if hasattr(view, 'check_permissions'):
+                view.check_permissions(view.request)
+        except (exceptions.APIException, PermissionDenied, Http404):
+            return False
+        finally:
+            view.request = request
+        return True
+
+    def build_metadata(self, request, view, allowed):
         metadata = OrderedDict()
         metadata['name'] = view.get_view_name()
         metadata['description'] = view.get_view_description()
@@ -70,39 +99,21 @@ class SimpleMetadata(BaseMetadata):
         metadata['parses'] = [parser.media_type for parser in view.parser_classes]
         metadata['filter_fields'] = self.get_filters_fields(request, view)
         metadata['order_fields'] = self.get_ordering_fields(request, view)
-        if hasattr(view, 'get_serializer'):
-            actions = self.determine_actions(request, view)
-            if actions:
-                metadata['actions'] = actions
+        if hasattr(view, 'get_serializer') and allowed:
+            metadata['actions'] = self.determine_actions(request, view)
         return metadata
 
     def determine_actions(self, request, view):
         """
         For generic class based views we return information about
-        the fields that are accepted for 'PUT' and 'POST' methods.
+        the fields that are accepted for 'POST' method.
+        权限已在determine_metadata中校验
         """
-        actions = {}
-        # for method in {'PUT', 'POST'} & set(view.allowed_methods):
-        for method in {'POST'}:
-            view.request = clone_request(request, method)
-            try:
-                # Test global permissions
-                if hasattr(view, 'check_permissions'):
-                    view.check_permissions(view.request)
-                # Test object permissions
-                if method == 'PUT' and hasattr(view, 'get_object'):
-                    view.get_object()
-            except (exceptions.APIException, PermissionDenied, Http404):
-                pass
-            else:
-                # If user has appropriate permissions for the view, include
-                # appropriate metadata about the fields that should be supplied.
-                serializer = view.get_serializer()
-                actions[method] = self.get_serializer_info(serializer)
-            finally:
-                view.request = request
-
-        return actions
+        view.request = clone_request(request, 'POST')
+        try:
+            return {'POST': self.get_serializer_info(view.get_serializer())}
+        finally:
+            view.request = request
 
     def get_serializer_info(self, serializer):
         """
@@ -0,0 +1,183 @@
+"""
+ProfilingMiddleware: 请求性能分析中间件，默认不启用，在settings.MIDDLEWARE中注册后生效（建议放在第一位）。
+按PROFILING_SAMPLE_RATE采样，被采样的请求记录：
+    db: SQL次数及耗时
+    view: 视图耗时（含序列化，不含渲染）
+    serialize: 序列化器生成data的耗时
+    render: 响应渲染耗时
+结果写入Server-Timing响应头（浏览器开发者工具可直接查看）和一行json日志（logger: workflow.profiling），
+单条SQL耗时超过PROFILING_SLOW_QUERY_MS时，同时记录SQL及项目代码中的调用栈。
+"""
+import json
+import logging
+import random
+import threading
+import time
+import traceback
+from contextlib import ExitStack
+
+from django.conf import settings
+from django.db import connections
+from rest_framework import serializers
+
+from workflow.libs.utils.metrics_util import Histogram
+
+logger = logging.getLogger('workflow.profiling')
+
+_local = threading.local()
+
+
+class RequestProfile(object):
+    """单个请求的耗时统计，各项单位为秒"""
+
+    def __init__(self, slow_query_seconds, stack_limit):
+        self.slow_query_seconds = slow_query_seconds
+        self.stack_limit = stack_limit
+        self.start = time.perf_counter()
+        self.view_start = self.view_end = None
+        self.render_start = self.render_end = None
+        self.serialize_time = 0
+        self.serialize_depth = 0
+        self.query_count = 0
+        self.query_time = 0
+        self.slow_queries = []
+
+    def execute_wrapper(self, execute, sql, params, many, context):
+        start = time.perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            elapsed = time.perf_counter() - start
+            self.query_count += 1
+            self.query_time += elapsed
+            if elapsed >= self.slow_query_seconds:
+                self.slow_queries.append({
+                    'sql': sql,
+                    'ms': round(elapsed * 1000, 2),
+                    'stack': self.project_stack(),
+                })
+
+    def project_stack(self):
+        """只保留项目代码的调用栈，去掉django/drf等第三方库的帧"""
+        base_dir = str(settings.BASE_DIR)
+        frames = [
+            f'{frame.filename[len(base_dir) + 1:]}:{frame.lineno} {frame.name}'
+            for frame in traceback.extract_stack()
+            if frame.filename.startswith(base_dir) and frame.filename != __file__ and 'site-packages' not in frame.filename
+        ]
+        return frames[-self.stack_limit:]
+
+    def timings(self):
+        """[(名称, 毫秒, 描述)]"""
+        end = time.perf_counter()
+        timings = [('total', end - self.start, '')]
+        if self.view_start is not None:
+            timings.append(('view', (self.view_end or self.render_start or end) - self.view_start, ''))
+        if self.serialize_time:
+            timings.append(('serialize', self.serialize_time, ''))
+        if self.render_start is not None and self.render_end is not None:
+            timings.append(('render', self.render_end - self.render_start, ''))
+        timings.append(('db', self.query_time, f'{self.query_count} queries'))
+        return [(name, round(seconds * 1000, 2), desc) for name, seconds, desc in timings]
+
+
+def current_profile():
+    """当前线程正在统计的请求，未被采样时返回None"""
+    return getattr(_local, 'profile', None)
+
+
+def _instrument_serializers():
+    """统计序列化器data属性的耗时，只在启用中间件时执行一次；嵌套调用只计最外层"""
+    if getattr(serializers.BaseSerializer, '_profiling_instrumented', False):
+        return
+    data = serializers.BaseSerializer.data
+
+    def profiled_data(self):
+        profile = current_profile()
+        if profile is None:
+            return data.fget(self)
+        profile.serialize_depth += 1
+        start = time.perf_counter()
+        try:
+            return data.fget(self)
+        finally:
+            profile.serialize_depth -= 1
+            if profile.serialize_depth == 0:
+                profile.serialize_time += time.perf_counter() - start
+
+    serializers.BaseSerializer.data = property(profiled_data)
+    serializers.BaseSerializer._profiling_instrumented = True
+
+
+class ProfilingMiddleware(object):
+    sample_rate = getattr(settings, 'PROFILING_SAMPLE_RATE', 1.0)
+    slow_query_ms = getattr(settings, 'PROFILING_SLOW_QUERY_MS', 100)
+    stack_limit = getattr(settings, 'PROFILING_STACK_LIMIT', 15)
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        _instrument_serializers()
+
+    def __call__(self, request):
+        if self.sample_rate < 1 and random.random() >= self.sample_rate:
+            return self.get_response(request)
+
+        profile = _local.profile = RequestProfile(self.slow_query_ms / 1000, self.stack_limit)
+        try:
+            with ExitStack() as stack:
+                for connection in connections.all():
+                    stack.enter_context(connection.execute_wrapper(profile.execute_wrapper))
+                response = self.get_response(request)
+        finally:
+            _local.profile = None
+
+        timings = profile.timings()
+        response['Server-Timing'] = ', '.join(
+            f'{name};dur={ms}' + (f';desc="{desc}"' if desc else '') for name, ms, desc in timings
+        )
+        record = {'method': request.method, 'path': request.get_full_path(), 'status': response.status_code}
+        record.update({f'{name}_ms': ms for name, ms, _ in timings})
+        record['queries'] = profile.query_count
+        if profile.slow_queries:
+            record['slow_queries'] = profile.slow_queries
+        logger.log(logging.WARNING if profile.slow_queries else logging.INFO, json.dumps(record, ensure_ascii=False))
+        return response
+
+    def process_view(self, request, view_func, view_args, view_kwargs):
+        profile = current_profile()
+        if profile is not None:
+            profile.view_start = time.perf_counter()
+
+    def process_template_response(self, request, response):
+        # DRF的Response在所有中间件的process_template_response之后渲染，注册在第一位时此处即为渲染开始
+        profile = current_profile()
+        if profile is not None:
+            profile.view_end = profile.render_start = time.perf_counter()
+            response.add_post_render_callback(lambda r: setattr(profile, 'render_end', time.perf_counter()))
+        return response
+
+
+request_seconds = Histogram('workflow_http_request_seconds', '按DRF视图和action统计的请求耗时', ['view', 'action', 'method', 'status'])
+
+
+class MetricsMiddleware(object):
+    """统计DRF视图的请求耗时（workflow_http_request_seconds），非DRF视图（admin、/metrics等）不统计"""
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        start = time.perf_counter()
+        response = self.get_response(request)
+        labels = getattr(request, '_metrics_labels', None)
+        if labels is not None:
+            request_seconds.observe(time.perf_counter() - start, status=f'{response.status_code // 100}xx', **labels)
+        return response
+
+    def process_view(self, request, view_func, view_args, view_kwargs):
+        view_class = getattr(view_func, 'cls', None)
+        if view_class is None:
+            return
+        method = request.method.lower()
+        actions = getattr(view_func, 'actions', None) or {}  # 视图集的{请求方法: action}
+        request._metrics_labels = {'view': view_class.__name__, 'action': actions.get(method, method), 'method': request.method}
@@ -1,8 +1,192 @@
-from rest_framework.pagination import PageNumberPagination
+import base64
+import hashlib
+import json
+from collections import OrderedDict
+
+from django.conf import settings
+from django.core.cache import cache
+from django.core.exceptions import ValidationError
+from django.core.paginator import Paginator
+from django.db import connections
+from django.db.models import Q
+from django.utils.functional import cached_property
+from rest_framework.exceptions import NotFound
+from rest_framework.pagination import BasePagination, PageNumberPagination
+from rest_framework.response import Response
+from rest_framework.utils.urls import replace_query_param
+
+
+class EstimatedCountPaginator(Paginator):
+    """
+    总数超过阈值时不再精确COUNT(*)：
+    先用带LIMIT的子查询判断是否超过阈值；超过时，无过滤条件的MySQL查询使用表统计信息估算，
+    其他情况使用缓存的精确总数（缓存时间内复用）。
+    """
+    count_threshold = getattr(settings, 'PAGINATION_COUNT_THRESHOLD', 10000)
+    count_cache_timeout = getattr(settings, 'PAGINATION_COUNT_CACHE_TIMEOUT', 60)
+
+    count_is_estimate = False
+
+    @cached_property
+    def count(self):
+        queryset = self.object_list
+        if not hasattr(queryset, 'query'):
+            return super().count
+        bounded_count = queryset.order_by()[:self.count_threshold + 1].count()
+        if bounded_count <= self.count_threshold:
+            return bounded_count
+
+        self.count_is_estimate = True
+        estimated_count = self.get_table_estimate(queryset)
+        if estimated_count is not None:
+            return max(estimated_count, bounded_count)
+        return self.get_cached_count(queryset)
+
+    @staticmethod
+    def get_table_estimate(queryset):
+        """无过滤条件时，从MySQL表统计信息读取估算行数"""
+        connection = connections[queryset.db]
+        if connection.vendor != 'mysql' or queryset.query.where.children or queryset.query.distinct:
+            return None
+        with connection.cursor() as cursor:
+            cursor.execute('SELECT TABLE_ROWS FROM information_schema.TABLES WHERE TABLE_SCHEMA = DATABASE() AND TABLE_NAME = %s',
+                           [queryset.model._meta.db_table])
+            row = cursor.fetchone()
+        return row[0] if row and row[0] is not None else None
+
+    def get_cached_count(self, queryset):
+        sql, params = queryset.order_by().query.sql_with_params()
+        key = 'pagination_count:' + hashlib.md5(f'{queryset.db}:{sql}:{params}'.encode()).hexdigest()
+        count = cache.get(key)
+        if count is None:
+            count = queryset.order_by().count()
+            cache.set(key, count, self.count_cache_timeout)
+        return count
+
+
+class CustomCursorPagination(BasePagination):
+    """
+    游标（keyset）分页，按视图的cursor_ordering（如('-create_time', '-id')）的全部字段定位：
+    下一页条件为 (create_time, id) < (上一页最后一条的create_time, id)，展开为
+    create_time <= x AND (create_time < x OR id < y)，首列的范围条件可直接走(…, create_time)索引。
+    不执行COUNT(*)，也没有OFFSET扫描，create_time相同的行再多也只按id继续定位。
+    游标为base64编码的json：{"v": [各排序字段的值], "r": 是否为上一页}
+    """
+    page_size = 20
+    page_size_query_param = 'page_size'
+    max_page_size = 100
+    cursor_query_param = 'cursor'
+    invalid_cursor_message = '无效的游标'
+
+    def get_ordering(self, view):
+        return list(view.cursor_ordering)
+
+    def get_page_size(self, request):
+        try:
+            return min(max(int(request.query_params[self.page_size_query_param]), 1), self.max_page_size)
+        except (KeyError, ValueError):
+            return self.page_size
+
+    def decode_cursor(self, request, fields):
+        encoded = request.query_params.get(self.cursor_query_param)
+        if not encoded:
+            return None, False
+        try:
+            cursor = json.loads(base64.urlsafe_b64decode(encoded.encode()).decode())
+            values = [field.to_python(value) for field, value in zip(fields, cursor['v'])]
+            if len(values) != len(fields) or any(value is None for value in values):
+                raise ValueError
+            return values, bool(cursor.get('r'))
+        except (TypeError, ValueError, KeyError, ValidationError):
+            raise NotFound(self.invalid_cursor_message)
+
+    def encode_cursor(self, obj, reverse):
+        cursor = {'v': [field.value_to_string(obj) for field in self.fields], 'r': reverse}
+        encoded = base64.urlsafe_b64encode(json.dumps(cursor).encode()).decode()
+        return replace_query_param(self.base_url, self.cursor_query_param, encoded)
+
+    @staticmethod
+    def keyset_condition(ordering, values):
+        """(f1, f2, ...)在排序方向上位于values之后的条件"""
+        condition = Q()
+        for i in range(len(ordering) - 1, -1, -1):
+            name = ordering[i].lstrip('-')
+            lookup = 'lt' if ordering[i].startswith('-') else 'gt'
+            strict = Q(**{f'{name}__{lookup}': values[i]})
+            if i == len(ordering) - 1:
+                condition = strict
+            else:
+                condition = Q(**{f'{name}__{lookup}e': values[i]}) & (strict | condition)
+        return condition
+
+    def paginate_queryset(self, queryset, request, view=None):
+        self.base_url = request.build_absolute_uri()
+        ordering = self.get_ordering(view)
+        self.fields = [queryset.model._meta.get_field(field.lstrip('-')) for field in ordering]
+        page_size = self.get_page_size(request)
+        values, reverse = self.decode_cursor(request, self.fields)
+        if reverse:  # 上一页：反向排序取游标之前的数据，取出后再翻转
+            ordering = [field[1:] if field.startswith('-') else f'-{field}' for field in ordering]
+        queryset = queryset.order_by(*ordering)
+        if values is not None:
+            queryset = queryset.filter(self.keyset_condition(ordering, values))
+
+        results = list(queryset[:page_size + 1])
+        has_more = len(results) > page_size
+        results = results[:page_size]
+        if reverse:
+            results.reverse()
+            self.has_next, self.has_previous = True, has_more
+        else:
+            self.has_next, self.has_previous = has_more, values is not None
+        self.page = results
+        return results
+
+    def get_next_link(self):
+        if not self.has_next or not self.page:
+            return None
+        return self.encode_cursor(self.page[-1], reverse=False)
+
+    def get_previous_link(self):
+        if not self.has_previous or not self.page:
+            return None
+        return self.encode_cursor(self.page[0], reverse=True)
+
+    def get_paginated_response(self, data):
+        return Response(OrderedDict([
+            ('next', self.get_next_link()),
+            ('previous', self.get_previous_link()),
+            ('results', data),
+        ]))
 
 
 class CustomPageNumberPagination(PageNumberPagination):
+    """
+    默认页码分页，总数过大时使用估算/缓存的总数。
+    视图声明了cursor_ordering时，客户端可通过?pagination=cursor切换为游标分页
+    """
+    django_paginator_class = EstimatedCountPaginator
+    pagination_query_param = 'pagination'
+    cursor_pagination_class = CustomCursorPagination
+
     def __init__(self):
         super(CustomPageNumberPagination, self).__init__()
         self.page_size_query_param = 'page_size'
-        self.max_page_size = 100
\ No newline at end of file
+        self.max_page_size = 100
+        self.cursor_paginator = None
+
+    def paginate_queryset(self, queryset, request, view=None):
+        # 合并多个数据源的列表（如包含归档事件）不是queryset，只支持页码分页
+        if request.query_params.get(self.pagination_query_param) == 'cursor' and getattr(view, 'cursor_ordering', None) \
+                and hasattr(queryset, 'query'):
+            self.cursor_paginator = self.cursor_pagination_class()
+            return self.cursor_paginator.paginate_queryset(queryset, request, view)
+        return super(CustomPageNumberPagination, self).paginate_queryset(queryset, request, view)
+
+    def get_paginated_response(self, data):
+        if self.cursor_paginator is not None:
+            return self.cursor_paginator.get_paginated_response(data)
+        response = super(CustomPageNumberPagination, self).get_paginated_response(data)
+        if self.page.paginator.count_is_estimate:
+            response.data['count_is_estimate'] = True
+        return response
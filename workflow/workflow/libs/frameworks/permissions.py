@@ -1,3 +1,4 @@
+from django.db import transaction
 from rest_framework import permissions
 
 
@@ -7,4 +8,12 @@ class IsApprover(permissions.BasePermission):
         return True
 
     def has_object_permission(self, request, view, obj):
-        return request.user and request.user in obj.approvers.all()
+        """
+        只查询当前用户的审批人记录，不取出节点全部审批人。
+        加载的审批上下文挂在obj.action_context上，请求事务（ATOMIC_REQUESTS）中加锁加载，随后的审批动作直接复用
+        """
+        from workflow.apps.workflow.models import NodeActionContext
+        if not request.user or not request.user.is_authenticated:
+            return False
+        context = NodeActionContext.load(obj, request.user.id, lock=transaction.get_connection().in_atomic_block)
+        return context.approver_row is not None
@@ -1,3 +1,4 @@
+from django.core.exceptions import ValidationError as DjangoValidationError
 from rest_framework import serializers
 
 
@@ -15,3 +16,29 @@ class DisplayModelSerializer(serializers.ModelSerializer):
                     label=field.label,
                     help_text=field.help_text
                 )
+
+
+class BulkManyRelatedField(serializers.ManyRelatedField):
+    """
+    many-to-many primary key list validated with a single query (ManyRelatedField looks up each pk separately).
+    usage: BulkManyRelatedField(child_relation=PrimaryKeyRelatedField(queryset=...))
+    """
+    def to_internal_value(self, data):
+        if isinstance(data, str) or not hasattr(data, '__iter__'):
+            self.fail('not_a_list', input_type=type(data).__name__)
+        if not self.allow_empty and len(data) == 0:
+            self.fail('empty')
+        child = self.child_relation
+        queryset = child.get_queryset()
+        pk_field = queryset.model._meta.pk
+        pks = []
+        for item in data:
+            try:
+                pks.append(pk_field.to_python(item))
+            except (DjangoValidationError, TypeError, ValueError):
+                child.fail('incorrect_type', data_type=type(item).__name__)
+        objects = queryset.in_bulk(set(pks))
+        for pk in pks:
+            if pk not in objects:
+                child.fail('does_not_exist', pk_value=pk)
+        return [objects[pk] for pk in pks]
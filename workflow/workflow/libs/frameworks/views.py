@@ -0,0 +1,68 @@
+import hashlib
+
+from django.http import HttpResponse
+from django.utils.cache import get_conditional_response
+from django.utils.http import http_date, quote_etag
+
+from workflow.apps.user.models import ResourceVersion
+from workflow.libs.utils.metrics_util import registry
+
+
+def metrics_view(request):
+    """Prometheus抓取接口，汇总所有uwsgi worker进程的指标，不需要登录，部署时应只对内网开放"""
+    return HttpResponse(registry.render(), content_type='text/plain; version=0.0.4; charset=utf-8')
+
+
+class NotModified(Exception):
+
+    def __init__(self, response):
+        self.response = response
+
+
+class ConditionalGetMixin(object):
+    """
+    定义类数据接口的条件GET。conditional_resources为返回内容所依赖的资源（见ResourceVersion），
+    conditional_actions中的GET请求在认证和权限校验之后、查询和序列化之前先读取资源版本，
+    If-None-Match与ETag相同或If-Modified-Since不早于最后修改时间时直接返回304。
+    ETag由资源版本号、请求路径（含查询参数）、响应格式及get_conditional_vary()共同决定，
+    读到的版本保存在conditional_versions中，视图可用作缓存key
+    """
+    conditional_resources = ()
+    conditional_actions = ('list', 'retrieve')
+
+    def get_conditional_vary(self, request):
+        """除路径和资源版本外影响返回内容的值，如按当前用户角色过滤时返回角色ID"""
+        return ''
+
+    def initial(self, request, *args, **kwargs):
+        super(ConditionalGetMixin, self).initial(request, *args, **kwargs)
+        self.conditional_etag = self.conditional_last_modified = self.conditional_versions = None
+        if request.method not in ('GET', 'HEAD') or self.action not in self.conditional_actions:
+            return
+        versions = self.conditional_versions = ResourceVersion.get_versions(self.conditional_resources)
+        key = '|'.join([
+            ','.join(f'{name}:{version}' for name, (version, _) in sorted(versions.items())),
+            request.get_full_path(),
+            request.accepted_media_type or '',
+            str(self.get_conditional_vary(request)),
+        ])
+        self.conditional_etag = quote_etag(hashlib.md5(key.encode()).hexdigest())
+        update_times = [update_time for _, update_time in versions.values() if update_time is not None]
+        if update_times:
+            self.conditional_last_modified = int(max(update_times).timestamp())
+        response = get_conditional_response(request, etag=self.conditional_etag, last_modified=self.conditional_last_modified)
+        if response is not None:
+            raise NotModified(response)
+
+    def handle_exception(self, exc):
+        if isinstance(exc, NotModified):
+            return exc.response
+        return super(ConditionalGetMixin, self).handle_exception(exc)
+
+    def finalize_response(self, request, response, *args, **kwargs):
+        response = super(ConditionalGetMixin, self).finalize_response(request, response, *args, **kwargs)
+        if getattr(self, 'conditional_etag', None) and response.status_code == 200:
+            response['ETag'] = self.conditional_etag
+            if self.conditional_last_modified is not None:
+                response['Last-Modified'] = http_date(self.conditional_last_modified)
+        return response
@@ -0,0 +1,65 @@
+import threading
+import time
+from collections import OrderedDict
+
+
+class LRUCache(object):
+    """
+    进程内的线程安全LRU缓存，可选ttl（秒）使缓存项过期。
+    uwsgi每个worker进程各持有一份，跨进程的一致性由调用方在key中带上版本号或设置较短的ttl来保证。
+    """
+    _missing = object()
+
+    def __init__(self, maxsize=128, ttl=None):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self._data = OrderedDict()  # key: (过期时间, value)
+        self._lock = threading.RLock()
+
+    def get(self, key, default=None):
+        with self._lock:
+            item = self._data.get(key, self._missing)
+            if item is self._missing:
+                return default
+            expire_at, value = item
+            if expire_at is not None and expire_at <= time.monotonic():
+                del self._data[key]
+                return default
+            self._data.move_to_end(key)
+            return value
+
+    def set(self, key, value):
+        with self._lock:
+            self._data[key] = (time.monotonic() + self.ttl if self.ttl is not None else None, value)
+            self._data.move_to_end(key)
+            while len(self._data) > self.maxsize:
+                self._data.popitem(last=False)
+
+    def get_or_set(self, key, default_func):
+        """命中则直接返回，未命中时调用default_func生成并写入缓存"""
+        value = self.get(key, self._missing)
+        if value is self._missing:
+            value = default_func()
+            self.set(key, value)
+        return value
+
+    def pop(self, key, default=None):
+        with self._lock:
+            item = self._data.pop(key, self._missing)
+            return default if item is self._missing else item[1]
+
+    def invalidate(self, predicate):
+        """删除所有predicate(key)为真的缓存项"""
+        with self._lock:
+            for key in [k for k in self._data if predicate(k)]:
+                del self._data[key]
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+
+    def __contains__(self, key):
+        return self.get(key, self._missing) is not self._missing
+
+    def __len__(self):
+        return len(self._data)
@@ -18,21 +18,37 @@ def chain_getattr(obj, *args, default=None, raise_error=False):
     return obj
 
 
-def sort_nodes_by_parent(nodes):
-    parent_map = {node['id']: node for node in nodes}
+def index_by_parent(items, parent_key='parent_id'):
+    """Group items by their parent id in a single pass, keeping the input order within each group."""
+    children_map = {}
+    for item in items:
+        children_map.setdefault(item[parent_key], []).append(item)
+    return children_map
 
-    def get_children(node_id):
-        return [node for node in nodes if node['parent_id'] == node_id]
 
-    def dfs(node_id):
-        result.append(parent_map[node_id])
-        children = get_children(node_id)
-        for child in children:
-            dfs(child['id'])
+def build_tree(items, id_key='id', parent_key='parent_id', children_key='children'):
+    """
+    Build a tree from a flat list of dicts in linear time.
+    Every item gets a `children_key` list holding its children in their input order,
+    so the caller controls sibling ordering (e.g. by rank).
+    Returns the root items, i.e. items whose parent is None.
+    """
+    children_map = index_by_parent(items, parent_key)
+    for item in items:
+        item[children_key] = children_map.get(item[id_key], [])
+    return children_map.get(None, [])
 
-    result = []
-    root_nodes = [node for node in nodes if node['parent_id'] is None]
-    for root in root_nodes:
-        dfs(root['id'])
 
+def sort_nodes_by_parent(nodes, id_key='id', parent_key='parent_id'):
+    """
+    Sort nodes so that every node is followed by its descendants
+    (depth-first pre-order, input order among siblings). Iterative, so tree depth is unlimited.
+    """
+    children_map = index_by_parent(nodes, parent_key)
+    result = []
+    stack = list(reversed(children_map.get(None, [])))
+    while stack:
+        node = stack.pop()
+        result.append(node)
+        stack.extend(reversed(children_map.get(node[id_key], [])))
     return result
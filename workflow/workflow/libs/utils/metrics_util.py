@@ -0,0 +1,220 @@
+"""
+进程内指标（Counter/Histogram）与Prometheus文本格式输出，不依赖外部服务。
+热路径只在本进程内存中累加；配置了METRICS_DIR时，各进程将自己的累计值写入METRICS_DIR/<pid>.json，两次写入至少间隔
+METRICS_FLUSH_INTERVAL秒：间隔内的更新由后台定时线程（uwsgi需enable-threads）补写，进程退出时再写一次，
+worker空闲后其他worker读到的也是完整计数。输出时汇总目录下所有进程的文件，uwsgi多个worker的计数因此可以正确合并。
+抓取时才需要计算的指标（如积压数量）通过collector注册，由输出的进程直接查询得到。
+"""
+import atexit
+import bisect
+import json
+import os
+import threading
+import time
+
+from django.conf import settings
+
+__all__ = ['Counter', 'Histogram', 'collector', 'registry']
+
+
+def _escape(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def _format_labels(labels: dict):
+    if not labels:
+        return ''
+    return '{' + ','.join(f'{name}="{_escape(value)}"' for name, value in labels.items()) + '}'
+
+
+def _format_value(value):
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+class Metric(object):
+    type = None
+
+    def __init__(self, name, documentation, labelnames=()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self.values = {}  # 标签值元组: 累计值
+        registry.register(self)
+
+    def key(self, labels: dict):
+        return tuple(str(labels[name]) for name in self.labelnames)
+
+    def merge(self, total, value):
+        raise NotImplementedError
+
+    def samples(self, values: dict):
+        """[(指标名后缀, 标签, 值)]"""
+        raise NotImplementedError
+
+
+class Counter(Metric):
+    """计数器，指标名按惯例以_total结尾"""
+    type = 'counter'
+
+    def inc(self, amount=1, **labels):
+        key = self.key(labels)
+        with registry.lock:
+            self.values[key] = self.values.get(key, 0) + amount
+            registry.dirty = True
+        registry.maybe_flush()
+
+    def merge(self, total, value):
+        return (total or 0) + value
+
+    def samples(self, values):
+        for key, value in sorted(values.items()):
+            yield '', dict(zip(self.labelnames, key)), value
+
+
+class Histogram(Metric):
+    type = 'histogram'
+    DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+
+    def __init__(self, name, documentation, labelnames=(), buckets=DEFAULT_BUCKETS):
+        self.buckets = tuple(buckets)
+        super(Histogram, self).__init__(name, documentation, labelnames)
+
+    def observe(self, value, **labels):
+        key = self.key(labels)
+        index = bisect.bisect_left(self.buckets, value)
+        with registry.lock:
+            entry = self.values.get(key)
+            if entry is None:
+                entry = self.values[key] = [0] * (len(self.buckets) + 1) + [0.0]  # 各区间（非累计）次数 + 总和
+            entry[index] += 1
+            entry[-1] += value
+            registry.dirty = True
+        registry.maybe_flush()
+
+    def merge(self, total, value):
+        return value if total is None else [a + b for a, b in zip(total, value)]
+
+    def samples(self, values):
+        for key, entry in sorted(values.items()):
+            labels = dict(zip(self.labelnames, key))
+            cumulative = 0
+            for bound, count in zip(self.buckets + ('+Inf',), entry[:-1]):
+                cumulative += count
+                yield '_bucket', dict(labels, le=str(bound)), cumulative
+            yield '_sum', labels, entry[-1]
+            yield '_count', labels, cumulative
+
+
+class Registry(object):
+
+    def __init__(self):
+        self.metrics = {}
+        self.collectors = []
+        self.lock = threading.Lock()
+        self.last_flush = 0
+        self.dirty = False  # 上次写入文件后是否有新的更新
+        self.timer = None  # (pid, 待执行的补写定时器)，fork出的worker不继承父进程的线程，按pid区分
+
+    @property
+    def directory(self):
+        return getattr(settings, 'METRICS_DIR', None)
+
+    def register(self, metric: Metric):
+        self.metrics[metric.name] = metric
+
+    def snapshot(self):
+        with self.lock:
+            return {
+                name: [[list(key), list(value) if isinstance(value, list) else value] for key, value in metric.values.items()]
+                for name, metric in self.metrics.items()
+            }
+
+    def maybe_flush(self):
+        if not self.directory:
+            return
+        delay = getattr(settings, 'METRICS_FLUSH_INTERVAL', 5) - (time.monotonic() - self.last_flush)
+        if delay <= 0:
+            self.flush()
+        else:
+            self.schedule_flush(delay)
+
+    def schedule_flush(self, delay):
+        """delay秒后补写间隔内的更新，同一进程同时只有一个定时器"""
+        pid = os.getpid()
+        with self.lock:
+            if self.timer is not None and self.timer[0] == pid:
+                return
+            timer = threading.Timer(delay, self.flush_if_dirty)
+            timer.daemon = True
+            self.timer = (pid, timer)
+        timer.start()
+
+    def flush_if_dirty(self):
+        with self.lock:
+            self.timer = None
+            dirty = self.dirty
+        if dirty:
+            self.flush()
+
+    def flush(self):
+        """将本进程的累计值写入METRICS_DIR/<pid>.json，先写临时文件再替换，读取方不会读到半个文件"""
+        self.last_flush = time.monotonic()
+        directory = self.directory
+        if not directory:
+            return
+        os.makedirs(directory, exist_ok=True)
+        path = os.path.join(directory, f'{os.getpid()}.json')
+        with self.lock:
+            self.dirty = False
+        with open(f'{path}.tmp', 'w') as f:
+            json.dump(self.snapshot(), f)
+        os.replace(f'{path}.tmp', path)
+
+    def load(self):
+        """汇总所有进程（含已退出进程）的累计值：{指标名: {标签值元组: 值}}"""
+        directory = self.directory
+        if not directory:
+            snapshots = [self.snapshot()]
+        else:
+            self.flush()
+            snapshots = []
+            for filename in os.listdir(directory):
+                if filename.endswith('.json'):
+                    try:
+                        with open(os.path.join(directory, filename)) as f:
+                            snapshots.append(json.load(f))
+                    except (OSError, ValueError):
+                        continue
+        merged = {name: {} for name in self.metrics}
+        for snapshot in snapshots:
+            for name, items in snapshot.items():
+                metric = self.metrics.get(name)
+                if metric is None:
+                    continue
+                for key, value in items:
+                    key = tuple(key)
+                    merged[name][key] = metric.merge(merged[name].get(key), value)
+        return merged
+
+    def render(self):
+        """Prometheus文本格式（text/plain; version=0.0.4）"""
+        lines = []
+        for name, values in self.load().items():
+            metric = self.metrics[name]
+            lines += [f'# HELP {name} {metric.documentation}', f'# TYPE {name} {metric.type}']
+            lines += [f'{name}{suffix}{_format_labels(labels)} {_format_value(value)}' for suffix, labels, value in metric.samples(values)]
+        for func in self.collectors:
+            for name, type_, documentation, samples in func():
+                lines += [f'# HELP {name} {documentation}', f'# TYPE {name} {type_}']
+                lines += [f'{name}{_format_labels(labels)} {_format_value(value)}' for labels, value in samples]
+        return '\n'.join(lines) + '\n'
+
+
+registry = Registry()
+atexit.register(registry.flush_if_dirty)
+
+
+def collector(func):
+    """注册抓取时计算的指标，func返回[(指标名, 类型, 说明, [(标签, 值), ...]), ...]"""
+    registry.collectors.append(func)
+    return func
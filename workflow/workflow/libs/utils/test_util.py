@@ -0,0 +1,24 @@
+from django.db import connection
+from django.test.utils import CaptureQueriesContext
+
+
+class QueryBudgetMixin(object):
+    """
+    接口SQL查询数预算。
+    测试用例以不同的scale（数据规模）各运行一次，同一接口在两种规模下须执行完全相同数量的SQL，
+    查询数随数据量增长（N+1）或超出预算时失败，并输出实际执行的SQL便于定位。
+    """
+    scale = 1
+
+    def assertQueryBudget(self, budget, method, url, data=None, status_code=None, **extra):
+        """extra为请求头等，如HTTP_IF_NONE_MATCH"""
+        with CaptureQueriesContext(connection) as context:
+            response = getattr(self.client, method)(url, data, format='json', **extra)
+        if status_code is not None:
+            self.assertEqual(response.status_code, status_code, getattr(response, 'data', None))
+        else:
+            self.assertLess(response.status_code, 400, getattr(response, 'data', None))
+        if len(context) != budget:
+            sql = '\n'.join(query['sql'] for query in context.captured_queries)
+            self.fail(f'{method.upper()} {url} 执行了{len(context)}条SQL，预算为{budget}（scale={self.scale}）：\n{sql}')
+        return response
@@ -31,6 +31,7 @@ INSTALLED_APPS = [
 ]
 
 MIDDLEWARE = [
+    'workflow.libs.frameworks.middleware.MetricsMiddleware',
     'django.middleware.security.SecurityMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'django.middleware.common.CommonMiddleware',
@@ -39,6 +40,13 @@ MIDDLEWARE = [
     'django.contrib.messages.middleware.MessageMiddleware',
     'django.middleware.clickjacking.XFrameOptionsMiddleware',
 ]
+# 请求性能分析：Server-Timing响应头+结构化日志，生产环境可通过PROFILING_SAMPLE_RATE（如0.01）只采样部分请求
+if os.getenv('ENABLE_PROFILING') == 'true':
+    MIDDLEWARE.insert(0, 'workflow.libs.frameworks.middleware.ProfilingMiddleware')
+PROFILING_SAMPLE_RATE = float(os.getenv('PROFILING_SAMPLE_RATE', 1))
+PROFILING_SLOW_QUERY_MS = int(os.getenv('PROFILING_SLOW_QUERY_MS', 100))
+# /metrics指标：多进程部署（uwsgi）时各进程定期将计数写入该目录，抓取时汇总；不设置时只统计当前进程
+METRICS_DIR = os.getenv('METRICS_DIR')
 
 ROOT_URLCONF = 'workflow.urls'
 
@@ -66,7 +74,7 @@ REST_FRAMEWORK = {
     'DEFAULT_AUTHENTICATION_CLASSES': [
         # 'rest_framework.authentication.BasicAuthentication',
         # 'rest_framework.authentication.SessionAuthentication',
-        'rest_framework.authentication.TokenAuthentication',
+        'workflow.libs.frameworks.authentication.CachedTokenAuthentication',
     ],
     'DEFAULT_FILTER_BACKENDS': [
         'django_filters.rest_framework.DjangoFilterBackend',
@@ -79,6 +87,12 @@ REST_FRAMEWORK = {
     'DEFAULT_METADATA_CLASS': 'workflow.libs.frameworks.metadata.SimpleMetadata',
 }
 
+# Token认证缓存：本进程缓存的条数和有效期（秒）；TOKEN_AUTH_SHARED_CACHE为CACHES中的别名时（如配置了redis）只使用共享缓存，
+# Token删除、用户禁用对所有进程立即生效，多进程（uwsgi多个worker）部署时须配置，否则其他进程在有效期内仍会放行
+TOKEN_AUTH_CACHE_SIZE = 10000
+TOKEN_AUTH_CACHE_TTL = int(os.getenv('TOKEN_AUTH_CACHE_TTL', 60))
+TOKEN_AUTH_SHARED_CACHE = os.getenv('TOKEN_AUTH_SHARED_CACHE')
+
 DATABASES = {
     # 'default': {
     #         'ENGINE': 'django.db.backends.sqlite3',
@@ -95,6 +109,13 @@ DATABASES = {
         'OPTIONS': {'charset': 'utf8mb4', 'init_command': 'SET sql_mode="STRICT_TRANS_TABLES"'},
     },
 }
+if os.getenv('DATABASE_ENGINE') == 'sqlite':  # 本地离线开发/压测，DATABASE_NAME为数据库文件路径
+    DATABASES['default'] = {
+        'ENGINE': 'django.db.backends.sqlite3',
+        'NAME': os.getenv('DATABASE_NAME', str(BASE_DIR / 'db.sqlite3')),
+        'ATOMIC_REQUESTS': True,
+        'OPTIONS': {'timeout': 30},  # 并发写入时等待写锁，而不是立即报database is locked
+    }
 
 AUTH_PASSWORD_VALIDATORS = [
     {
@@ -118,3 +139,14 @@ ALLOWED_HOSTS = ['*']
 
 DEFAULT_AUTO_FIELD = 'django.db.models.BigAutoField'
 AUTH_USER_MODEL = 'user.User'
+
+LOGGING = {
+    'version': 1,
+    'disable_existing_loggers': False,
+    'handlers': {
+        'console': {'class': 'logging.StreamHandler'},
+    },
+    'loggers': {
+        'workflow.profiling': {'handlers': ['console'], 'level': 'INFO', 'propagate': False},
+    },
+}
@@ -16,6 +16,8 @@ Including another URLconf
 from django.contrib import admin
 from django.urls import path, include
 
+from workflow.libs.frameworks.views import metrics_view
+
 
 api_v1 = [
     path('user/', include(('workflow.apps.user.urls', 'users'), namespace='users')),
@@ -25,4 +27,5 @@ api_v1 = [
 urlpatterns = [
     path(f'admin/', admin.site.urls),
     path(f'api/v1/', include(api_v1)),
+    path(f'metrics', metrics_view),
 ]